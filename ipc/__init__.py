@@ -1,5 +1,18 @@
 from .types import IPCError, Fd, Buffer, Bytes
-from .transport import Transport, PacketTransport, TransportError
+from .framing import PacketFraming
+from .transport import Transport, PacketTransport, StreamTransport, TcpTransport, TransportError
 from .connection import Connection, RequestHandler, NotificationHandler
 from .server import Server, ErrorHandler
-from .codecs import NativeCodec, NativeType, Codec, CodecError
+from .codecs import NativeCodec, NativeType, Codec, CodecError, InterningCodec, StringTable
+from .lazy import LazyNativeCodec, LazyList, LazyDict
+from .schema import Schema
+from .events import iter_events, iter_array, Event, EventType
+from .cache import EncodingCache
+from .compression import CompressingCodec
+from .memfd import SealedBuffer
+from .shm import ShmTransport
+from .pool import BufferPool, PooledBuffer
+from .transfer import copy_fd, request_transfer, handle_transfer, TransferResult, TransferError
+from .metrics import ConnectionStats, MethodStats, Histogram
+from .aio import AioConnection, AioServer, AioPacketTransport, ConnectionClosedError
+from .sync import SyncClient, SyncPacketTransport
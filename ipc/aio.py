@@ -0,0 +1,814 @@
+from __future__ import annotations
+import asyncio
+import json
+import os
+import socket as stdlib_socket
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple, Type, TYPE_CHECKING
+
+from ipc.framing import PacketFraming, Message, NoDataError, BATCH_BUDGET, MAX_MESSAGE_SIZE, MAX_PENDING_SIZE
+from ipc.framing import BATCH_SIZE, message_size, pack_batch, unpack_batch
+from ipc.metrics import ConnectionStats, MethodStats, encode_stats
+from ipc.pool import BufferPool
+from ipc.protocol import Flags, FEATURE_FLAGS
+from ipc.types import Buffer, Bytes, Fd, INT32_MAX, IPCError
+from ipc.utils import WrappedCounter
+
+if TYPE_CHECKING:
+    from ipc.codecs import Codec
+
+AioNotificationHandler = Callable[['AioConnection', Bytes, List[Fd]], Awaitable[None]]
+AioRequestHandler = Callable[['AioConnection', Bytes, List[Fd]], Awaitable[Tuple[Bytes, List[Fd]]]]
+AioErrorHandler = Callable[['AioConnection', Exception], Awaitable[None]]
+
+# A queued message, its future, whether it waits for a response and the time it was queued.
+_Item = Tuple[Message, asyncio.Future, bool, float]
+
+
+class ConnectionClosedError(IPCError):
+    """An AioConnection has been closed, the counterpart of trio.ClosedResourceError of Connection."""
+
+
+class AioPacketTransport(PacketFraming):
+    """
+    PacketFraming for asyncio, which is wire-compatible with the trio one.
+
+    It takes a standard socket, which is switched to non-blocking mode. Records are read and written
+    with non-blocking system calls, see PacketFraming, and if the socket is not ready, the task
+    waits for it with `loop.add_reader`/`loop.add_writer`, which both asyncio and uvloop implement
+    natively. Asyncio has no coroutines for `recvmsg`/`sendmsg` with ancillary data.
+
+    See PacketFraming for information about parameters.
+    """
+
+    socket: stdlib_socket.socket
+    _writers: Deque[asyncio.Future]
+
+    def __init__(self, socket: stdlib_socket.socket, *, max_message_size: int = MAX_MESSAGE_SIZE,
+                 max_pending_size: int = MAX_PENDING_SIZE, spill_size: Optional[int] = None,
+                 batch_budget: int = BATCH_BUDGET):
+        super().__init__(socket, max_message_size=max_message_size, max_pending_size=max_pending_size,
+                         spill_size=spill_size, batch_budget=batch_budget)
+        self.socket = socket
+        socket.setblocking(False)
+        self._writers = deque()
+
+    @classmethod
+    def create_socket(cls) -> stdlib_socket.socket:
+        """
+        Create a non-blocking standard socket suitable for this implementation.
+
+        Returns:
+            New socket.
+        """
+        socket = stdlib_socket.socket(*cls.SOCKET_TYPE)
+        socket.setblocking(False)
+        return socket
+
+    async def read(self) -> Message:
+        """
+        Read a message from a SEQPACKET socket.
+
+        See PacketTransport.read for information about returned values and raised errors.
+
+        This method yields to other tasks only if it waits for the socket or after `batch_budget`
+        messages read without waiting.
+        """
+        self._reads += 1
+        if self._reads >= self.batch_budget:
+            self._reads = 0
+            await asyncio.sleep(0)
+        return await self._read_message()
+
+    async def write(self, msg: Message) -> None:
+        """
+        Write a message to a SEQPACKET socket.
+
+        See PacketTransport.write for information about parameters and raised errors.
+
+        This method yields to other tasks only if it waits for the socket or after `batch_budget`
+        messages written without waiting.
+        """
+        self._writes += 1
+        if self._writes >= self.batch_budget:
+            self._writes = 0
+            await asyncio.sleep(0)
+        await self._write_message(msg)
+
+    async def _recvmsg_into(self, buffers: List[Buffer], ancillary_size: int) -> Tuple[int, list, int, Any]:
+        while True:
+            try:
+                return self._sock.recvmsg_into(buffers, ancillary_size)
+            except BlockingIOError:
+                self._reads = 0
+                await _wait_fd(self._sock.fileno(), False)
+
+    async def _sendmsg(self, buffers: List[Bytes], ancillary: list, flags: int) -> int:
+        while True:
+            try:
+                return self._sock.sendmsg(buffers, ancillary, flags)
+            except BlockingIOError:
+                self._writes = 0
+                await _wait_fd(self._sock.fileno(), True)
+
+    async def _acquire_writing(self) -> None:
+        # Writing is handed over to waiting tasks in turn like in PacketTransport.
+        if not self._writing:
+            self._writing = True
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._writers.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Writing was handed over before the task was cancelled.
+                self._release_writing()
+            raise
+
+    def _release_writing(self) -> None:
+        while self._writers:
+            future = self._writers.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self._writing = False
+
+
+class AioConnection:
+    """
+    A duplex client <-> server connection running on asyncio.
+
+    It is wire-compatible with Connection, which runs on trio, and handlers have the same signatures,
+    but receive the AioConnection. Feature negotiation, codecs, batch frames, concurrent writes of
+    fragmented messages and statistics work as in Connection, see its attributes. Closing the
+    connection raises ConnectionClosedError instead of trio.ClosedResourceError.
+
+    Args:
+        num: Connection number.
+        transport_factory: A callable to provide transport for this connection, e.g. AioPacketTransport.
+        request_handler: A callable to handle incoming requests. Any exception will close the connection.
+        notification_handler: A callable to handle incoming notifications. Any exception will close the connection.
+        codec: A codec to encode and decode messages or None. See `Connection.codec`.
+        max_batch_size: The maximal size of message bodies packed into a batch frame, 0 to disable batching.
+            See `Connection.max_batch_size`.
+        batch_delay: The time in seconds to wait for more messages to batch. See `Connection.batch_delay`.
+        pool: A pool of receive buffers or None. See `Connection.pool`.
+        method_key: A callable returning method names of messages or None. See `Connection.method_key`.
+    """
+
+    num: int
+    """Connection number."""
+    transport_factory: Type[AioPacketTransport]
+    """A callable to provide transport for this connection."""
+    request_handler: AioRequestHandler
+    """A callable to handle incoming requests."""
+    notification_handler: AioNotificationHandler
+    """A callable to handle incoming notifications."""
+    address: bytes = None
+    """The address of the remote endpoint or None."""
+    features: Flags = Flags.NONE
+    """Feature flags advertised to the remote endpoint with every message."""
+    peer_features: Flags = Flags.NONE
+    """Feature flags advertised by the remote endpoint."""
+    codec: Optional[Codec] = None
+    """A codec bound to this connection to encode and decode messages or None, see `Connection.codec`."""
+    max_batch_size: int
+    """The maximal size of message bodies packed into a batch frame, 0 if batching is disabled."""
+    batch_delay: float
+    """The time in seconds to wait for more messages to batch after a message is queued."""
+    pool: Optional[BufferPool] = None
+    """A pool to borrow buffers of received messages from or None, see `Connection.pool`."""
+    stats: ConnectionStats
+    """Statistics of messages, handlers and errors of this connection."""
+    method_key: Optional[Callable[[Any], str]] = None
+    """A callable returning the method name of a request or a notification or None, see `Connection.method_key`."""
+    stats_provider: Optional[Callable[[], Dict[str, Any]]] = None
+    """A callable returning statistics sent in response to `request_stats` of the remote endpoint or None."""
+    _socket: stdlib_socket.socket = None
+    _transport: AioPacketTransport = None
+    _error: Exception = None
+    _closed: bool = False
+    _stopping: asyncio.Event = None
+    _tasks: Set[asyncio.Task]
+    _requests: Dict[int, asyncio.Future]
+    _outbox: asyncio.Queue = None
+
+    def __init__(self,
+                 num: int,
+                 transport_factory: Type[AioPacketTransport],
+                 request_handler: AioRequestHandler,
+                 notification_handler: AioNotificationHandler,
+                 codec: Optional[Codec] = None,
+                 max_batch_size: int = BATCH_SIZE,
+                 batch_delay: float = 0.0,
+                 pool: Optional[BufferPool] = None,
+                 method_key: Optional[Callable[[Any], str]] = None) -> None:
+        self.num = num
+        self.transport_factory = transport_factory
+        self.request_handler = request_handler
+        self.notification_handler = notification_handler
+        self.max_batch_size = max_batch_size
+        self.batch_delay = batch_delay
+        self.pool = pool
+        self.method_key = method_key
+        self.stats = ConnectionStats()
+        if max_batch_size > 0:
+            self.features |= Flags.BATCHING
+        if codec is not None:
+            self.codec = codec.bind(self)
+        self._tasks = set()
+        self._requests = {}
+        self._counter = WrappedCounter(1, INT32_MAX)
+
+    def __repr__(self) -> str:
+        return f'AioConn#{self.num}: {self._socket}'
+
+    async def connect(self, address: bytes, *, started: Optional[asyncio.Event] = None) -> None:
+        """
+        Connect to a remote endpoint.
+
+        Typically used by client code to establish a new connection. It runs until the connection is closed.
+
+        Args:
+            address: The address to connect to.
+            started: An event set when the connection is ready to send messages.
+
+        Raises:
+            Exception: Any exception raised when connecting and sending/receiving messages.
+                       ConnectionClosedError is never raised.
+        """
+        socket = self.transport_factory.create_socket()
+        try:
+            await asyncio.get_running_loop().sock_connect(socket, address)
+        except BaseException:
+            socket.close()
+            raise
+        await self.attach(socket, address, started=started)
+
+    async def attach(self, socket: stdlib_socket.socket, address: bytes, *,
+                     started: Optional[asyncio.Event] = None) -> None:
+        """
+        Attach an already connected socket.
+
+        Typically used by server code for an accepted client connection. It runs until the connection is closed.
+
+        Args:
+            socket: The socket to attach to.
+            address: The address of the remote endpoint.
+            started: An event set when the connection is ready to send messages.
+
+        Raises:
+            Exception: Any exception raised when sending/receiving messages.
+                       ConnectionClosedError is never raised.
+        """
+        if self._stopping is not None:
+            raise RuntimeError('Already running.')
+
+        self.address = address
+        self._socket = socket
+        self._transport = self.transport_factory(socket)
+        self._transport.pool = self.pool
+        self._outbox = asyncio.Queue()
+        self._stopping = asyncio.Event()
+        if self._closed:
+            self._stopping.set()
+        self._spawn(self._read_messages())
+        self._spawn(self._write_messages())
+        if started is not None:
+            started.set()
+
+        try:
+            await self._stopping.wait()
+        finally:
+            await self._shutdown()
+
+        if self._error is not None and not isinstance(self._error, ConnectionClosedError):
+            raise self._error
+
+    def close(self) -> None:
+        """
+        Close the connection.
+
+        Stops running `connect`/`attach` tasks.
+        """
+        self._closed = True
+        if self._stopping is not None:
+            self._stopping.set()
+        elif self._socket is not None:
+            self._socket.close()
+
+    async def send(self, data: Any, fds: List[Fd] = None) -> Tuple[Any, List[Fd]]:
+        """
+        Send a request and wait for response.
+
+        Args:
+            data: Data to send or a message to encode if `codec` is set.
+            fds: File descriptors to send. If `codec` is set, they follow file descriptors
+                of the encoded message.
+
+        Returns: Response of the request.
+
+        Raises:
+            Exception: An error occurred when sending request or receiving response.
+        """
+        self._check_not_closed()
+
+        method = self._method_stats(data)
+        if method is not None:
+            method.sent += 1
+        start = time.perf_counter()
+        try:
+            response = await self._request(Flags.REQUEST.value, data, fds or [])
+        except Exception:
+            if method is not None:
+                method.errors += 1
+            raise
+        elapsed = time.perf_counter() - start
+        self.stats.round_trip.add(elapsed)
+        if method is not None:
+            method.round_trip.add(elapsed)
+        return response
+
+    async def notify(self, data: Any, fds: List[Fd] = None) -> None:
+        """
+        Send a notification.
+
+        Args:
+            data: Data to send or a message to encode if `codec` is set.
+            fds: File descriptors to send. If `codec` is set, they follow file descriptors
+                of the encoded message.
+
+        Raises:
+            Exception: An error occurred when sending the notification.
+        """
+        self._check_not_closed()
+
+        method = self._method_stats(data)
+        if method is not None:
+            method.sent += 1
+        future = asyncio.get_running_loop().create_future()
+        msg = Message(0, Flags.NOTIFICATION.value | self.features.value, data, fds or [])
+        self._outbox.put_nowait((msg, future, False, time.perf_counter()))
+        try:
+            await future
+        except Exception:
+            if method is not None:
+                method.errors += 1
+            raise
+
+    async def request_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        Request statistics of the remote endpoint, see `Connection.request_stats`.
+
+        Returns: Statistics or None if the remote endpoint does not provide them or fails to.
+
+        Raises:
+            Exception: An error occurred when sending request or receiving response.
+        """
+        self._check_not_closed()
+        data, _fds = await self._request(Flags.REQUEST.value | Flags.STATS.value, b'', [])
+        return json.loads(bytes(data))
+
+    async def _request(self, flags: int, data: Any, fds: List[Fd]) -> Tuple[Any, List[Fd]]:
+        future = asyncio.get_running_loop().create_future()
+        while True:
+            num = next(self._counter)
+            if num not in self._requests:
+                break
+
+        self._requests[num] = future
+        try:
+            msg = Message(num, flags | self.features.value, data, fds)
+            self._outbox.put_nowait((msg, future, True, time.perf_counter()))
+            return await future
+        finally:
+            del self._requests[num]
+
+    def _check_not_closed(self) -> None:
+        if self._error is not None:
+            raise self._error
+        if self._outbox is None or self._closed:
+            raise ConnectionClosedError()
+
+    def _spawn(self, coro: Awaitable[Any]) -> None:
+        # Like tasks of a trio nursery, an error of any task closes the connection and is raised by attach.
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self._set_error(task.exception())
+            self._stopping.set()
+
+    async def _read_messages(self):
+        while True:
+            try:
+                msg = await self._transport.read()
+                stats = self.stats
+                stats.frames_in += 1
+                stats.bytes_in += len(msg.data)
+                stats.fds_in += len(msg.fds)
+                if msg.flags & Flags.BATCH.value:
+                    with msg:
+                        messages = unpack_batch(msg, self.pool)
+                else:
+                    messages = [msg]
+                for msg in messages:
+                    if msg.flags & FEATURE_FLAGS.value:
+                        self.peer_features |= Flags(msg.flags & FEATURE_FLAGS.value)
+                    stats.messages_in += 1
+                    if self.codec is not None and not msg.flags & Flags.STATS.value:
+                        # Decoded values referencing the buffer keep it out of the pool.
+                        with msg:
+                            data = self.codec.decode_message(msg.data, msg.fds, msg.flags)
+                        msg = msg._replace(data=data, buffer=None)
+                    if msg.flags & Flags.RESPONSE.value:
+                        # Responses only wake up waiting tasks, so they are not dispatched by new tasks.
+                        future = self._requests.get(msg.num)
+                        if future is not None and not future.done():
+                            future.set_result((msg.data, msg.fds))
+                    else:
+                        self._spawn(self._dispatch_message(msg))
+            except Exception as e:
+                if isinstance(e, NoDataError):
+                    e = ConnectionClosedError(str(e))
+                else:
+                    self.stats.error(e)
+                self._set_error(e)
+                self._stopping.set()
+                break
+
+    async def _dispatch_message(self, msg: Message):
+        if msg.flags & Flags.REQUEST.value:
+            # The response may reference data of the request, so they are released when it is sent.
+            with msg:
+                if msg.flags & Flags.STATS.value:
+                    data, fds = encode_stats(self.stats_provider, self.stats), []
+                    flags = Flags.RESPONSE.value | Flags.STATS.value | self.features.value
+                else:
+                    data, fds = await self._handle(self.request_handler, msg)
+                    flags = Flags.RESPONSE.value | self.features.value
+                future = asyncio.get_running_loop().create_future()
+                self._outbox.put_nowait((Message(msg.num, flags, data, fds or []), future, False, time.perf_counter()))
+                await future
+        elif msg.flags & Flags.NOTIFICATION.value:
+            with msg:
+                await self._handle(self.notification_handler, msg)
+        else:
+            raise RuntimeError('Unknown message type')
+
+    async def _handle(self, handler: Callable[..., Awaitable[Any]], msg: Message) -> Any:
+        method = self._method_stats(msg.data)
+        start = time.perf_counter()
+        try:
+            return await handler(self, msg.data, msg.fds)
+        except Exception as e:
+            self.stats.error(e)
+            if method is not None:
+                method.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stats.handler.add(elapsed)
+            if method is not None:
+                method.handled += 1
+                method.handler.add(elapsed)
+
+    def _method_stats(self, data: Any) -> Optional[MethodStats]:
+        if self.method_key is None:
+            return None
+        return self.stats.method(self.method_key(data))
+
+    async def _write_messages(self):
+        while True:
+            batch = []
+            item = self._encode(await self._outbox.get())
+            if item is not None:
+                batch.append(item)
+            sent = 0
+            try:
+                if self.max_batch_size > 0 and self.peer_features & Flags.BATCHING:
+                    await self._collect_batch(batch)
+                fragment_size = self._transport.fragment_size
+                if fragment_size is not None and (self.codec is None or not self.codec.ordered):
+                    # Messages written in fragments are written by their own tasks, so that other
+                    # messages are written between fragments instead of waiting for large transfers.
+                    for item in batch:
+                        if message_size(item[0]) > fragment_size:
+                            self._spawn(self._write_message(item))
+                    batch = [item for item in batch if message_size(item[0]) <= fragment_size]
+                for msg, count in pack_batch(batch, self.max_batch_size, Flags.BATCH.value | self.features.value):
+                    self._count_written(msg, batch[sent:sent + count])
+                    await self._transport.write(msg)
+                    for _msg, future, needs_response, _queued in batch[sent:sent + count]:
+                        if not needs_response:
+                            _resolve(future)
+                    sent += count
+            except asyncio.CancelledError:
+                error = self._set_error(ConnectionClosedError())
+                for _msg, future, _needs_response, _queued in batch[sent:]:
+                    _fail(future, error)
+                raise
+            except Exception as e:
+                self.stats.error(e)
+                error = self._set_error(e)
+                for _msg, future, _needs_response, _queued in batch[sent:]:
+                    _fail(future, error)
+                self._stopping.set()
+                break
+
+    async def _write_message(self, item: _Item) -> None:
+        msg, future, needs_response, _queued = item
+        self._count_written(msg, [item])
+        try:
+            await self._transport.write(msg)
+        except asyncio.CancelledError:
+            _fail(future, self._set_error(ConnectionClosedError()))
+            raise
+        except Exception as e:
+            self.stats.error(e)
+            _fail(future, self._set_error(e))
+            self._stopping.set()
+        else:
+            if not needs_response:
+                _resolve(future)
+
+    def _count_written(self, frame: Message, items: List[_Item]) -> None:
+        stats = self.stats
+        now = time.perf_counter()
+        for _msg, _future, _needs_response, queued in items:
+            stats.queue_wait.add(now - queued)
+        stats.messages_out += len(items)
+        stats.frames_out += 1
+        stats.bytes_out += message_size(frame)
+        stats.fds_out += len(frame.fds)
+
+    async def _collect_batch(self, batch: List[_Item]) -> None:
+        # Drain queued messages until the size budget is exhausted or the delay expires.
+        loop = asyncio.get_running_loop()
+        size = sum(message_size(item[0]) for item in batch)
+        deadline = loop.time() + self.batch_delay
+        while size < self.max_batch_size:
+            try:
+                item = self._outbox.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._outbox.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            item = self._encode(item)
+            if item is not None:
+                batch.append(item)
+                size += message_size(item[0])
+
+    def _encode(self, item: _Item) -> Optional[_Item]:
+        msg, future, needs_response, queued = item
+        if self.codec is not None and not msg.flags & Flags.STATS.value:
+            # A message which cannot be encoded is not fatal for the connection.
+            # Codecs raise CodecError, a subclass of IPCError.
+            try:
+                data, fds, flags = self.codec.encode_message(msg.data)
+            except IPCError as e:
+                self.stats.error(e)
+                _fail(future, e)
+                return None
+            msg = msg._replace(flags=msg.flags | flags, data=data, fds=fds + msg.fds)
+        return msg, future, needs_response, queued
+
+    def _set_error(self, error: Exception) -> Exception:
+        if self._error is None:
+            self._error = error
+        return self._error
+
+    async def _shutdown(self) -> None:
+        error = self._set_error(ConnectionClosedError())
+        self._closed = True
+
+        # Tasks are cancelled before the socket is closed, so that none of them waits for it.
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        while not self._outbox.empty():
+            _msg, future, _needs_response, _queued = self._outbox.get_nowait()
+            _fail(future, error)
+
+        # Requests already written will never receive a response.
+        for future in self._requests.values():
+            _fail(future, error)
+
+        self._socket.close()
+
+
+class AioServer:
+    """
+    A server accepting duplex client connections running on asyncio.
+
+    It is the counterpart of Server for AioConnection, see Server for information about parameters.
+    Its error handler receives an AioConnection.
+    """
+
+    transport_factory: Type[AioPacketTransport]
+    """A callable to provide transport for client connections."""
+    request_handler: AioRequestHandler
+    """A callable to handle incoming requests. Any exception will close the connection."""
+    notification_handler: AioNotificationHandler
+    """A callable to handle incoming notifications. Any exception will close the connection."""
+    error_handler: AioErrorHandler
+    """A callable to handle errors of individual client connections. An exception terminates the server."""
+    backlog: int
+    """The number of client connections to be allowed to wait in a queue."""
+    codec: Optional[Codec]
+    """A codec to be bound to client connections or None."""
+    max_batch_size: int
+    """The maximal size of message bodies packed into a batch frame, 0 if batching is disabled."""
+    batch_delay: float
+    """The time in seconds to wait for more messages to batch."""
+    pool: Optional[BufferPool]
+    """A pool of receive buffers shared by client connections or None."""
+    method_key: Optional[Callable[[Any], str]]
+    """A callable returning method names of messages or None, see `Connection.method_key`."""
+    serve_stats: bool
+    """Whether to respond to `Connection.request_stats` of clients with `stats`."""
+    closed_stats: ConnectionStats
+    """Statistics of closed client connections."""
+    address: bytes = None
+    """Server address."""
+    connections: Dict[int, AioConnection]
+    """Client connections."""
+    _socket: stdlib_socket.socket = None
+    _closed: bool = False
+    _accepting: Optional[asyncio.Future] = None
+    _error: Optional[Exception] = None
+    _tasks: Set[asyncio.Task]
+    _counter: WrappedCounter
+
+    def __init__(self,
+                 transport_factory: Type[AioPacketTransport],
+                 request_handler: AioRequestHandler,
+                 notification_handler: AioNotificationHandler,
+                 error_handler: AioErrorHandler,
+                 backlog: int = 0,
+                 codec: Optional[Codec] = None,
+                 max_batch_size: int = BATCH_SIZE,
+                 batch_delay: float = 0.0,
+                 pool: Optional[BufferPool] = None,
+                 method_key: Optional[Callable[[Any], str]] = None,
+                 serve_stats: bool = False) -> None:
+        self.transport_factory = transport_factory
+        self.request_handler = request_handler
+        self.notification_handler = notification_handler
+        self.error_handler = error_handler
+        self.backlog = backlog
+        self.codec = codec
+        self.max_batch_size = max_batch_size
+        self.batch_delay = batch_delay
+        self.pool = pool
+        self.method_key = method_key
+        self.serve_stats = serve_stats
+        self.closed_stats = ConnectionStats()
+        self.connections = {}
+        self._tasks = set()
+        self._counter = WrappedCounter(1, INT32_MAX)
+
+    async def serve(self, address: bytes, *, started: Optional[asyncio.Event] = None) -> None:
+        """
+        Listen for client connections until the server is closed.
+
+        Args:
+            address: The address to listen on.
+            started: An event set when the server is listening.
+
+        Raises:
+            Exception: Any exception raised when binding an address or not handled with an error handler.
+        """
+        loop = asyncio.get_running_loop()
+        self.address = address
+        # Abstract sockets address starts with a zero byte.
+        # Other addresses are filesystem paths.
+        if self.address[0]:
+            # Remove dangling socket.
+            try:
+                os.unlink(self.address)
+            except FileNotFoundError:
+                pass
+
+        self._socket = server_socket = self.transport_factory.create_socket()
+        try:
+            server_socket.bind(self.address)
+            server_socket.listen(self.backlog)
+            if started is not None:
+                started.set()
+
+            while not self._closed:
+                self._accepting = asyncio.ensure_future(loop.sock_accept(server_socket))
+                try:
+                    client_socket, client_address = await self._accepting
+                except asyncio.CancelledError:
+                    # Accepting is cancelled by close, otherwise the task running the server is cancelled.
+                    if not self._closed:
+                        raise
+                    break
+                finally:
+                    self._accepting = None
+                # Addresses of Unix sockets are returned as str unless they are abstract.
+                task = asyncio.ensure_future(self._accept(client_socket, os.fsencode(client_address)))
+                self._tasks.add(task)
+                task.add_done_callback(self._task_done)
+        finally:
+            self._closed = True
+            for conn in self.connections.values():
+                conn.close()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            server_socket.close()
+
+        if self._error is not None:
+            raise self._error
+
+    async def _accept(self, socket: stdlib_socket.socket, address: bytes) -> None:
+        while True:
+            num = next(self._counter)
+            if num not in self.connections:
+                break
+
+        self.connections[num] = conn = AioConnection(
+            num, self.transport_factory, self.request_handler, self.notification_handler, self.codec,
+            self.max_batch_size, self.batch_delay, self.pool, self.method_key)
+        if self.serve_stats:
+            conn.stats_provider = self.stats
+        try:
+            await conn.attach(socket, address)
+        except Exception as e:
+            await self.error_handler(conn, e)
+        finally:
+            del self.connections[num]
+            self.closed_stats.merge(conn.stats)
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        # An error of the error handler terminates the server.
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            if self._error is None:
+                self._error = task.exception()
+            self.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of statistics of client connections, see `Server.stats`."""
+        total = ConnectionStats()
+        total.merge(self.closed_stats)
+        for conn in self.connections.values():
+            total.merge(conn.stats)
+        return {
+            'total': total.snapshot(),
+            'connections': {str(num): conn.stats.snapshot() for num, conn in self.connections.items()},
+        }
+
+    def close(self) -> None:
+        """Close the server and client connections."""
+        self._closed = True
+        if self._accepting is not None:
+            self._accepting.cancel()
+        for conn in self.connections.values():
+            conn.close()
+
+
+async def _wait_fd(fd: int, writable: bool) -> None:
+    # Wait until the file descriptor is readable or writable.
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def ready():
+        if not future.done():
+            future.set_result(None)
+
+    if writable:
+        loop.add_writer(fd, ready)
+        try:
+            await future
+        finally:
+            loop.remove_writer(fd)
+    else:
+        loop.add_reader(fd, ready)
+        try:
+            await future
+        finally:
+            loop.remove_reader(fd)
+
+
+def _resolve(future: asyncio.Future, value: Any = None) -> None:
+    # Futures of cancelled tasks are already done.
+    if not future.done():
+        future.set_result(value)
+
+
+def _fail(future: asyncio.Future, error: Exception) -> None:
+    if not future.done():
+        future.set_exception(error)
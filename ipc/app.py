@@ -1,15 +1,17 @@
 from __future__ import annotations
+import os
 from pprint import pformat
 import random
 from typing import List, Any, Optional, Tuple
 
 import trio
 
-from ipc import NativeCodec
+from ipc import InterningCodec, CompressingCodec
 from ipc import Server
 from ipc import Connection
 from ipc import PacketTransport
-from ipc import Fd, Bytes
+from ipc import Fd
+from ipc.transfer import TRANSFER, request_transfer, handle_transfer
 
 
 def run(argv: List[str]):
@@ -20,6 +22,8 @@ def run(argv: List[str]):
         trio.run(run_server, address)
     elif action == 'write':
         trio.run(run_client, address, argv[3:])
+    elif action == 'copy':
+        trio.run(run_copy, address, *argv[3:5])
     else:
         raise ValueError(f'Unknown action: {action!r}')
 
@@ -50,14 +54,23 @@ async def run_client(address, paths: List[str]):
         await client.quit()
 
 
+async def run_copy(address: bytes, src: str, dst: str):
+    client = FileWriterClient()
+
+    async with trio.open_nursery() as nursery:
+        await nursery.start(client.connect, address)
+        await client.copy(src, dst)
+        await client.quit()
+
+
 class FileWriterServer:
     def __init__(self):
         self.quit_event = trio.Event()
-        self.codec = NativeCodec()
         self.server = Server(PacketTransport,
                              self._handle_request,
                              self._handle_notification,
-                             self._handle_error)
+                             self._handle_error,
+                             codec=CompressingCodec(InterningCodec()))
 
     async def serve(self, address: bytes, *, task_status=trio.TASK_STATUS_IGNORED):
         async with trio.open_nursery() as n:
@@ -76,12 +89,11 @@ class FileWriterServer:
         self.quit_event.set()
 
     async def call(self, conn: Connection, method: str, *args: Any) -> Any:
-        data, fds = self.codec.encode([method, *args])
-        data, fds = await conn.send(data, fds)
-        return self.codec.decode(data, fds)
+        result, _fds = await conn.send([method, *args])
+        return result
 
-    async def _handle_request(self, conn: Connection, data: Bytes, fds: List[Fd]) -> Tuple[Bytes, List[Fd]]:
-        method, *args = self.codec.decode(data, fds)
+    async def _handle_request(self, conn: Connection, msg: Any, fds: List[Fd]) -> Tuple[Any, List[Fd]]:
+        method, *args = msg
         if method == "quit":
             print('Quit?')
             if await self.call(conn, 'quit?'):
@@ -99,11 +111,14 @@ class FileWriterServer:
                     result = True, written
             except Exception as e:
                 result = False, str(e)
+        elif method == TRANSFER:
+            print(f'Copying {args[2]} bytes from fd {args[0].get()} to fd {args[1].get()}.')
+            result = await handle_transfer(msg)
         else:
             result = False, 'unknown method', method
-        return self.codec.encode(result)
+        return result, []
 
-    async def _handle_notification(self, conn: Connection, data: Bytes, fds: List[Fd]) -> None:
+    async def _handle_notification(self, conn: Connection, msg: Any, fds: List[Fd]) -> None:
         raise NotImplementedError
 
     async def _handle_error(self, conn: Connection, err: Exception):
@@ -116,19 +131,19 @@ class FileWriterClient:
     _nursery: Optional[trio.Nursery] = None
 
     def __init__(self, ):
-        self.conn = Connection(0, PacketTransport, self._handle_request, self._handle_notification)
-        self.codec = NativeCodec()
+        self.conn = Connection(0, PacketTransport, self._handle_request, self._handle_notification,
+                               CompressingCodec(InterningCodec()))
         self._quit_event = None
 
-    async def _handle_request(self, _conn: Connection, data: Bytes, fds: List[Fd]) -> Tuple[Bytes, List[Fd]]:
-        method, *args = self.codec.decode(data, fds)
+    async def _handle_request(self, _conn: Connection, msg: Any, fds: List[Fd]) -> Tuple[Any, List[Fd]]:
+        method, *args = msg
         if method == "quit?":
             result = random.choice([True, False, None])
         else:
             result = None
-        return self.codec.encode(result)
+        return result, []
 
-    async def _handle_notification(self, conn: Connection, data: Bytes, fds: List[Fd]) -> None:
+    async def _handle_notification(self, conn: Connection, msg: Any, fds: List[Fd]) -> None:
         raise NotImplementedError
 
     async def connect(self, address: bytes, *, task_status=trio.TASK_STATUS_IGNORED):
@@ -157,7 +172,15 @@ class FileWriterClient:
         else:
             print(f'Error: {result}')
 
+    async def copy(self, src: str, dst: str) -> None:
+        print(f'Asking server to copy {src!r} to {dst!r}.')
+        with open(src, 'rb') as src_fh, open(dst, 'wb') as dst_fh:
+            size = os.fstat(src_fh.fileno()).st_size
+            result = await request_transfer(self.conn, Fd(src_fh.fileno(), duplicate=True),
+                                            Fd(dst_fh.fileno(), duplicate=True), size, src_offset=0, dst_offset=0)
+
+        print(f'{dst}: {result.size} bytes copied by {result.method} at {result.rate / 1e6:.1f} MB/s')
+
     async def call(self, method: str, *args: Any) -> Any:
-        data, fds = self.codec.encode([method, *args])
-        data, fds = await self.conn.send(data, fds)
-        return self.codec.decode(data, fds)
+        result, _fds = await self.conn.send([method, *args])
+        return result
@@ -0,0 +1,5 @@
+import sys
+
+from ipc.bench.app import run
+
+run(sys.argv)
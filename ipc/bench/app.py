@@ -0,0 +1,74 @@
+from __future__ import annotations
+import json
+import platform
+import sys
+from argparse import ArgumentParser
+from contextlib import redirect_stdout, nullcontext
+from typing import List, Dict, Any, Optional, Tuple
+
+from ipc.bench import schema, cache, codecs, transports, backends
+
+BENCHMARKS = {
+    'codecs': codecs.run,
+    'schema': schema.run,
+    'cache': cache.run,
+    'transports': transports.run,
+    'backends': backends.run,
+}
+"""
+Benchmarks by their names.
+
+Benchmarks print their results and may also return records of them to be stored as JSON
+and compared with a baseline.
+"""
+
+
+def run(argv: List[str]):
+    parser = ArgumentParser(prog='python3 -m ipc.bench', description='IPC benchmarks.')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help=f'Benchmarks to run: {", ".join(BENCHMARKS)}. All by default.')
+    parser.add_argument('--json', metavar='PATH', help='Store the results as JSON, "-" for stdout.')
+    parser.add_argument('--baseline', metavar='PATH', help='Compare the results with stored JSON results.')
+    args = parser.parse_args(argv[1:])
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f'Unknown benchmark: {name!r}')
+
+    # Keep stdout for JSON only.
+    with redirect_stdout(sys.stderr) if args.json == '-' else nullcontext():
+        records = []
+        for name in args.benchmarks or BENCHMARKS:
+            records += BENCHMARKS[name]() or []
+
+        if args.baseline:
+            with open(args.baseline) as f:
+                compare(records, json.load(f)['results'])
+
+    if args.json:
+        results = {
+            'python': sys.version,
+            'platform': platform.platform(),
+            'results': records,
+        }
+        if args.json == '-':
+            json.dump(results, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+
+
+def compare(records: List[Dict[str, Any]], baseline: List[Dict[str, Any]]) -> None:
+    """Print the ratio of operations per second of the records and the baseline."""
+    baseline = {_key(record): record for record in baseline}
+    print(f'\n{"benchmark":10} {"shape":14} {"version":>7} {"op":6} {"ops/s":>12} {"baseline":>12} {"ratio":>7}')
+    for record in records:
+        base: Optional[Dict[str, Any]] = baseline.get(_key(record))
+        if base is None or 'ops_per_s' not in record:
+            continue
+        print(f'{record["benchmark"]:10} {record["shape"]:14} {record["version"]:>7} {record["op"]:6} '
+              f'{record["ops_per_s"]:>12.0f} {base["ops_per_s"]:>12.0f} {record["ops_per_s"] / base["ops_per_s"]:>6.2f}x')
+
+
+def _key(record: Dict[str, Any]) -> Tuple:
+    return record.get('benchmark'), record.get('shape'), record.get('version'), record.get('op')
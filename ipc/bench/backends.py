@@ -0,0 +1,130 @@
+from __future__ import annotations
+import asyncio
+import os
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import trio
+
+from ipc.aio import AioConnection, AioServer, AioPacketTransport
+from ipc.bench.schema import _us
+from ipc.connection import Connection
+from ipc.server import Server
+from ipc.transport import PacketTransport
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+CONCURRENCY = 64
+"""The number of requests in flight in the concurrent benchmark."""
+
+
+def run(number: int = 20000) -> List[Dict[str, Any]]:
+    """Compare round trips, concurrent requests and notifications of trio and asyncio backends."""
+    backends = {'trio': _run_trio, 'asyncio': lambda *args: asyncio.run(_measure_aio(*args))}
+    if uvloop is not None:
+        backends['uvloop'] = lambda *args: uvloop.run(_measure_aio(*args))
+    else:
+        print('uvloop is not installed.')
+
+    records = []
+    print(f'{"backend":8} {"size":>6} {"round trip":>12} {"requests/s":>12} {"notify/s":>12}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in (100, 4096):
+            for name, measure in backends.items():
+                address = os.path.join(tmp, f'{name}-{size}.sock').encode()
+                round_trip, requests, notifications = measure(address, size, number)
+                print(f'{name:8} {size:>6} {_us(round_trip):>12} {requests:>12.0f} {notifications:>12.0f}')
+                for op, ops_per_s in (('rtt', 1 / round_trip), ('req', requests), ('notify', notifications)):
+                    records.append({'benchmark': 'backends', 'shape': f'{size} B', 'version': name, 'op': op,
+                                    'ops_per_s': ops_per_s})
+    return records
+
+
+async def _echo(_conn, data, fds):
+    return data, fds
+
+
+async def _sink(_conn, _data, _fds):
+    pass
+
+
+async def _error(_conn, e):
+    raise e
+
+
+def _run_trio(address: bytes, size: int, number: int):
+    return trio.run(_measure_trio, address, size, number)
+
+
+async def _measure_trio(address: bytes, size: int, number: int):
+    data = b'x' * size
+    server = Server(PacketTransport, _echo, _sink, _error)
+    conn = Connection(1, PacketTransport, _echo, _sink)
+    async with trio.open_nursery() as nursery:
+        await nursery.start(server.serve, address)
+        await nursery.start(conn.connect, address)
+
+        start = time.perf_counter()
+        for _i in range(number):
+            await conn.send(data)
+        round_trip = (time.perf_counter() - start) / number
+
+        async def send_many(count: int):
+            for _i in range(count):
+                await conn.send(data)
+
+        start = time.perf_counter()
+        async with trio.open_nursery() as senders:
+            for _i in range(CONCURRENCY):
+                senders.start_soon(send_many, number // CONCURRENCY)
+        requests = number // CONCURRENCY * CONCURRENCY / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _i in range(number):
+            await conn.notify(data)
+        await conn.send(data)  # The server has handled all notifications.
+        notifications = number / (time.perf_counter() - start)
+
+        conn.close()
+        server.close()
+    return round_trip, requests, notifications
+
+
+async def _measure_aio(address: bytes, size: int, number: int):
+    data = b'x' * size
+    server = AioServer(AioPacketTransport, _echo, _sink, _error)
+    conn = AioConnection(1, AioPacketTransport, _echo, _sink)
+    listening, connected = asyncio.Event(), asyncio.Event()
+    serving = asyncio.ensure_future(server.serve(address, started=listening))
+    await listening.wait()
+    connecting = asyncio.ensure_future(conn.connect(address, started=connected))
+    await connected.wait()
+
+    start = time.perf_counter()
+    for _i in range(number):
+        await conn.send(data)
+    round_trip = (time.perf_counter() - start) / number
+
+    async def send_many(count: int):
+        for _i in range(count):
+            await conn.send(data)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[send_many(number // CONCURRENCY) for _i in range(CONCURRENCY)])
+    requests = number // CONCURRENCY * CONCURRENCY / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _i in range(number):
+        await conn.notify(data)
+    await conn.send(data)  # The server has handled all notifications.
+    notifications = number / (time.perf_counter() - start)
+
+    conn.close()
+    await connecting
+    server.close()
+    await serving
+    return round_trip, requests, notifications
@@ -0,0 +1,22 @@
+from __future__ import annotations
+import os
+
+from ipc.bench.schema import DATA, _measure, _us
+from ipc.cache import EncodingCache
+from ipc.codecs import serialize
+from ipc.types import Fd
+
+
+def run(number: int = 10000) -> None:
+    """Compare function serialize with and without EncodingCache on FileWriter write calls."""
+    fd = Fd(os.open(os.devnull, os.O_RDONLY))
+    print(f'{"message":24} {"version":>7} {"no cache":>10} {"cache":>10} {"speedup":>8} {"hits":>8} {"misses":>8}')
+    for count in (1, 10, 100):
+        msg = ['write', fd, [DATA] * count]
+        for version in (1, 2):
+            cache = EncodingCache()
+            assert bytes(serialize(msg, version)[0]) == bytes(serialize(msg, version, cache=cache)[0])
+            plain = _measure(number, serialize, msg, version)
+            cached = _measure(number, lambda: serialize(msg, version, cache=cache))
+            print(f'{f"write call, {count} items":24} {version:>7} {_us(plain):>10} {_us(cached):>10} '
+                  f'{plain / cached:>7.2f}x {cache.hits:>8} {cache.misses:>8}')
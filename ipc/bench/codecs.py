@@ -0,0 +1,90 @@
+from __future__ import annotations
+import os
+import tracemalloc
+from timeit import Timer
+from typing import Any, Callable, Dict, List
+
+from ipc.codecs import serialize, deserialize, NativeType
+from ipc.memfd import SealedBuffer
+from ipc.types import Fd
+
+
+def _nested(depth: int) -> NativeType:
+    value: NativeType = 1
+    for i in range(depth):
+        value = [value] if i % 2 else {'key': value}
+    return value
+
+
+def shapes(fd: Fd) -> Dict[str, NativeType]:
+    """Return representative messages by their names."""
+    messages = {
+        'tiny_rpc': ['write', 123, True],
+        'wide_dict': {f'key{i}': i for i in range(1000)},
+        'deep_nesting': _nested(200),
+        'large_bytes': os.urandom(1024 * 1024),
+        'many_strings': [f'string number {i}' for i in range(1000)],
+        'fd_heavy': [fd] * 100,
+        'int_list': list(range(10000)),
+        'float_list': [i / 3 for i in range(10000)],
+    }
+    try:
+        buffer = SealedBuffer.from_bytes(os.urandom(1024))
+        messages['sealed_buffer'] = [buffer, [f'string number {i}' for i in range(100)]]
+    except OSError:
+        pass  # Sealed memfds are Linux-only.
+    return messages
+
+
+def run() -> List[Dict[str, Any]]:
+    """
+    Measure functions serialize and deserialize with messages of various shapes.
+
+    Each message is encoded and decoded with both versions of the wire format. The speed is reported
+    as operations per second and bytes of encoded data per second. CPython does not count allocations,
+    so the peak memory allocated by a single operation is reported instead, as traced by tracemalloc.
+
+    Returns:
+        Records of the results.
+    """
+    fd = Fd(os.open(os.devnull, os.O_RDONLY))
+    records = []
+    print(f'{"shape":14} {"version":>7} {"op":6} {"size":>10} {"ops/s":>12} {"MB/s":>10} {"peak KiB":>10}')
+    for shape, msg in shapes(fd).items():
+        for version in (1, 2):
+            data, fds = serialize(msg, version)
+            data = bytes(data)
+            for op, func, args in (('encode', serialize, (msg, version)), ('decode', deserialize, (data, fds))):
+                ops = _ops_per_second(func, *args)
+                record = {
+                    'benchmark': 'codecs',
+                    'shape': shape,
+                    'version': version,
+                    'op': op,
+                    'size': len(data),
+                    'ops_per_s': ops,
+                    'bytes_per_s': ops * len(data),
+                    'peak_bytes': _peak_bytes(func, *args),
+                }
+                records.append(record)
+                print(f'{shape:14} {version:>7} {op:6} {len(data):>10} {ops:>12.0f} '
+                      f'{record["bytes_per_s"] / 1e6:>10.1f} {record["peak_bytes"] / 1024:>10.1f}')
+    return records
+
+
+def _ops_per_second(func: Callable, *args: Any) -> float:
+    """Return the best number of calls per second of three runs of at least 0.2 s."""
+    timer = Timer(lambda: func(*args))
+    number, _time = timer.autorange()
+    return number / min(timer.repeat(repeat=3, number=number))
+
+
+def _peak_bytes(func: Callable, *args: Any) -> int:
+    """Return the peak memory allocated by a call in bytes."""
+    func(*args)
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,55 @@
+from __future__ import annotations
+import os
+from timeit import timeit
+from typing import Any, Callable
+
+from ipc.codecs import serialize, deserialize, NativeType
+from ipc.schema import Schema
+from ipc.types import Fd
+
+WriteCall = Schema('WriteCall', {'method': str, 'fd': Fd, 'content': NativeType})
+"""The `write` call of FileWriterClient."""
+WriteResult = Schema('WriteResult', {'ok': bool, 'written': int})
+"""The result of the `write` call."""
+QuitCall = Schema('QuitCall', {'method': str})
+"""The `quit` call of FileWriterClient."""
+
+DATA = {
+    "string": True,
+    b"binary": False,
+    'int': 123,
+    'double': 3.14,
+    'array': [False, True, None, 123, 3.14, 'hello', b'world']
+}
+"""The data sent by FileWriterClient."""
+
+
+def run(number: int = 100000) -> None:
+    """Compare schema codecs with functions serialize and deserialize on FileWriter messages."""
+    fd = Fd(os.open(os.devnull, os.O_RDONLY))
+    messages = [
+        ('write call', WriteCall, ('write', fd, [DATA])),
+        ('write call, no content', WriteCall, ('write', fd, None)),
+        ('write result', WriteResult, (True, 1234)),
+        ('quit call', QuitCall, ('quit',)),
+    ]
+
+    print(f'{"message":24} {"serialize":>10} {"schema":>10} {"speedup":>8} {"deserialize":>12} {"schema":>10} {"speedup":>8}')
+    for name, schema, msg in messages:
+        data, fds = schema.encode(msg)
+        assert bytes(data) == bytes(serialize(msg)[0])
+        assert list(schema.decode(data, fds)) == deserialize(data, fds)
+
+        encode = _measure(number, serialize, msg), _measure(number, schema.encode, msg)
+        decode = _measure(number, deserialize, data, fds), _measure(number, schema.decode, data, fds)
+        print(f'{name:24} {_us(encode[0]):>10} {_us(encode[1]):>10} {encode[0] / encode[1]:>7.2f}x '
+              f'{_us(decode[0]):>12} {_us(decode[1]):>10} {decode[0] / decode[1]:>7.2f}x')
+
+
+def _measure(number: int, func: Callable, *args: Any) -> float:
+    """Return the best time of a call in seconds."""
+    return min(timeit(lambda: func(*args), number=number) for _i in range(3)) / number
+
+
+def _us(seconds: float) -> str:
+    return f'{seconds * 1e6:.2f} µs'
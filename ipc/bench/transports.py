@@ -0,0 +1,74 @@
+from __future__ import annotations
+import socket
+import time
+from functools import partial
+from typing import Tuple, Type
+
+import trio
+import trio.socket
+
+from ipc.bench.schema import _us
+from ipc.shm import ShmTransport
+from ipc.transport import Transport, PacketTransport, StreamTransport, TcpTransport, Message, SocketType, BATCH_BUDGET
+
+
+def run(number: int = 20000) -> None:
+    """Compare round trips and streaming of messages over transports."""
+    print(f'{"transport":16} {"size":>6} {"round trip":>12} {"stream msg/s":>14}')
+    for size in (100, 4096, 65536):
+        for transport in (PacketTransport, ShmTransport, StreamTransport, TcpTransport):
+            round_trip, stream = trio.run(_measure, transport, size, number)
+            print(f'{transport.__name__:16} {size:>6} {_us(round_trip):>12} {stream:>14.0f}')
+
+    # A budget of one message yields to other tasks for each message like trio sockets.
+    print(f'\n{"transport":16} {"size":>6} {"budget":>6} {"round trip":>12} {"stream msg/s":>14}')
+    for size in (100, 4096):
+        for budget in (1, 8, BATCH_BUDGET):
+            round_trip, stream = trio.run(partial(_measure, PacketTransport, size, number, batch_budget=budget))
+            print(f'{"PacketTransport":16} {size:>6} {budget:>6} {_us(round_trip):>12} {stream:>14.0f}')
+
+
+async def _measure(transport: Type[Transport], size: int, number: int, **kwargs):
+    a, b = await _connect(transport)
+    client, server = transport(a, **kwargs), transport(b, **kwargs)
+    msg = Message(1, 0, b'x' * size, [])
+
+    async def echo():
+        for _i in range(number):
+            await server.write(await server.read())
+
+    start = time.perf_counter()
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(echo)
+        for _i in range(number):
+            await client.write(msg)
+            await client.read()
+    round_trip = (time.perf_counter() - start) / number
+
+    async def sink():
+        for _i in range(number):
+            await server.read()
+
+    start = time.perf_counter()
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(sink)
+        for _i in range(number):
+            await client.write(msg)
+    stream = number / (time.perf_counter() - start)
+
+    a.close()
+    b.close()
+    return round_trip, stream
+
+
+async def _connect(transport: Type[Transport]) -> Tuple[SocketType, SocketType]:
+    if transport.SOCKET_TYPE[0] == socket.AF_UNIX:
+        return trio.socket.socketpair(*transport.SOCKET_TYPE)
+    # Loopback TCP connection.
+    with transport.create_socket() as listener:
+        await listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        client = transport.create_socket()
+        await client.connect(listener.getsockname())
+        server, _address = await listener.accept()
+    return client, server
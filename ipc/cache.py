@@ -0,0 +1,137 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple, Union
+
+from ipc.codecs import _plan, _plan_v2, _pack
+
+CacheKey = Callable[[Any], Optional[Hashable]]
+"""A callable returning a key of an array or a dictionary to cache its encoded data, or None not to cache it."""
+
+
+class EncodingCache:
+    """
+    A cache of encoded data of repeated arrays and dictionaries for function serialize.
+
+    Encoded data of an array or a dictionary are cached when the same container is encoded the second
+    time, and are spliced into encoded messages afterwards without encoding the container again.
+    Containers holding file descriptors are never cached, because their encoding depends on the message.
+
+    By default, containers are identified by their identity, and the cache holds references to them.
+    Such containers must not be modified while they are cached, otherwise stale data are sent. Use
+    a key function, e.g. returning a frozen copy or a version of a container, to identify containers
+    by their value instead. The least recently used entries are evicted when the number of entries
+    or the total size of encoded data reaches a limit.
+
+    Args:
+        max_entries: The maximal number of cached containers.
+        max_bytes: The maximal total size of cached data in bytes.
+        key: A function to identify containers. See CacheKey.
+    """
+
+    max_entries: int
+    """The maximal number of cached containers."""
+    max_bytes: int
+    """The maximal total size of cached data in bytes."""
+    key: Optional[CacheKey]
+    """A function to identify containers or None to identify them by their identity."""
+    size: int = 0
+    """The total size of cached data in bytes."""
+    hits: int = 0
+    """The number of containers whose encoded data have been found in the cache."""
+    misses: int = 0
+    """The number of containers whose encoded data have not been found in the cache."""
+    _entries: OrderedDict[Hashable, Tuple[Any, bytes]]
+    _seen: OrderedDict[Hashable, Tuple[Any, bool]]
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024,
+                 key: Optional[CacheKey] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.key = key
+        self._entries = OrderedDict()
+        self._seen = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        """Remove all entries and reset counters."""
+        self._entries.clear()
+        self._seen.clear()
+        self.size = self.hits = self.misses = 0
+
+    def encode(self, value: Union[list, tuple, dict], version: int, pack: Optional[int],
+               memfd: Optional[int] = None) -> Optional[bytes]:
+        """
+        Return encoded data of a container if it is cached or has been seen before.
+
+        Args:
+            value: An array or a dictionary to encode.
+            version: The version of the wire format.
+            pack: See `pack_sequences` of function serialize.
+            memfd: See `memfd_size` of function serialize.
+
+        Returns:
+            Encoded data of the container or None if the container is to be encoded as usual.
+
+        Raises:
+            EncoderError: On failure.
+        """
+        if self.key is None:
+            key = (id(value), version, pack)
+        else:
+            key = self.key(value)
+            if key is None:
+                return None
+            key = (key, version, pack)
+
+        entries = self._entries
+        entry = entries.get(key)
+        if entry is not None and (self.key is not None or entry[0] is value):
+            entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        seen = self._seen
+        ref = value if self.key is None else None
+        state = seen.get(key)
+        # The identity of a container which has been garbage collected may be reused.
+        if state is None or state[0] is not ref:
+            seen[key] = (ref, False)
+            if len(seen) > self.max_entries:
+                seen.popitem(last=False)
+            return None
+        if state[1]:
+            seen.move_to_end(key)
+            return None
+
+        fds = []
+        if version == 2:
+            fmt, args, views = _plan_v2(value, fds, pack, memfd=memfd)
+            # The magic byte of version 2 is only at the start of a message.
+            del fmt[0]
+            del args[0]
+            views = [(fmt_index - 1, args_index - 1, view) for fmt_index, args_index, view in views]
+        else:
+            fmt, args, views = _plan(value, fds, pack, memfd=memfd)
+        if fds:
+            # Indexes of file descriptors depend on the message, so the container is never cached.
+            # Memfds are created for each message too.
+            seen[key] = (ref, True)
+            return None
+
+        del seen[key]
+        data = bytes(_pack(fmt, args, views))
+        if len(data) <= self.max_bytes:
+            if entry is not None:
+                self._remove(key)
+            entries[key] = (ref, data)
+            self.size += len(data)
+            while len(entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(entries)))
+        return data
+
+    def _remove(self, key: Hashable) -> None:
+        _value, data = self._entries.pop(key)
+        self.size -= len(data)
@@ -1,15 +1,30 @@
 from __future__ import annotations
+import array
 import struct
 from abc import ABC, abstractmethod
 from collections import OrderedDict
 from enum import unique, IntEnum
-from typing import Union, List, Dict, Tuple, cast, TypeVar, Generic
+from copy import copy
+from itertools import chain
+import sys
+from typing import Union, List, Dict, Tuple, TypeVar, Generic, Any, Iterator, Optional, TYPE_CHECKING
 
+from ipc.convert import varint_to_bytes, varint_from_bytes, zigzag_encode
+from ipc.memfd import SealedBuffer, map_sealed
+from ipc.protocol import Flags, Peer
 from ipc.types import Fd, Bytes, IPCError
-from ipc.convert import int32_to_bytes, int64_to_bytes, int_from_bytes, float_to_bytes, float_from_bytes
+
+if TYPE_CHECKING:
+    from ipc.cache import EncodingCache
+
+try:
+    from numpy import ndarray
+except ImportError:
+    # NumPy is optional, array.array is always supported.
+    ndarray = None
 
 NativeType = Union[
-    None, bool, int, float, str, bytes, bytearray, memoryview, Fd,
+    None, bool, int, float, str, bytes, bytearray, memoryview, Fd, array.array, SealedBuffer,
     Dict['NativeType', 'NativeType'], List['NativeType'], Tuple['NativeType', ...]]
 
 T = TypeVar('T')
@@ -30,6 +45,66 @@ class Markers(IntEnum):
     DICT_START = 9
     DICT_END = 10
     FD = 11
+    TYPED_ARRAY = 12
+    STRING_DEFINE = 13
+    STRING_REF = 14
+    MEMFD = 15
+
+
+_FALSE = Markers.FALSE.value
+_TRUE = Markers.TRUE.value
+_NONE = Markers.NONE.value
+_INT64 = Markers.INT64.value
+_DOUBLE = Markers.DOUBLE.value
+_STRING = Markers.STRING.value
+_BYTES = Markers.BYTES.value
+_ARRAY_START = Markers.ARRAY_START.value
+_ARRAY_END = Markers.ARRAY_END.value
+_DICT_START = Markers.DICT_START.value
+_DICT_END = Markers.DICT_END.value
+_FD = Markers.FD.value
+_TYPED_ARRAY = Markers.TYPED_ARRAY.value
+_STRING_DEFINE = Markers.STRING_DEFINE.value
+_STRING_REF = Markers.STRING_REF.value
+_MEMFD = Markers.MEMFD.value
+
+_UINT32 = struct.Struct('=I')
+_UINT64 = struct.Struct('=Q')
+_FLOAT64 = struct.Struct('=d')
+_NO_KEY = object()
+
+VERSION_2_MAGIC = 0xC2
+"""
+The first byte of messages encoded with version 2 of NativeCodec.
+
+The first byte of version 1 messages is always a marker lesser than 0x20 or zero on big endian.
+"""
+
+# Version 2 uses one-byte markers. Markers lesser than 0x20 have the same meaning as in version 1,
+# but INT64 is followed by a zigzag varint and STRING, BYTES and FD are followed by a varint.
+# STRING_DEFINE and STRING_REF are followed by a varint id of an interned string, STRING_DEFINE
+# is then followed by the string like STRING. They are valid only in messages of InterningCodec.
+# MEMFD is followed by a varint index of a file descriptor and a varint size.
+# Markers from the following ranges hold small values directly.
+_V2_FIXINT = 0x20
+"""Markers 0x20-0x3F hold integers 0-31."""
+_V2_FIXSTR = 0x40
+"""Markers 0x40-0x7F are followed by a string of 0-63 bytes."""
+_V2_FIXBYTES = 0x80
+"""Markers 0x80-0xBF are followed by binary data of 0-63 bytes."""
+_V2_FIXREF = 0xC0
+"""Markers 0xC0-0xFF refer to interned strings 0-63, see InterningCodec."""
+_V2_INT_MIN = -(1 << 63)
+_V2_INT_MAX = (1 << 64) - 1
+TYPECODES = 'bBhHiIlLqQfd?'
+"""Struct format characters of items of typed arrays, always in native byte order."""
+_TYPED_ARRAYS = (array.array,) if ndarray is None else (array.array, ndarray)
+_MAX_NDIM = 64
+
+SEGMENT_SIZE = 64 * 1024
+"""The default minimal size of binary data to be referenced in place instead of copied, see serialize."""
+_MIN_VIEW_SIZE = 4096
+"""The minimal size of bytes to be referenced like memoryviews while planning."""
 
 
 class CodecError(IPCError):
@@ -47,6 +122,13 @@ class DecoderError(CodecError):
 class Codec(Generic[T], ABC):
     """A codec encodes a message to bytes and decodes bytes to a message."""
 
+    ordered: bool = False
+    """
+    Whether messages must be decoded in the order they have been encoded.
+
+    Connection otherwise writes large messages concurrently with other messages.
+    """
+
     @abstractmethod
     def encode(self, msg: T) -> Tuple[Bytes, List[Fd]]:
         """
@@ -85,21 +167,140 @@ class Codec(Generic[T], ABC):
         """
         raise NotImplementedError
 
+    def encode_message(self, msg: T) -> Tuple[Union[Bytes, List[Bytes]], List[Fd], int]:
+        """
+        Encode a message as the body of a message of a connection.
+
+        Codecs may set flags of the message, e.g. to describe the encoding of the body.
+        The default implementation calls `encode` and sets no flags.
+
+        Args:
+            msg: A message to encode.
+
+        Returns:
+            A tuple (data, fds, flags) where data are encoded data, fds are file descriptors
+            to send along with the data and flags are Flags values to be set on the message.
+
+        Raises:
+            EncoderError: On failure.
+        """
+        data, fds = self.encode(msg)
+        return data, fds, 0
+
+    def decode_message(self, data: Bytes, fds: List[Fd], flags: int) -> T:
+        """
+        Decode a message from the body of a message of a connection.
+
+        The default implementation calls `decode`.
+
+        Args:
+            data: Data to deserialize.
+            fds: File descriptors to attach to decoded message.
+            flags: Flags of the message.
+
+        Returns:
+             Decoded message.
+
+        Raises:
+            DecoderError: On failure.
+        """
+        return self.decode(data, fds)
+
+    def bind(self, conn: Peer) -> Codec[T]:
+        """
+        Return a codec to encode/decode messages of the given connection.
+
+        Codecs may use it to negotiate features with the remote endpoint.
+        The default implementation returns the codec itself.
+
+        Args:
+            conn: The connection to bind to.
+
+        Returns:
+            A codec for the connection.
+        """
+        return self
+
 
 class NativeCodec(Codec[NativeType]):
     """
     Native coded supports messages consisting of a subset of native Python types.
 
     See NativeType for supported types.
+
+    Version 1 of the wire format uses 32bit markers and fixed-width values. Version 2 starts with
+    `VERSION_2_MAGIC` byte and uses one-byte markers, variable-length integers and short size
+    prefixes. Messages of both versions are always decoded.
+
+    Args:
+        version: The version of the wire format to encode messages with.
+        connection: The connection to negotiate the version with, see `bind`.
+        pack_sequences: The minimal length of lists and tuples of ints or floats to encode
+            as typed arrays, None to disable packing. See function serialize.
+        segment_size: The minimal size of binary data to be sent from its own buffer, None to encode
+            messages into a single buffer. See function serialize.
+        cache: A cache of encoded arrays and dictionaries or None. See function serialize.
+        memfd_size: The minimal size of binary data to be sent in a sealed memfd, None to send
+            data inline. See function serialize.
     """
 
+    version: int
+    """The version of the wire format to encode messages with."""
+    connection: Optional[Peer]
+    """The connection to negotiate the version with or None."""
+    pack_sequences: Optional[int]
+    """The minimal length of lists and tuples of ints or floats to encode as typed arrays or None."""
+    segment_size: Optional[int]
+    """The minimal size of binary data to be sent from its own buffer or None."""
+    cache: Optional[EncodingCache]
+    """A cache of encoded arrays and dictionaries or None."""
+    memfd_size: Optional[int]
+    """The minimal size of binary data to be sent in a sealed memfd or None."""
+
+    def __init__(self, version: int = 1, connection: Optional[Peer] = None, *,
+                 pack_sequences: Optional[int] = None, segment_size: Optional[int] = None,
+                 cache: Optional[EncodingCache] = None, memfd_size: Optional[int] = None):
+        if version not in (1, 2):
+            raise ValueError(f'Unsupported version: {version}.')
+        self.version = version
+        self.connection = connection
+        self.pack_sequences = pack_sequences
+        self.segment_size = segment_size
+        self.cache = cache
+        self.memfd_size = memfd_size
+
+    def bind(self, conn: Peer) -> NativeCodec:
+        """
+        Return a codec negotiating the version of the wire format with the given connection.
+
+        If the version is 2, the connection advertises that it accepts version 2, and messages are
+        encoded with version 2 only after the remote endpoint has advertised the same. Otherwise,
+        version 1 is used, so that older peers keep working.
+
+        Args:
+            conn: The connection to bind to.
+
+        Returns:
+            A codec for the connection.
+        """
+        if self.version < 2:
+            return self
+        conn.features |= Flags.CODEC_V2
+        codec = copy(self)
+        codec.connection = conn
+        return codec
+
     def encode(self, msg: NativeType) -> Tuple[Bytes, List[Fd]]:
         """
         Encode a message consisting of a subset of native Python types.
 
         See function serialize for details.
         """
-        return serialize(msg)
+        version = self.version
+        if version > 1 and self.connection is not None and not self.connection.peer_features & Flags.CODEC_V2:
+            version = 1
+        return serialize(msg, version, pack_sequences=self.pack_sequences, segment_size=self.segment_size,
+                         cache=self.cache, memfd_size=self.memfd_size)
 
     def decode(self, data: Bytes, fds: List[Fd]) -> NativeType:
         """
@@ -110,79 +311,759 @@ class NativeCodec(Codec[NativeType]):
         return deserialize(data, fds)
 
 
-def serialize(value: NativeType) -> Tuple[bytearray, List[Fd]]:
+class StringTable:
+    """
+    A bounded table of interned strings of one direction of a connection.
+
+    The encoding side assigns ids to strings with `intern` and evicts the least recently used string
+    when the table is full, reusing its id. The decoding side learns the same ids from definitions
+    in the order of messages with `define` and looks them up with `get`.
+
+    Args:
+        max_entries: The maximal number of interned strings.
+        max_length: The maximal length of interned strings.
+        min_length: The minimal length of interned strings.
+    """
+
+    max_entries: int
+    """The maximal number of interned strings. Both endpoints must use the same value."""
+    max_length: int
+    """The maximal length of interned strings."""
+    min_length: int
+    """The minimal length of interned strings. Shorter strings are cheaper to send in full."""
+    ids: OrderedDict[str, int]
+    """Ids of interned strings from the least to the most recently used, for encoding."""
+    values: List[str]
+    """Interned strings indexed by their ids, for decoding."""
+    _journal: List[Tuple[str, int, Optional[str]]]
+
+    def __init__(self, max_entries: int = 256, max_length: int = 64, min_length: int = 2):
+        if max_entries < 1:
+            raise ValueError(f'The table must hold at least one string: {max_entries}.')
+        self.max_entries = max_entries
+        self.max_length = max_length
+        self.min_length = min_length
+        self.ids = OrderedDict()
+        self.values = []
+        self._journal = []
+
+    def intern(self, value: str) -> Tuple[Optional[int], bool]:
+        """
+        Look up or assign an id of a string to encode.
+
+        New ids are recorded until `commit` or `rollback` is called.
+
+        Args:
+            value: The string to intern.
+
+        Returns:
+            A tuple (id, new) where id is the id of the string or None if the string is not interned
+            and new is True if the id has been just assigned and the string must be defined.
+        """
+        if not self.min_length <= len(value) <= self.max_length:
+            return None, False
+        ids = self.ids
+        index = ids.get(value)
+        if index is not None:
+            ids.move_to_end(value)
+            return index, False
+
+        if len(ids) < self.max_entries:
+            evicted = None
+            index = len(ids)
+        else:
+            evicted, index = ids.popitem(last=False)
+        ids[value] = index
+        self._journal.append((value, index, evicted))
+        return index, True
+
+    def commit(self) -> None:
+        """Keep ids assigned since the last commit, because the message has been encoded."""
+        self._journal.clear()
+
+    def rollback(self) -> None:
+        """Forget ids assigned since the last commit, because the message has not been encoded."""
+        ids = self.ids
+        for value, index, evicted in reversed(self._journal):
+            del ids[value]
+            if evicted is not None:
+                ids[evicted] = index
+        self._journal.clear()
+
+    def define(self, index: int, value: str) -> None:
+        """
+        Define a decoded string.
+
+        Args:
+            index: The id of the string.
+            value: The string.
+
+        Raises:
+            DecoderError: If the id is out of range.
+        """
+        values = self.values
+        if index < len(values):
+            values[index] = value
+        elif index == len(values) and index < self.max_entries:
+            values.append(value)
+        else:
+            raise DecoderError(f'Interned string id out of range: {index}.')
+
+    def get(self, index: int) -> str:
+        """
+        Get a decoded string.
+
+        Args:
+            index: The id of the string.
+
+        Returns:
+            The string.
+
+        Raises:
+            DecoderError: If the id has not been defined.
+        """
+        try:
+            return self.values[index]
+        except IndexError:
+            raise DecoderError(f'Interned string id not defined: {index}.')
+
+
+class InterningCodec(NativeCodec):
+    """
+    A stateful variant of NativeCodec, which sends repeated strings as small ids.
+
+    The first occurrence of a string, such as a dictionary key or a method name, is sent in full
+    with an id, and later messages send only the id. The tables of strings are bound to a connection,
+    so the codec must be set as `Connection.codec`, which encodes and decodes messages in the order
+    they are written and read. A message which fails to be decoded leaves the tables inconsistent
+    and closes the connection.
+
+    The codec always uses version 2 of the wire format. Interning is used only after the remote
+    endpoint has advertised it, otherwise the codec behaves like NativeCodec.
+
+    Args:
+        connection: The connection to bind to, see `bind`.
+        max_entries: The maximal number of interned strings per direction, see StringTable.
+        max_length: The maximal length of interned strings.
+        pack_sequences: See NativeCodec.
+        segment_size: See NativeCodec.
+        memfd_size: See NativeCodec.
+    """
+
+    ordered = True
+    max_entries: int
+    """The maximal number of interned strings per direction."""
+    max_length: int
+    """The maximal length of interned strings."""
+    outgoing: Optional[StringTable] = None
+    """The table of strings of encoded messages or None if the codec is not bound."""
+    incoming: Optional[StringTable] = None
+    """The table of strings of decoded messages or None if the codec is not bound."""
+
+    def __init__(self, connection: Optional[Peer] = None, *, max_entries: int = 256,
+                 max_length: int = 64, pack_sequences: Optional[int] = None,
+                 segment_size: Optional[int] = None, memfd_size: Optional[int] = None):
+        super().__init__(2, connection, pack_sequences=pack_sequences, segment_size=segment_size,
+                         memfd_size=memfd_size)
+        self.max_entries = max_entries
+        self.max_length = max_length
+        if connection is not None:
+            self.outgoing = StringTable(max_entries, max_length)
+            self.incoming = StringTable(max_entries, max_length)
+
+    def bind(self, conn: Peer) -> InterningCodec:
+        """
+        Return a codec with new tables of strings for the given connection.
+
+        The connection advertises that it accepts version 2 and interned strings.
+
+        Args:
+            conn: The connection to bind to.
+
+        Returns:
+            A codec for the connection.
+        """
+        conn.features |= Flags.CODEC_V2 | Flags.CODEC_INTERNING
+        return InterningCodec(conn, max_entries=self.max_entries, max_length=self.max_length,
+                              pack_sequences=self.pack_sequences, segment_size=self.segment_size,
+                              memfd_size=self.memfd_size)
+
+    def encode(self, msg: NativeType) -> Tuple[Bytes, List[Fd]]:
+        """
+        Encode a message interning strings if the remote endpoint accepts it.
+
+        See function serialize for details.
+        """
+        conn = self.connection
+        if conn is None or self.outgoing is None:
+            raise EncoderError('InterningCodec must be bound to a connection.')
+        if not conn.peer_features & Flags.CODEC_INTERNING:
+            return super().encode(msg)
+        return serialize(msg, 2, pack_sequences=self.pack_sequences, segment_size=self.segment_size,
+                         strings=self.outgoing, memfd_size=self.memfd_size)
+
+    def decode(self, data: Bytes, fds: List[Fd]) -> NativeType:
+        """
+        Decode a message with interned strings.
+
+        See function deserialize for details.
+        """
+        if self.incoming is None:
+            raise DecoderError('InterningCodec must be bound to a connection.')
+        return deserialize(data, fds, strings=self.incoming)
+
+
+def serialize(value: NativeType, version: int = 1, *,
+              pack_sequences: Optional[int] = None,
+              segment_size: Optional[int] = None,
+              strings: Optional[StringTable] = None,
+              cache: Optional[EncodingCache] = None,
+              memfd_size: Optional[int] = None) -> Tuple[Union[bytearray, List[Bytes]], List[Fd]]:
     """
     Serialize a subset of native Python types.
 
-    See NativeType for supported types.
+    See NativeType for supported types. Integers must be in range 0 to 2^64-1 for version 1
+    and -2^63 to 2^64-1 for version 2.
+
+    Instances of `array.array` and NumPy arrays are encoded as typed arrays holding the type
+    code of items, the shape and the raw data, see TYPECODES for supported types. Typed arrays
+    are decoded as read-only memoryviews of the same type code and shape, which reference
+    the decoded data. Use `numpy.asarray` to get a NumPy array without copying the data.
+    Lists and tuples of ints or floats can be optionally packed as typed arrays too.
+
+    The value is first flattened without recursion into a struct format and a list of arguments,
+    then the size of the encoded data is computed and all markers and values are packed into
+    a single preallocated buffer in one pass. Large binary data are joined with the packed values
+    instead, so that they are copied only once.
+
+    If segment_size is set, binary data of at least that size (bytes and bytearray of at least 4 KiB,
+    memoryviews and contiguous typed arrays) are not copied. The data are returned as a list of
+    segments instead, in which markers and small values are packed into slices of one small buffer
+    and large binary data are referenced in place. The segments can be sent with a single
+    `sendmsg` call, see Transport.write. The referenced buffers must not be modified until sent.
+
+    If memfd_size is set, binary data of at least that size (bytes, bytearray and memoryviews) are copied
+    into a sealed memfd, which is sent as a file descriptor instead of the data. Instances of SealedBuffer
+    are always sent that way without copying. The receiver maps the memfd as a read-only memoryview,
+    so large buffers avoid the size limit and copies of the socket. Sealed memfds are Linux-only.
 
     Args:
         value: Data to serialize.
+        version: The version of the wire format, see NativeCodec.
+        pack_sequences: The minimal length of lists and tuples consisting only of ints
+            in the int64 range or only of floats to encode them as typed arrays.
+            None disables packing.
+        segment_size: The minimal size of binary data to be referenced in place, e.g. SEGMENT_SIZE.
+            None to return a single buffer.
+        strings: A table to intern strings in, see InterningCodec. Requires version 2.
+        cache: A cache to reuse encoded data of repeated arrays and dictionaries, see EncodingCache.
+            It is not used together with strings, because interned strings depend on the state
+            of a connection.
+        memfd_size: The minimal size of binary data to be sent in a sealed memfd. None to send data inline.
 
     Returns:
-        A tuple (data, fds) where data are serialized data and fds are file descriptors
-        to send along with the data.
+        A tuple (data, fds) where data are serialized data or a list of segments
+        and fds are file descriptors to send along with the data.
 
     Raises:
         EncoderError: On failure.
     """
-    data = bytearray()
     fds: List[Fd] = []
-    _serialize(data, fds, value)
+    try:
+        if version == 2:
+            fmt, args, views = _plan_v2(value, fds, pack_sequences, strings, None if strings is not None else cache,
+                                        memfd_size)
+        elif strings is not None:
+            raise EncoderError('Interned strings require version 2.')
+        else:
+            fmt, args, views = _plan(value, fds, pack_sequences, cache, memfd_size)
+        if segment_size is None:
+            data = _pack(fmt, args, views)
+        else:
+            data = _pack_segments(fmt, args, views, segment_size)
+    except Exception:
+        if strings is not None:
+            strings.rollback()
+        raise
+    if strings is not None:
+        strings.commit()
     return data, fds
 
 
-def _serialize(buffer: bytearray, fds: List[Fd], value: NativeType) -> None:
+def _pack(fmt: List[str], args: List[Any], views: List[Tuple[int, int, memoryview]]) -> bytearray:
+    """
+    Pack flattened values into a single buffer.
+
+    Args:
+        fmt: Struct format items without byte order.
+        args: Arguments for the format items.
+        views: Triples of (the number of preceding format items, the number of preceding arguments,
+            memoryview) to be copied between the packed format items.
+
+    Returns:
+        Packed data.
+
+    Raises:
+        EncoderError: On failure.
+    """
+    try:
+        if not views:
+            fmt_str = '=' + ''.join(fmt)
+            data = bytearray(struct.calcsize(fmt_str))
+            struct.pack_into(fmt_str, data, 0, *args)
+            return data
+
+        # Memoryviews cannot be packed by struct, so the format items between them are packed separately
+        # and joined with them. Every byte is then copied once into a buffer which is not zero-filled first.
+        parts: List[Bytes] = []
+        fmt_start = args_start = 0
+        for fmt_index, args_index, view in views:
+            parts.append(struct.pack('=' + ''.join(fmt[fmt_start:fmt_index]), *args[args_start:args_index]))
+            parts.append(view)
+            fmt_start = fmt_index
+            args_start = args_index
+        if fmt_start < len(fmt):
+            parts.append(struct.pack('=' + ''.join(fmt[fmt_start:]), *args[args_start:]))
+        return bytearray().join(parts)
+    except struct.error as e:
+        raise EncoderError(f'Encoder failure: {e}')
+
+
+def _pack_segments(fmt: List[str], args: List[Any], views: List[Tuple[int, int, memoryview]],
+                   segment_size: int) -> List[Bytes]:
+    """
+    Pack flattened values into a list of segments referencing large memoryviews in place.
+
+    Args:
+        fmt: Struct format items without byte order.
+        args: Arguments for the format items.
+        views: Triples of (the number of preceding format items, the number of preceding arguments,
+            memoryview).
+        segment_size: The minimal size of memoryviews to be referenced instead of copied.
+
+    Returns:
+        A list of segments.
+
+    Raises:
+        EncoderError: On failure.
+    """
+    segments: List[Bytes] = []
+    small: List[Tuple[int, int, memoryview]] = []
+    fmt_start = args_start = 0
+    for fmt_index, args_index, view in views:
+        if view.nbytes < segment_size:
+            small.append((fmt_index - fmt_start, args_index - args_start, view))
+            continue
+        if fmt_index > fmt_start or small:
+            segments.append(_pack(fmt[fmt_start:fmt_index], args[args_start:args_index], small))
+        segments.append(view)
+        fmt_start = fmt_index
+        args_start = args_index
+        small = []
+    if fmt_start < len(fmt) or small or not segments:
+        segments.append(_pack(fmt[fmt_start:], args[args_start:], small))
+    return segments
+
+
+def _plan(value: NativeType, fds: List[Fd], pack: Optional[int], cache: Optional[EncodingCache] = None,
+          memfd: Optional[int] = None) -> Tuple[List[str], List[Any], List[Tuple[int, int, memoryview]]]:
+    """
+    Flatten a value into struct format items and arguments.
+
+    Containers are walked with an explicit stack of iterators, so there is no recursion limit.
+
+    Returns:
+        A tuple (fmt, args, views) where fmt are struct format items, args are the arguments for them
+        and views are triples of (the number of preceding format items, the number of preceding arguments,
+        memoryview) to be copied between the packed format items.
+    """
     # TODO: refactor to reduce complexity
-    if value is None:
-        buffer += int32_to_bytes(Markers.NONE)
-    elif value is True:
-        buffer += int32_to_bytes(Markers.TRUE)
-    elif value is False:
-        buffer += int32_to_bytes(Markers.FALSE)
-    elif isinstance(value, int):
-        buffer += int32_to_bytes(Markers.INT64)
-        buffer += int64_to_bytes(value)
-    elif isinstance(value, float):
-        buffer += int32_to_bytes(Markers.DOUBLE)
-        buffer += float_to_bytes(value)
-    elif isinstance(value, str):
-        value = value.encode('utf-8')
-        buffer += int32_to_bytes(Markers.STRING)
-        buffer += int32_to_bytes(len(value))
-        buffer += value
-    elif isinstance(value, (bytes, memoryview)):
-        buffer += int32_to_bytes(Markers.BYTES)
-        buffer += int32_to_bytes(len(value))
-        buffer += value
-    elif isinstance(value, (list, tuple)):
-        buffer += int32_to_bytes(Markers.ARRAY_START)
-        for item in value:
-            _serialize(buffer, fds, item)
-        buffer += int32_to_bytes(Markers.ARRAY_END)
-    elif isinstance(value, (dict, OrderedDict)):
-        buffer += int32_to_bytes(Markers.DICT_START)
-        for key, value in value.items():
-            _serialize(buffer, fds, key)
-            _serialize(buffer, fds, value)
-        buffer += int32_to_bytes(Markers.DICT_END)
-    elif isinstance(value, Fd):
-        buffer += int32_to_bytes(Markers.FD)
-        buffer += int32_to_bytes(len(fds))
-        fds.append(value)
+    fmt: List[str] = []
+    add_fmt = fmt.append
+    args: List[Any] = []
+    add_arg = args.append
+    views: List[Tuple[int, int, memoryview]] = []
+    stack = []
+    items: Iterator[NativeType] = iter((value,))
+    end_marker = None
+
+    while True:
+        for value in items:
+            if value is None:
+                add_fmt('I')
+                add_arg(_NONE)
+            elif value is True:
+                add_fmt('I')
+                add_arg(_TRUE)
+            elif value is False:
+                add_fmt('I')
+                add_arg(_FALSE)
+            elif isinstance(value, str):
+                value = value.encode('utf-8')
+                size = len(value)
+                add_fmt(f'II{size}s')
+                add_arg(_STRING)
+                add_arg(size)
+                add_arg(value)
+            elif isinstance(value, int):
+                add_fmt('IQ')
+                add_arg(_INT64)
+                add_arg(value)
+            elif isinstance(value, float):
+                add_fmt('Id')
+                add_arg(_DOUBLE)
+                add_arg(value)
+            elif isinstance(value, (list, tuple)):
+                if cache is not None and _plan_cached(cache, value, 1, pack, memfd, fmt, args, views):
+                    continue
+                if pack is not None and len(value) >= pack:
+                    packed = _pack_sequence(value)
+                    if packed is not None:
+                        _plan_typed_array(packed, fmt, args, views)
+                        continue
+                add_fmt('I')
+                add_arg(_ARRAY_START)
+                stack.append((items, end_marker))
+                items = iter(value)
+                end_marker = _ARRAY_END
+                break
+            elif isinstance(value, (dict, OrderedDict)):
+                if cache is not None and _plan_cached(cache, value, 1, pack, memfd, fmt, args, views):
+                    continue
+                add_fmt('I')
+                add_arg(_DICT_START)
+                stack.append((items, end_marker))
+                items = chain.from_iterable(value.items())
+                end_marker = _DICT_END
+                break
+            elif isinstance(value, (bytes, bytearray)):
+                size = len(value)
+                if memfd is not None and size >= memfd:
+                    _plan_memfd(value, 1, fmt, args, fds)
+                    continue
+                add_fmt('II')
+                add_arg(_BYTES)
+                add_arg(size)
+                if size < _MIN_VIEW_SIZE:
+                    add_fmt(f'{size}s')
+                    add_arg(value)
+                else:
+                    views.append((len(fmt), len(args), memoryview(value)))
+            elif isinstance(value, _TYPED_ARRAYS):
+                _plan_typed_array(value, fmt, args, views)
+            elif isinstance(value, memoryview):
+                size = value.nbytes
+                if memfd is not None and size >= memfd:
+                    _plan_memfd(value, 1, fmt, args, fds)
+                    continue
+                add_fmt('II')
+                add_arg(_BYTES)
+                add_arg(size)
+                view = value.cast('B') if value.format != 'B' or value.ndim != 1 else value
+                views.append((len(fmt), len(args), view))
+            elif isinstance(value, SealedBuffer):
+                _plan_memfd(value, 1, fmt, args, fds)
+            elif isinstance(value, Fd):
+                add_fmt('II')
+                add_arg(_FD)
+                add_arg(len(fds))
+                fds.append(value)
+            else:
+                raise EncoderError(f'Unsupported type {type(value)} for value {value!r}.')
+        else:
+            if not stack:
+                return fmt, args, views
+            add_fmt('I')
+            add_arg(end_marker)
+            items, end_marker = stack.pop()
+
+
+def _plan_v2(value: NativeType, fds: List[Fd], pack: Optional[int], strings: Optional[StringTable] = None,
+             cache: Optional[EncodingCache] = None, memfd: Optional[int] = None) -> Tuple[List[str], List[Any], List[Tuple[int, int, memoryview]]]:
+    """Flatten a value into struct format items and arguments for version 2, see `_plan`."""
+    # TODO: refactor to reduce complexity
+    fmt: List[str] = ['B']
+    add_fmt = fmt.append
+    args: List[Any] = [VERSION_2_MAGIC]
+    add_arg = args.append
+    views: List[Tuple[int, int, memoryview]] = []
+    stack = []
+    items: Iterator[NativeType] = iter((value,))
+    end_marker = None
+
+    while True:
+        for value in items:
+            if value is None:
+                add_fmt('B')
+                add_arg(_NONE)
+            elif value is True:
+                add_fmt('B')
+                add_arg(_TRUE)
+            elif value is False:
+                add_fmt('B')
+                add_arg(_FALSE)
+            elif isinstance(value, str):
+                index, new = (None, False) if strings is None else strings.intern(value)
+                if index is not None and not new:
+                    if index < 0x40:
+                        add_fmt('B')
+                        add_arg(_V2_FIXREF | index)
+                    else:
+                        prefix = varint_to_bytes(index)
+                        add_fmt(f'B{len(prefix)}s')
+                        add_arg(_STRING_REF)
+                        add_arg(prefix)
+                    continue
+                value = value.encode('utf-8')
+                size = len(value)
+                if index is not None:
+                    prefix = varint_to_bytes(index) + varint_to_bytes(size)
+                    add_fmt(f'B{len(prefix)}s{size}s')
+                    add_arg(_STRING_DEFINE)
+                    add_arg(prefix)
+                elif size < _V2_FIXSTR:
+                    add_fmt(f'B{size}s')
+                    add_arg(_V2_FIXSTR | size)
+                else:
+                    prefix = varint_to_bytes(size)
+                    add_fmt(f'B{len(prefix)}s{size}s')
+                    add_arg(_STRING)
+                    add_arg(prefix)
+                add_arg(value)
+            elif isinstance(value, int):
+                if 0 <= value < 0x20:
+                    add_fmt('B')
+                    add_arg(_V2_FIXINT | value)
+                elif -0x2000 <= value < 0x2000:
+                    # Zigzag varints of one or two bytes are packed byte by byte, see zigzag_encode.
+                    value = value << 1 if value >= 0 else ~value << 1 | 1
+                    add_arg(_INT64)
+                    if value < 0x80:
+                        add_fmt('BB')
+                        add_arg(value)
+                    else:
+                        add_fmt('BBB')
+                        add_arg(value & 0x7F | 0x80)
+                        add_arg(value >> 7)
+                elif _V2_INT_MIN <= value <= _V2_INT_MAX:
+                    value = zigzag_encode(value)
+                    add_arg(_INT64)
+                    if value < 0x200000:
+                        # Three-byte varints are packed byte by byte, so that no bytes are allocated.
+                        add_fmt('BBBB')
+                        add_arg(value & 0x7F | 0x80)
+                        add_arg(value >> 7 & 0x7F | 0x80)
+                        add_arg(value >> 14)
+                    else:
+                        value = varint_to_bytes(value)
+                        add_fmt(f'B{len(value)}s')
+                        add_arg(value)
+                else:
+                    raise EncoderError(f'Integer out of range: {value}.')
+            elif isinstance(value, float):
+                add_fmt('Bd')
+                add_arg(_DOUBLE)
+                add_arg(value)
+            elif isinstance(value, (list, tuple)):
+                if cache is not None and _plan_cached(cache, value, 2, pack, memfd, fmt, args, views):
+                    continue
+                if pack is not None and len(value) >= pack:
+                    packed = _pack_sequence(value)
+                    if packed is not None:
+                        _plan_typed_array_v2(packed, fmt, args, views)
+                        continue
+                add_fmt('B')
+                add_arg(_ARRAY_START)
+                stack.append((items, end_marker))
+                items = iter(value)
+                end_marker = _ARRAY_END
+                break
+            elif isinstance(value, (dict, OrderedDict)):
+                if cache is not None and _plan_cached(cache, value, 2, pack, memfd, fmt, args, views):
+                    continue
+                add_fmt('B')
+                add_arg(_DICT_START)
+                stack.append((items, end_marker))
+                items = chain.from_iterable(value.items())
+                end_marker = _DICT_END
+                break
+            elif isinstance(value, (bytes, bytearray)):
+                size = len(value)
+                if memfd is not None and size >= memfd:
+                    _plan_memfd(value, 2, fmt, args, fds)
+                    continue
+                if size < _V2_FIXSTR:
+                    add_fmt(f'B{size}s')
+                    add_arg(_V2_FIXBYTES | size)
+                    add_arg(value)
+                else:
+                    prefix = varint_to_bytes(size)
+                    add_arg(_BYTES)
+                    add_arg(prefix)
+                    if size < _MIN_VIEW_SIZE:
+                        add_fmt(f'B{len(prefix)}s{size}s')
+                        add_arg(value)
+                    else:
+                        add_fmt(f'B{len(prefix)}s')
+                        views.append((len(fmt), len(args), memoryview(value)))
+            elif isinstance(value, _TYPED_ARRAYS):
+                _plan_typed_array_v2(value, fmt, args, views)
+            elif isinstance(value, memoryview):
+                size = value.nbytes
+                if memfd is not None and size >= memfd:
+                    _plan_memfd(value, 2, fmt, args, fds)
+                    continue
+                if size < _V2_FIXSTR:
+                    add_fmt('B')
+                    add_arg(_V2_FIXBYTES | size)
+                else:
+                    prefix = varint_to_bytes(size)
+                    add_fmt(f'B{len(prefix)}s')
+                    add_arg(_BYTES)
+                    add_arg(prefix)
+                view = value.cast('B') if value.format != 'B' or value.ndim != 1 else value
+                views.append((len(fmt), len(args), view))
+            elif isinstance(value, SealedBuffer):
+                _plan_memfd(value, 2, fmt, args, fds)
+            elif isinstance(value, Fd):
+                index = varint_to_bytes(len(fds))
+                add_fmt(f'B{len(index)}s')
+                add_arg(_FD)
+                add_arg(index)
+                fds.append(value)
+            else:
+                raise EncoderError(f'Unsupported type {type(value)} for value {value!r}.')
+        else:
+            if not stack:
+                return fmt, args, views
+            add_fmt('B')
+            add_arg(end_marker)
+            items, end_marker = stack.pop()
+
+
+def _pack_sequence(value: Union[list, tuple]) -> Optional[array.array]:
+    """Pack a sequence of ints in the int64 range or of floats into an array or return None."""
+    first = type(value[0]) if value else None
+    try:
+        if first is int and all(type(item) is int for item in value):
+            return array.array('q', value)
+        if first is float and all(type(item) is float for item in value):
+            return array.array('d', value)
+    except OverflowError:
+        pass
+    return None
+
+
+def _typed_array_view(value: Any) -> Tuple[str, memoryview]:
+    """Return the type code and a memoryview of a typed array."""
+    view = memoryview(value)
+    typecode = view.format.lstrip('@=>' if sys.byteorder == 'big' else '@=<')
+    if len(typecode) != 1 or typecode not in TYPECODES:
+        raise EncoderError(f'Unsupported typed array format {view.format!r} of {value!r}.')
+    return typecode, view
+
+
+def _plan_memfd(value: Union[Bytes, SealedBuffer], version: int, fmt: List[str], args: List[Any],
+                fds: List[Fd]) -> None:
+    """Add struct format items and arguments for binary data in a sealed memfd."""
+    try:
+        if isinstance(value, SealedBuffer):
+            value.seal()
+        else:
+            value = SealedBuffer.from_bytes(value)
+    except (BufferError, OSError) as e:
+        raise EncoderError(f'Cannot create a sealed memfd: {e}')
+    if version == 1:
+        fmt.append('IIQ')
+        args += (_MEMFD, len(fds), value.size)
     else:
-        raise EncoderError(f'Unsupported type {type(value)} for value {value!r}.')
+        header = varint_to_bytes(len(fds)) + varint_to_bytes(value.size)
+        fmt.append(f'B{len(header)}s')
+        args += (_MEMFD, header)
+    fds.append(value.fd)
+
+
+def _plan_cached(cache: EncodingCache, value: Union[list, tuple, dict], version: int, pack: Optional[int],
+                 memfd: Optional[int], fmt: List[str], args: List[Any], views: List[Tuple[int, int, memoryview]]) -> bool:
+    """Splice encoded data of a container from the cache and return True, or return False on a miss."""
+    encoded = cache.encode(value, version, pack, memfd)
+    if encoded is None:
+        return False
+    size = len(encoded)
+    if size < _MIN_VIEW_SIZE:
+        fmt.append(f'{size}s')
+        args.append(encoded)
+    else:
+        views.append((len(fmt), len(args), memoryview(encoded)))
+    return True
+
+
+def _plan_typed_array(value: Any, fmt: List[str], args: List[Any], views: List[Tuple[int, int, memoryview]]) -> None:
+    """Add struct format items and arguments for a typed array, see `_plan`."""
+    typecode, view = _typed_array_view(value)
+    fmt.append(f'III{view.ndim}Q')
+    args += (_TYPED_ARRAY, ord(typecode), view.ndim, *view.shape)
+    if view.c_contiguous:
+        views.append((len(fmt), len(args), view.cast('B')))
+    else:
+        fmt.append(f'{view.nbytes}s')
+        args.append(view.tobytes())
+
+
+def _plan_typed_array_v2(value: Any, fmt: List[str], args: List[Any], views: List[Tuple[int, int, memoryview]]) -> None:
+    """Add struct format items and arguments for a typed array, see `_plan_v2`."""
+    typecode, view = _typed_array_view(value)
+    header = b''.join(varint_to_bytes(i) for i in (view.ndim, *view.shape))
+    fmt.append(f'BB{len(header)}s')
+    args += (_TYPED_ARRAY, ord(typecode), header)
+    if view.c_contiguous:
+        views.append((len(fmt), len(args), view.cast('B')))
+    else:
+        fmt.append(f'{view.nbytes}s')
+        args.append(view.tobytes())
+
+
+def _typed_array_at(data: memoryview, offset: int, typecode: int, shape: Tuple[int, ...]) -> Tuple[memoryview, int]:
+    """Return a read-only view of a typed array in data and the offset after it."""
+    typecode = chr(typecode)
+    if typecode not in TYPECODES:
+        raise DecoderError(f'Unsupported typed array format: {typecode!r}.')
+    size = struct.calcsize(typecode)
+    for dimension in shape:
+        size *= dimension
+    end = offset + size
+    if end > len(data):
+        raise DecoderError(f'Value exceeds data by {end - len(data)} bytes.')
 
+    # Memoryviews cannot have zero dimensions, so empty arrays are always one-dimensional.
+    view = data[offset:end].toreadonly()
+    if len(shape) == 1 or not size:
+        return view.cast(typecode), end
+    return view.cast(typecode, shape), end
 
-def deserialize(data: Union[bytes, bytearray, memoryview], fds: List[Fd]) -> NativeType:
+
+def _copy_typed_array(view: memoryview) -> memoryview:
+    """Return a read-only view of a copy of a typed array with the same type code and shape."""
+    copy = memoryview(view.tobytes())
+    if view.ndim == 1:
+        return copy.cast(view.format)
+    return copy.cast(view.format, view.shape)
+
+
+def deserialize(data: Union[bytes, bytearray, memoryview], fds: List[Fd], *,
+                strings: Optional[StringTable] = None) -> NativeType:
     """
     Deserialize data to subset of native Python types.
 
-    See NativeType for supported types.
+    See NativeType for supported types. The version of the wire format is detected from the data.
+
+    The data are decoded without recursion, keeping an integer offset into the buffer and
+    an explicit stack of open arrays and dictionaries.
 
     Args:
         data: Data to deserialize.
         fds: File descriptors to attach to deserialized data.
+        strings: A table of interned strings, see InterningCodec.
 
     Returns:
          Deserialized data.
@@ -192,72 +1073,217 @@ def deserialize(data: Union[bytes, bytearray, memoryview], fds: List[Fd]) -> Nat
     """
     if not isinstance(data, memoryview):
         data = memoryview(data)
+    if data.format != 'B' or data.ndim != 1:
+        data = data.cast('B')
 
     try:
-        end, value = _deserialize(fds, data)
-    except (ValueError, IndexError, struct.error) as e:
+        if data and data[0] == VERSION_2_MAGIC:
+            end, value = _deserialize_v2(fds, data, 1, strings)
+        else:
+            end, value = _deserialize(fds, data, 0)
+    except (ValueError, IndexError, TypeError, struct.error) as e:
         raise DecoderError(f'Decoder failure: {e}')
-    if end:
-        raise DecoderError(f'Decoding ended with extra data: {end.tobytes()}.')
-    if isinstance(value, Markers):
-        raise DecoderError(f'Value cannot be {value}.')
+    if end != len(data):
+        raise DecoderError(f'Decoding ended with extra data: {data[end:].tobytes()}.')
     return value
 
 
-def _deserialize(fds: List[Fd], data: memoryview) -> Tuple[memoryview, Union[Markers, NativeType]]:
+def _deserialize(fds: List[Fd], data: memoryview, offset: int, copy_arrays: bool = False) -> Tuple[int, NativeType]:
     # TODO: refactor to reduce complexity
-    type_ = int_from_bytes(data[0:4])
-    if type_ == Markers.NONE:
-        return data[4:], None
-    if type_ == Markers.FALSE:
-        return data[4:], False
-    if type_ == Markers.TRUE:
-        return data[4:], True
-    if type_ == Markers.FD:
-        return data[8:], fds[int_from_bytes(data[4:8])]
-    if type_ == Markers.INT64:
-        return data[12:], int_from_bytes(data[4:12])
-    if type_ == Markers.DOUBLE:
-        return data[12:], float_from_bytes(data[4:12])
-    if type_ == Markers.STRING:
-        end = 8 + int_from_bytes(data[4:8])
-        return data[end:], str(cast(bytes, data[8:end]), encoding='utf-8')
-    if type_ == Markers.BYTES:
-        end = 8 + int_from_bytes(data[4:8])
-        return data[end:], data[8:end].tobytes()
-    if type_ == Markers.ARRAY_START:
-        result = []
-        data = data[4:]
-
-        while True:
-            data, value = _deserialize(fds, data)
-            if value is Markers.ARRAY_END:
-                break
-            if isinstance(value, Markers):
-                raise DecoderError(f'Value cannot be {value}.')
-            result.append(value)
-        return data, result
-    if type_ == Markers.DICT_START:
-        result = {}
-        data = data[4:]
-
-        while True:
-            data, key = _deserialize(fds, data)
-            if key is Markers.DICT_END:
-                break
-            if isinstance(key, Markers):
-                raise DecoderError(f'Value cannot be {key}.')
+    unpack_uint32 = _UINT32.unpack_from
+    unpack_uint64 = _UINT64.unpack_from
+    unpack_double = _FLOAT64.unpack_from
+    size = len(data)
+    # Open containers. A dictionary has a pending key or _NO_KEY.
+    stack: List[Union[list, dict]] = []
+    keys: List[Any] = []
+    container: Union[list, dict, None] = None
+    key: Any = _NO_KEY
+
+    while True:
+        type_, = unpack_uint32(data, offset)
+        offset += 4
+        if type_ == _STRING or type_ == _BYTES:
+            end = offset + 4 + unpack_uint32(data, offset)[0]
+            if end > size:
+                raise DecoderError(f'Value exceeds data by {end - size} bytes.')
+            if type_ == _STRING:
+                value = str(data[offset + 4:end], encoding='utf-8')
+            else:
+                value = data[offset + 4:end].tobytes()
+            offset = end
+        elif type_ == _INT64:
+            value, = unpack_uint64(data, offset)
+            offset += 8
+        elif type_ == _NONE:
+            value = None
+        elif type_ == _FALSE:
+            value = False
+        elif type_ == _TRUE:
+            value = True
+        elif type_ == _DOUBLE:
+            value, = unpack_double(data, offset)
+            offset += 8
+        elif type_ == _FD:
+            value = fds[unpack_uint32(data, offset)[0]]
+            offset += 4
+        elif type_ == _MEMFD:
+            index, = unpack_uint32(data, offset)
+            value = map_sealed(fds[index], unpack_uint64(data, offset + 4)[0])
+            offset += 12
+        elif type_ == _TYPED_ARRAY:
+            typecode, ndim = unpack_uint32(data, offset)[0], unpack_uint32(data, offset + 4)[0]
+            if ndim > _MAX_NDIM:
+                raise DecoderError(f'Too many dimensions of typed array: {ndim}.')
+            shape = struct.unpack_from(f'={ndim}Q', data, offset + 8)
+            value, offset = _typed_array_at(data, offset + 8 + 8 * ndim, typecode, shape)
+            if copy_arrays:
+                value = _copy_typed_array(value)
+        elif type_ == _ARRAY_START or type_ == _DICT_START:
+            if container is not None:
+                stack.append(container)
+                keys.append(key)
+            container = [] if type_ == _ARRAY_START else {}
+            key = _NO_KEY
+            continue
+        elif type_ == _ARRAY_END or type_ == _DICT_END:
+            expected = list if type_ == _ARRAY_END else dict
+            if container.__class__ is not expected or key is not _NO_KEY:
+                raise DecoderError(f'Value cannot be {Markers(type_)}.')
+            value = container
+            if stack:
+                container = stack.pop()
+                key = keys.pop()
+            else:
+                container = None
+        else:
+            raise DecoderError(f'Unknown data type: {type_}.')
+
+        if container is None:
+            return offset, value
+        if container.__class__ is list:
+            container.append(value)
+        elif key is _NO_KEY:
+            key = value
+        else:
+            container[key] = value
+            key = _NO_KEY
+
+
+def _deserialize_v2(fds: List[Fd], data: memoryview, offset: int,
+                    strings: Optional[StringTable] = None, copy_arrays: bool = False) -> Tuple[int, NativeType]:
+    # TODO: refactor to reduce complexity
+    unpack_double = _FLOAT64.unpack_from
+    size = len(data)
+    # Open containers. A dictionary has a pending key or _NO_KEY.
+    stack: List[Union[list, dict]] = []
+    keys: List[Any] = []
+    container: Union[list, dict, None] = None
+    key: Any = _NO_KEY
 
-            data, value = _deserialize(fds, data)
-            if isinstance(value, Markers):
-                raise DecoderError(f'Value cannot be {value}.')
-            result[key] = value
-        return data, result
+    while True:
+        type_ = data[offset]
+        offset += 1
+        if type_ >= _V2_FIXINT:
+            if type_ >= _V2_FIXREF:
+                if strings is None:
+                    raise DecoderError(f'Unknown data type: {type_}.')
+                value = strings.get(type_ & 0x3F)
+            elif type_ >= _V2_FIXSTR:
+                end = offset + (type_ & 0x3F)
+                if end > size:
+                    raise DecoderError(f'Value exceeds data by {end - size} bytes.')
+                if type_ >= _V2_FIXBYTES:
+                    value = data[offset:end].tobytes()
+                else:
+                    value = str(data[offset:end], encoding='utf-8')
+                offset = end
+            else:
+                value = type_ - _V2_FIXINT
+        elif type_ == _STRING or type_ == _BYTES:
+            length, offset = varint_from_bytes(data, offset)
+            end = offset + length
+            if end > size:
+                raise DecoderError(f'Value exceeds data by {end - size} bytes.')
+            if type_ == _STRING:
+                value = str(data[offset:end], encoding='utf-8')
+            else:
+                value = data[offset:end].tobytes()
+            offset = end
+        elif type_ == _INT64:
+            value, offset = varint_from_bytes(data, offset, 65)
+            value = value >> 1 if not value & 1 else -(value >> 1) - 1
+        elif type_ == _NONE:
+            value = None
+        elif type_ == _FALSE:
+            value = False
+        elif type_ == _TRUE:
+            value = True
+        elif type_ == _DOUBLE:
+            value, = unpack_double(data, offset)
+            offset += 8
+        elif type_ == _FD:
+            index, offset = varint_from_bytes(data, offset)
+            value = fds[index]
+        elif type_ == _MEMFD:
+            index, offset = varint_from_bytes(data, offset)
+            memfd_size, offset = varint_from_bytes(data, offset)
+            value = map_sealed(fds[index], memfd_size)
+        elif type_ == _TYPED_ARRAY:
+            value, offset = _typed_array_at_v2(data, offset)
+            if copy_arrays:
+                value = _copy_typed_array(value)
+        elif type_ == _ARRAY_START or type_ == _DICT_START:
+            if container is not None:
+                stack.append(container)
+                keys.append(key)
+            container = [] if type_ == _ARRAY_START else {}
+            key = _NO_KEY
+            continue
+        elif type_ == _ARRAY_END or type_ == _DICT_END:
+            expected = list if type_ == _ARRAY_END else dict
+            if container.__class__ is not expected or key is not _NO_KEY:
+                raise DecoderError(f'Value cannot be {Markers(type_)}.')
+            value = container
+            if stack:
+                container = stack.pop()
+                key = keys.pop()
+            else:
+                container = None
+        elif strings is not None and type_ == _STRING_REF:
+            index, offset = varint_from_bytes(data, offset)
+            value = strings.get(index)
+        elif strings is not None and type_ == _STRING_DEFINE:
+            index, offset = varint_from_bytes(data, offset)
+            length, offset = varint_from_bytes(data, offset)
+            end = offset + length
+            if end > size:
+                raise DecoderError(f'Value exceeds data by {end - size} bytes.')
+            value = str(data[offset:end], encoding='utf-8')
+            strings.define(index, value)
+            offset = end
+        else:
+            raise DecoderError(f'Unknown data type: {type_}.')
 
-    if type_ == Markers.DICT_END:
-        return data[4:], Markers.DICT_END
-    if type_ == Markers.ARRAY_END:
-        return data[4:], Markers.ARRAY_END
-    raise DecoderError(f'Unknown data type: {type_}.')
+        if container is None:
+            return offset, value
+        if container.__class__ is list:
+            container.append(value)
+        elif key is _NO_KEY:
+            key = value
+        else:
+            container[key] = value
+            key = _NO_KEY
 
 
+def _typed_array_at_v2(data: memoryview, offset: int) -> Tuple[memoryview, int]:
+    """Return a read-only view of a typed array in data after its marker and the offset after it."""
+    typecode = data[offset]
+    ndim, offset = varint_from_bytes(data, offset + 1)
+    if ndim > _MAX_NDIM:
+        raise DecoderError(f'Too many dimensions of typed array: {ndim}.')
+    shape = []
+    for _i in range(ndim):
+        dimension, offset = varint_from_bytes(data, offset)
+        shape.append(dimension)
+    return _typed_array_at(data, offset, typecode, tuple(shape))
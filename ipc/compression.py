@@ -0,0 +1,200 @@
+from __future__ import annotations
+import lzma
+import zlib
+from copy import copy
+from typing import Any, List, Optional, Tuple, Union
+
+from ipc.codecs import Codec, NativeCodec, DecoderError, T
+from ipc.protocol import Flags, Peer
+from ipc.types import Bytes, Fd
+
+METHODS = ('zlib', 'lzma')
+"""Supported compression methods."""
+_METHOD_IDS = {'zlib': 1, 'lzma': 2}
+"""Ids of compression methods in the first byte of compressed message bodies."""
+_MAX_SKIP = 64
+"""The maximal number of messages not to be compressed after a poor compression ratio."""
+
+
+class CompressingCodec(Codec[T]):
+    """
+    A codec compressing bodies of messages encoded by another codec.
+
+    Compression requires a connection: the codec must be set as `Connection.codec`, so that compressed
+    messages are marked with Flags.COMPRESSED. The connection advertises that it accepts compressed
+    messages and messages are compressed only after the remote endpoint has advertised the same.
+    Methods `encode` and `decode` of the codec itself just call the wrapped codec.
+
+    The first byte of compressed bodies identifies the compression method, so that they are
+    decompressed with the method of the sender, whatever the `method` of the receiver is.
+
+    Only messages of at least `threshold` bytes are compressed. If a message is not compressed
+    to at most `min_ratio` of its size, it is sent uncompressed and the following messages are not
+    compressed at all, first one, then twice as many after another poor result, up to 64 messages,
+    so that CPU is not wasted on incompressible data.
+
+    Args:
+        codec: A codec to encode messages, NativeCodec by default.
+        connection: A connection to bind to, see `bind`.
+        method: A compression method, see METHODS.
+        threshold: The minimal size of encoded messages to compress.
+        level: A compression level, the fastest level by default.
+        zdict: A pre-shared dictionary for zlib, which must be the same for both endpoints.
+        min_ratio: The maximal ratio of compressed and uncompressed size to send compressed data.
+        max_size: The maximal size of decompressed data.
+
+    Raises:
+        ValueError: If the method is not supported or does not support a dictionary.
+    """
+
+    codec: Codec[T]
+    """A codec to encode messages."""
+    connection: Optional[Peer]
+    """The connection to negotiate compression with or None."""
+    method: str
+    """A compression method, see METHODS."""
+    threshold: int
+    """The minimal size of encoded messages to compress."""
+    level: int
+    """A compression level."""
+    zdict: Optional[bytes]
+    """A pre-shared dictionary for zlib or None."""
+    min_ratio: float
+    """The maximal ratio of compressed and uncompressed size to send compressed data."""
+    max_size: int
+    """The maximal size of decompressed data."""
+    compressed: int = 0
+    """The number of compressed messages."""
+    skipped: int = 0
+    """The number of messages not compressed because of a poor compression ratio."""
+    _skip: int = 0
+    _backoff: int = 0
+
+    def __init__(self, codec: Optional[Codec[T]] = None, connection: Optional[Peer] = None, *,
+                 method: str = 'zlib', threshold: int = 1024, level: Optional[int] = None,
+                 zdict: Optional[bytes] = None, min_ratio: float = 0.9, max_size: int = 64 * 1024 * 1024):
+        if method not in METHODS:
+            raise ValueError(f'Unsupported compression method: {method!r}.')
+        if zdict is not None and method != 'zlib':
+            raise ValueError(f'A dictionary is not supported by {method!r}.')
+        self.codec = codec if codec is not None else NativeCodec()
+        self.connection = connection
+        self.method = method
+        self.threshold = threshold
+        self.level = level if level is not None else (zlib.Z_BEST_SPEED if method == 'zlib' else 0)
+        self.zdict = zdict
+        self.min_ratio = min_ratio
+        self.max_size = max_size
+
+    @property
+    def ordered(self) -> bool:
+        """Whether the wrapped codec decodes messages in order."""
+        return self.codec.ordered
+
+    def bind(self, conn: Peer) -> CompressingCodec[T]:
+        """
+        Return a codec negotiating compression with the given connection.
+
+        The wrapped codec is bound to the connection too.
+
+        Args:
+            conn: The connection to bind to.
+
+        Returns:
+            A codec for the connection.
+        """
+        conn.features |= Flags.CODEC_COMPRESSION
+        codec = copy(self)
+        codec.codec = self.codec.bind(conn)
+        codec.connection = conn
+        codec.compressed = codec.skipped = codec._skip = codec._backoff = 0
+        return codec
+
+    def encode(self, msg: T) -> Tuple[Bytes, List[Fd]]:
+        """Encode a message with the wrapped codec without compression."""
+        return self.codec.encode(msg)
+
+    def decode(self, data: Bytes, fds: List[Fd]) -> T:
+        """Decode an uncompressed message with the wrapped codec."""
+        return self.codec.decode(data, fds)
+
+    def encode_message(self, msg: T) -> Tuple[Union[Bytes, List[Bytes]], List[Fd], int]:
+        """
+        Encode a message with the wrapped codec and compress it if it is worth it.
+
+        See Codec.encode_message for details.
+        """
+        data, fds, flags = self.codec.encode_message(msg)
+        conn = self.connection
+        if conn is None or not conn.peer_features & Flags.CODEC_COMPRESSION:
+            return data, fds, flags
+
+        segments = data if isinstance(data, list) else [data]
+        size = sum(memoryview(segment).nbytes for segment in segments)
+        if size < self.threshold:
+            return data, fds, flags
+        if self._skip:
+            self._skip -= 1
+            self.skipped += 1
+            return data, fds, flags
+
+        compressed = self._compress(segments)
+        if len(compressed) > size * self.min_ratio:
+            self._backoff = min(self._backoff * 2 or 1, _MAX_SKIP)
+            self._skip = self._backoff
+            return data, fds, flags
+
+        self._backoff = 0
+        self.compressed += 1
+        return compressed, fds, flags | Flags.COMPRESSED.value
+
+    def decode_message(self, data: Bytes, fds: List[Fd], flags: int) -> T:
+        """
+        Decompress a message if it is compressed and decode it with the wrapped codec.
+
+        See Codec.decode_message for details.
+        """
+        if flags & Flags.COMPRESSED.value:
+            data = self._decompress(memoryview(data).cast('B'))
+            flags &= ~Flags.COMPRESSED.value
+        return self.codec.decode_message(data, fds, flags)
+
+    def _compress(self, segments: List[Bytes]) -> bytes:
+        compressor: Any
+        if self.method == 'zlib':
+            if self.zdict is not None:
+                compressor = zlib.compressobj(self.level, zdict=self.zdict)
+            else:
+                compressor = zlib.compressobj(self.level)
+        else:
+            compressor = lzma.LZMACompressor(check=lzma.CHECK_NONE, preset=self.level)
+        parts = [bytes((_METHOD_IDS[self.method],))]
+        parts += [compressor.compress(segment) for segment in segments]
+        parts.append(compressor.flush())
+        return b''.join(parts)
+
+    def _decompress(self, data: memoryview) -> bytes:
+        if not data:
+            raise DecoderError('Compressed data are empty.')
+        method_id = data[0]
+        data = data[1:]
+        try:
+            if method_id == _METHOD_IDS['zlib']:
+                decompressor = zlib.decompressobj(zdict=self.zdict) if self.zdict is not None else zlib.decompressobj()
+                result = decompressor.decompress(data, self.max_size)
+                if decompressor.unconsumed_tail:
+                    raise DecoderError(f'Decompressed data exceed {self.max_size} bytes.')
+            elif method_id == _METHOD_IDS['lzma']:
+                decompressor = lzma.LZMADecompressor()
+                result = decompressor.decompress(data, self.max_size)
+                if not decompressor.eof and not decompressor.needs_input:
+                    raise DecoderError(f'Decompressed data exceed {self.max_size} bytes.')
+            else:
+                raise DecoderError(f'Unknown compression method: {method_id}.')
+        except (zlib.error, lzma.LZMAError) as e:
+            raise DecoderError(f'Decompression failure: {e}')
+        if not decompressor.eof:
+            raise DecoderError('Compressed data are incomplete.')
+        if decompressor.unused_data:
+            raise DecoderError('Compressed data are followed by extra data.')
+        return result
@@ -1,32 +1,28 @@
 from __future__ import annotations
 
-from enum import Flag
-from typing import Type, Callable, Awaitable, Tuple, List, Dict
+import json
+import time
+from typing import Type, Callable, Awaitable, Tuple, List, Dict, Optional, Any, TYPE_CHECKING
 
 import trio
 from trio import MemorySendChannel, MemoryReceiveChannel, CancelScope
+from trio.lowlevel import checkpoint_if_cancelled
 
+from ipc.framing import BATCH_SIZE, message_size, pack_batch, unpack_batch
+from ipc.metrics import ConnectionStats, MethodStats, encode_stats
+from ipc.pool import BufferPool
+from ipc.protocol import Flags, FEATURE_FLAGS
 from ipc.transport import Transport, SocketType, NoDataError, Message
-from ipc.types import Bytes, Fd, INT32_MAX
+from ipc.types import Bytes, Fd, INT32_MAX, IPCError
 from ipc.utils import Result, WrappedCounter
 
+if TYPE_CHECKING:
+    from ipc.codecs import Codec
+
 NotificationHandler = Callable[['Connection', Bytes, List[Fd]], Awaitable[None]]
 RequestHandler = Callable[['Connection', Bytes, List[Fd]], Awaitable[Tuple[Bytes, List[Fd]]]]
 
 
-class Flags(Flag):
-    """Message flags."""
-
-    NONE = 0
-    """No flags."""
-    REQUEST = 1 << 0
-    """This message is a request."""
-    RESPONSE = 1 << 1
-    """This message is a response to a request."""
-    NOTIFICATION = 1 << 2
-    """This message is a notification not receiving any response."""
-
-
 class Connection:
     """
     A duplex client <-> server connection.
@@ -36,6 +32,12 @@ class Connection:
         transport_factory: A callable to provide transport for this connection.
         request_handler: A callable to handle incoming requests. Any exception will close the connection.
         notification_handler: A callable to handle incoming notifications. Any exception will close the connection.
+        codec: A codec to encode and decode messages or None. See `codec` attribute.
+        max_batch_size: The maximal size of message bodies packed into a batch frame, 0 to disable batching.
+            See `max_batch_size` attribute.
+        batch_delay: The time in seconds to wait for more messages to batch. See `batch_delay` attribute.
+        pool: A pool of receive buffers or None. See `pool` attribute.
+        method_key: A callable returning method names of messages or None. See `method_key` attribute.
     """
 
     num: int
@@ -48,6 +50,64 @@ class Connection:
     """A callable to handle incoming notifications."""
     address: bytes = None
     """The address of the remote endpoint or None."""
+    features: Flags = Flags.NONE
+    """Feature flags advertised to the remote endpoint with every message."""
+    peer_features: Flags = Flags.NONE
+    """Feature flags advertised by the remote endpoint."""
+    codec: Optional[Codec] = None
+    """
+    A codec bound to this connection to encode and decode messages or None.
+
+    If the codec is set, `send` and `notify` accept messages instead of binary data, and handlers
+    receive and return messages instead of binary data. Messages are encoded in the order they
+    are written and decoded in the order they are read, so that stateful codecs can be used.
+
+    If the transport writes large messages in fragments, see `Transport.fragment_size`, they are
+    written concurrently with other messages, unless the codec is `Codec.ordered`. Large messages
+    then arrive later than small messages queued after them, but do not delay them.
+    """
+    max_batch_size: int
+    """
+    The maximal size of message bodies packed into a batch frame, 0 if batching is disabled.
+
+    When concurrent tasks queue several messages, the writer drains all queued messages and packs
+    them into batch frames of up to this size, so that they are written with a single transport write.
+    File descriptors of each message are preserved. The remote endpoint unpacks a batch frame into
+    individual messages. Batch frames are sent only after the remote endpoint has advertised
+    that it accepts them.
+    """
+    batch_delay: float
+    """
+    The time in seconds to wait for more messages to batch after a message is queued.
+
+    Zero packs only messages already queued, a higher value trades latency for fewer writes.
+    """
+    pool: Optional[BufferPool] = None
+    """
+    A pool to borrow buffers of received messages from or None, see BufferPool.
+
+    Buffers are returned to the pool after a codec decodes a message or, without a codec, after
+    a handler of a request or a notification returns. Handlers must then copy binary data they
+    keep. Data of responses are never returned to the pool.
+    """
+    stats: ConnectionStats
+    """Statistics of messages, handlers and errors of this connection."""
+    method_key: Optional[Callable[[Any], str]] = None
+    """
+    A callable returning the method name of a request or a notification or None.
+
+    It is called with data passed to `send`/`notify` and received by handlers, and must not raise.
+    Statistics are then collected per method too, see `ConnectionStats.methods`. For example,
+    `lambda msg: msg[0]` for messages which are lists starting with a method name.
+    """
+    stats_provider: Optional[Callable[[], Dict[str, Any]]] = None
+    """
+    A callable returning statistics sent in response to `request_stats` of the remote endpoint or None.
+
+    The result must be serializable as JSON, e.g. `Server.stats` or `ConnectionStats.snapshot`.
+    If it raises or the result cannot be serialized, the error is counted in `stats` and the response
+    is None rather than closing the connection.
+    """
     _socket: SocketType = None
     _transport: Transport = None
     _error: Exception = None
@@ -60,11 +120,25 @@ class Connection:
                  num: int,
                  transport_factory: Type[Transport],
                  request_handler: RequestHandler,
-                 notification_handler: NotificationHandler) -> None:
+                 notification_handler: NotificationHandler,
+                 codec: Optional[Codec] = None,
+                 max_batch_size: int = BATCH_SIZE,
+                 batch_delay: float = 0.0,
+                 pool: Optional[BufferPool] = None,
+                 method_key: Optional[Callable[[Any], str]] = None) -> None:
         self.num = num
         self.transport_factory = transport_factory
         self.request_handler = request_handler
         self.notification_handler = notification_handler
+        self.max_batch_size = max_batch_size
+        self.batch_delay = batch_delay
+        self.pool = pool
+        self.method_key = method_key
+        self.stats = ConnectionStats()
+        if max_batch_size > 0:
+            self.features |= Flags.BATCHING
+        if codec is not None:
+            self.codec = codec.bind(self)
         self._requests = {}
         self._notification = {}
         self._counter = WrappedCounter(1, INT32_MAX)
@@ -117,6 +191,7 @@ class Connection:
         self.address = address
         self._socket = socket
         self._transport = self.transport_factory(socket)
+        self._transport.pool = self.pool
         self._outbox_sender, self._outbox_receiver = trio.open_memory_channel(0)
         task_status.started()
 
@@ -124,7 +199,7 @@ class Connection:
             with CancelScope() as self._scope:
                 async with trio.open_nursery() as n:
                     n.start_soon(self._read_messages)
-                    n.start_soon(self._write_messages)
+                    n.start_soon(self._write_messages, n)
         finally:
             with CancelScope() as s:
                 s.shield = True
@@ -144,15 +219,16 @@ class Connection:
         if self._scope is not None:
             self._scope.cancel()
 
-    async def send(self, data: Bytes, fds: List[Fd] = None) -> Tuple[Bytes, List[Fd]]:
+    async def send(self, data: Any, fds: List[Fd] = None) -> Tuple[Any, List[Fd]]:
         """
         Send a request and wait for response.
 
         This method is an unconditional trio checkpoint.
 
         Args:
-            data: Data to send.
-            fds: File descriptors to send.
+            data: Data to send or a message to encode if `codec` is set.
+            fds: File descriptors to send. If `codec` is set, they follow file descriptors
+                of the encoded message.
 
         Returns: Response of the request.
 
@@ -161,39 +237,87 @@ class Connection:
         """
         await self._check_not_closed()
 
-        result = Result()
-        while True:
-            num = next(self._counter)
-            if num not in self._requests:
-                break
-
-        self._requests[num] = result
-        await self._outbox_sender.send((Message(num, Flags.REQUEST.value, data, fds or []), result, True))
-        data, fds = await result.wait()
-        del self._requests[num]
-        return data, fds
-
-    async def notify(self, data: Bytes, fds: List[Fd] = None) -> None:
+        method = self._method_stats(data)
+        if method is not None:
+            method.sent += 1
+        start = time.perf_counter()
+        try:
+            response = await self._request(Flags.REQUEST.value, data, fds or [])
+        except Exception:
+            if method is not None:
+                method.errors += 1
+            raise
+        elapsed = time.perf_counter() - start
+        self.stats.round_trip.add(elapsed)
+        if method is not None:
+            method.round_trip.add(elapsed)
+        return response
+
+    async def notify(self, data: Any, fds: List[Fd] = None) -> None:
         """
         Send a notification.
 
         This method is an unconditional trio checkpoint.
 
         Args:
-            data: Data to send.
-            fds: File descriptors to send.
+            data: Data to send or a message to encode if `codec` is set.
+            fds: File descriptors to send. If `codec` is set, they follow file descriptors
+                of the encoded message.
+
+        Raises:
+            Exception: An error occurred when sending request or receiving response.
+        """
+        await self._check_not_closed()
+
+        method = self._method_stats(data)
+        if method is not None:
+            method.sent += 1
+        result = Result()
+        msg = Message(0, Flags.NOTIFICATION.value | self.features.value, data, fds or [])
+        try:
+            await self._outbox_sender.send((msg, result, False))
+            await result.wait()
+        except Exception:
+            if method is not None:
+                method.errors += 1
+            raise
+
+    async def request_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        Request statistics of the remote endpoint.
+
+        The remote endpoint responds with the result of its `stats_provider`, bypassing codecs
+        and handlers.
+
+        This method is an unconditional trio checkpoint.
+
+        Returns: Statistics or None if the remote endpoint does not provide them or fails to.
 
         Raises:
             Exception: An error occurred when sending request or receiving response.
         """
         await self._check_not_closed()
+        data, _fds = await self._request(Flags.REQUEST.value | Flags.STATS.value, b'', [])
+        return json.loads(bytes(data))
 
+    async def _request(self, flags: int, data: Any, fds: List[Fd]) -> Tuple[Any, List[Fd]]:
         result = Result()
-        await self._outbox_sender.send((Message(0, Flags.NOTIFICATION.value, data, fds or []), result, False))
-        await result.wait()
+        while True:
+            num = next(self._counter)
+            if num not in self._requests:
+                break
+
+        self._requests[num] = result
+        try:
+            msg = Message(num, flags | self.features.value, data, fds)
+            await self._outbox_sender.send((msg, result, True))
+            return await result.wait()
+        finally:
+            del self._requests[num]
 
     async def _check_not_closed(self):
-        await trio.sleep(0)
+        # Sending to the outbox yields to other tasks, so only cancellation is checked here.
+        await checkpoint_if_cancelled()
         if self._error is not None:
             raise self._error
         if self._outbox_sender is None:
@@ -204,44 +328,177 @@ class Connection:
             while True:
                 try:
                     msg = await self._transport.read()
-                    n.start_soon(self._dispatch_message, msg)
+                    stats = self.stats
+                    stats.frames_in += 1
+                    stats.bytes_in += len(msg.data)
+                    stats.fds_in += len(msg.fds)
+                    if msg.flags & Flags.BATCH.value:
+                        with msg:
+                            messages = unpack_batch(msg, self.pool)
+                    else:
+                        messages = [msg]
+                    for msg in messages:
+                        if msg.flags & FEATURE_FLAGS.value:
+                            self.peer_features |= Flags(msg.flags & FEATURE_FLAGS.value)
+                        stats.messages_in += 1
+                        if self.codec is not None and not msg.flags & Flags.STATS.value:
+                            # Decoded values referencing the buffer keep it out of the pool.
+                            with msg:
+                                data = self.codec.decode_message(msg.data, msg.fds, msg.flags)
+                            msg = msg._replace(data=data, buffer=None)
+                        n.start_soon(self._dispatch_message, msg)
                 except Exception as e:
                     if isinstance(e, NoDataError):
                         e = trio.ClosedResourceError(str(e))
+                    else:
+                        self.stats.error(e)
                     self._set_error(e)
                     self._scope.cancel()
                     break
 
     async def _dispatch_message(self, msg: Message):
-        await trio.sleep(0)
         if msg.flags & Flags.REQUEST.value:
-            data, fds = await self.request_handler(self, msg.data, msg.fds)
-            result = Result()
-            await self._outbox_sender.send((Message(msg.num, Flags.RESPONSE.value, data, fds or []), result, False))
-            await result.wait()
+            # The response may reference data of the request, so they are released when it is sent.
+            with msg:
+                if msg.flags & Flags.STATS.value:
+                    data, fds = encode_stats(self.stats_provider, self.stats), []
+                    flags = Flags.RESPONSE.value | Flags.STATS.value | self.features.value
+                else:
+                    data, fds = await self._handle(self.request_handler, msg)
+                    flags = Flags.RESPONSE.value | self.features.value
+                result = Result()
+                await self._outbox_sender.send((Message(msg.num, flags, data, fds or []), result, False))
+                await result.wait()
         elif msg.flags & Flags.NOTIFICATION.value:
-            await self.notification_handler(self, msg.data, msg.fds)
+            with msg:
+                await self._handle(self.notification_handler, msg)
         elif msg.flags & Flags.RESPONSE.value:
-            self._requests[msg.num].set((msg.data, msg.fds))
+            # The caller of `send` may keep response data, so they are not returned to the pool.
+            # Responses to cancelled requests are dropped.
+            result = self._requests.get(msg.num)
+            if result is not None and result.value is None:
+                result.set((msg.data, msg.fds))
         else:
             raise RuntimeError('Unknown message type')
 
-    async def _write_messages(self):
+    async def _handle(self, handler: Callable[..., Awaitable[Any]], msg: Message) -> Any:
+        method = self._method_stats(msg.data)
+        start = time.perf_counter()
+        try:
+            return await handler(self, msg.data, msg.fds)
+        except Exception as e:
+            self.stats.error(e)
+            if method is not None:
+                method.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stats.handler.add(elapsed)
+            if method is not None:
+                method.handled += 1
+                method.handler.add(elapsed)
+
+    def _method_stats(self, data: Any) -> Optional[MethodStats]:
+        if self.method_key is None:
+            return None
+        return self.stats.method(self.method_key(data))
+
+    async def _write_messages(self, nursery: trio.Nursery):
         while True:
-            msg, result, needs_response = await self._outbox_receiver.receive()
-
+            batch = []
+            item = self._encode(await self._outbox_receiver.receive())
+            if item is not None:
+                batch.append(item)
+            sent = 0
             try:
-                await self._transport.write(msg)
-                if not needs_response:
-                    result.set()
+                if self.max_batch_size > 0 and self.peer_features & Flags.BATCHING:
+                    await self._collect_batch(batch)
+                fragment_size = self._transport.fragment_size
+                if fragment_size is not None and (self.codec is None or not self.codec.ordered):
+                    # Messages written in fragments are written by their own tasks, so that other
+                    # messages are written between fragments instead of waiting for large transfers.
+                    for item in batch:
+                        if message_size(item[0]) > fragment_size:
+                            nursery.start_soon(self._write_message, *item)
+                    batch = [item for item in batch if message_size(item[0]) <= fragment_size]
+                for msg, count in pack_batch(batch, self.max_batch_size, Flags.BATCH.value | self.features.value):
+                    self._count_written(msg, batch[sent:sent + count])
+                    await self._transport.write(msg)
+                    for _msg, result, needs_response in batch[sent:sent + count]:
+                        if not needs_response:
+                            result.set()
+                    sent += count
             except trio.Cancelled:
-                result.fail(self._set_error(trio.ClosedResourceError()))
+                error = self._set_error(trio.ClosedResourceError())
+                for _msg, result, _needs_response in batch[sent:]:
+                    result.fail(error)
                 raise
             except Exception as e:
-                result.fail(self._set_error(e))
+                self.stats.error(e)
+                error = self._set_error(e)
+                for _msg, result, _needs_response in batch[sent:]:
+                    result.fail(error)
                 self._scope.cancel()
                 break
 
+    async def _write_message(self, msg: Message, result: Result, needs_response: bool) -> None:
+        self._count_written(msg, [(msg, result, needs_response)])
+        try:
+            await self._transport.write(msg)
+        except trio.Cancelled:
+            result.fail(self._set_error(trio.ClosedResourceError()))
+            raise
+        except Exception as e:
+            self.stats.error(e)
+            result.fail(self._set_error(e))
+            self._scope.cancel()
+        else:
+            if not needs_response:
+                result.set()
+
+    def _count_written(self, frame: Message, items: List[Tuple[Message, Result, bool]]) -> None:
+        stats = self.stats
+        now = time.perf_counter()
+        for _msg, result, _needs_response in items:
+            stats.queue_wait.add(now - result.created)
+        stats.messages_out += len(items)
+        stats.frames_out += 1
+        stats.bytes_out += message_size(frame)
+        stats.fds_out += len(frame.fds)
+
+    async def _collect_batch(self, batch: List[Tuple[Message, Result, bool]]) -> None:
+        # Drain queued messages until the size budget is exhausted or the delay expires.
+        size = sum(message_size(msg) for msg, _result, _needs_response in batch)
+        deadline = trio.current_time() + self.batch_delay
+        while size < self.max_batch_size:
+            try:
+                item = self._outbox_receiver.receive_nowait()
+            except trio.WouldBlock:
+                if self.batch_delay <= 0:
+                    break
+                with trio.move_on_at(deadline) as scope:
+                    item = await self._outbox_receiver.receive()
+                if scope.cancelled_caught:
+                    break
+            item = self._encode(item)
+            if item is not None:
+                batch.append(item)
+                size += message_size(item[0])
+
+    def _encode(self, item: Tuple[Message, Result, bool]) -> Optional[Tuple[Message, Result, bool]]:
+        msg, result, needs_response = item
+        if self.codec is not None and not msg.flags & Flags.STATS.value:
+            # A message which cannot be encoded is not fatal for the connection.
+            # Codecs raise CodecError, a subclass of IPCError.
+            try:
+                data, fds, flags = self.codec.encode_message(msg.data)
+            except IPCError as e:
+                self.stats.error(e)
+                result.fail(e)
+                return None
+            msg = msg._replace(flags=msg.flags | flags, data=data, fds=fds + msg.fds)
+        return msg, result, needs_response
+
     def _set_error(self, error: Exception) -> Exception:
         if self._error is None:
             self._error = error
@@ -253,12 +510,17 @@ class Connection:
         if self._outbox_receiver is not None:
             while True:
                 try:
-                    _msg, result, _needs_response = await self._outbox_receiver.receive_nowait()
+                    _msg, result, _needs_response = self._outbox_receiver.receive_nowait()
                     result.fail(error)
                 except trio.WouldBlock:
                     break
             await self._outbox_receiver.aclose()
 
-        self.close()
-
+        # Requests already written will never receive a response.
+        for result in self._requests.values():
+            if result.value is None:
+                result.fail(error)
 
+        if self._transport is not None:
+            self._transport.close()
+        self.close()
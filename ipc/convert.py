@@ -1,7 +1,8 @@
 import struct
 import sys
+from typing import Tuple
 
-from ipc.types import Bytes, INT32_SIZE, INT64_SIZE, DOUBLE_SIZE
+from ipc.types import Bytes, INT32_SIZE, INT64_SIZE, DOUBLE_SIZE, VARINT_MAX_SIZE
 
 
 def int32_to_bytes(value: int) -> bytes:
@@ -50,3 +51,75 @@ def float_from_bytes(value: Bytes) -> float:
     if len(value) != DOUBLE_SIZE:
         raise ValueError(f'Wrong value size: {DOUBLE_SIZE} bytes expected, got {len(value)} bytes.')
     return struct.unpack('d', value)[0]
+
+
+def varint_to_bytes(value: int) -> bytes:
+    """
+    Convert a non-negative int into a variable-length integer.
+
+    Each byte holds seven bits of the value starting with the least significant ones. The most
+    significant bit is set in all bytes but the last one.
+    """
+    if value < 0x80:
+        return _SMALL_VARINTS[value]
+    if value < 0x4000:
+        return bytes((value & 0x7F | 0x80, value >> 7))
+
+    result = bytearray()
+    while value >= 0x80:
+        result.append(value & 0x7F | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def varint_from_bytes(data: Bytes, offset: int, bits: int = 64) -> Tuple[int, int]:
+    """
+    Create int from a variable-length integer.
+
+    Args:
+        data: The buffer to read from.
+        offset: The offset of the variable-length integer in data.
+        bits: The maximal number of bits of the value, 65 for zigzag varints of integers
+            from -2**63 to 2**64-1.
+
+    Returns:
+        A tuple (value, offset) where offset points after the variable-length integer.
+
+    Raises:
+        ValueError: If the variable-length integer is longer than `VARINT_MAX_SIZE` bytes
+            or its value does not fit in the given number of bits.
+        IndexError: If the variable-length integer is not terminated.
+    """
+    byte = data[offset]
+    if byte < 0x80:
+        return byte, offset + 1
+
+    value = byte & 0x7F
+    shift = 7
+    end = offset + VARINT_MAX_SIZE
+    offset += 1
+    while True:
+        if offset >= end:
+            raise ValueError(f'Variable-length integer longer than {VARINT_MAX_SIZE} bytes.')
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            if value >> bits:
+                raise ValueError(f'Variable-length integer exceeds {bits} bits.')
+            return value, offset
+        shift += 7
+
+
+def zigzag_encode(value: int) -> int:
+    """Map a signed int to a non-negative one, so that small negative values stay small."""
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def zigzag_decode(value: int) -> int:
+    """Map a non-negative int created with `zigzag_encode` back to a signed int."""
+    return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+
+_SMALL_VARINTS = [bytes((i,)) for i in range(0x80)]
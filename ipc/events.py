@@ -0,0 +1,191 @@
+from __future__ import annotations
+import struct
+from enum import unique, IntEnum
+from typing import List, Union, Iterator, NamedTuple, Sequence, Tuple
+
+from ipc.codecs import NativeType, Markers, DecoderError, VERSION_2_MAGIC
+from ipc.codecs import _ARRAY_START, _ARRAY_END, _DICT_START, _DICT_END
+from ipc.lazy import _Format, _V1, _V2
+from ipc.types import Fd
+
+
+@unique
+class EventType(IntEnum):
+    """Types of events of a streamed message."""
+    VALUE = 0
+    KEY = 1
+    ARRAY_START = 2
+    ARRAY_END = 3
+    DICT_START = 4
+    DICT_END = 5
+
+
+class Event(NamedTuple):
+    """An event of a streamed message."""
+
+    type: EventType
+    """The type of the event."""
+    value: NativeType = None
+    """A decoded key or value for KEY and VALUE events, None otherwise."""
+    depth: int = 0
+    """The number of arrays and dictionaries the event is nested in."""
+
+
+def iter_events(data: Union[bytes, bytearray, memoryview], fds: List[Fd]) -> Iterator[Event]:
+    """
+    Decode a message of NativeCodec as a stream of events.
+
+    Arrays and dictionaries are not built. Instead, a start event is yielded, then events of
+    the items and an end event. Keys of dictionaries are yielded as KEY events, all other scalar
+    values and typed arrays are decoded as with function deserialize and yielded as VALUE events.
+    Therefore, extra memory does not depend on the size of the message but on the size of the items.
+
+    The version of the wire format is detected from the data. Interned strings of InterningCodec
+    are not supported.
+
+    Args:
+        data: Data to decode.
+        fds: File descriptors to attach to decoded values.
+
+    Returns:
+        An iterator of events.
+
+    Raises:
+        DecoderError: On failure while iterating. The preceding events have been already yielded.
+    """
+    data, offset, fmt = _prepare(data)
+    return _iter_events(data, fds, offset, fmt)
+
+
+def iter_array(data: Union[bytes, bytearray, memoryview], fds: List[Fd],
+               path: Sequence[NativeType] = ()) -> Iterator[NativeType]:
+    """
+    Decode items of an array in a message of NativeCodec one by one.
+
+    The array is found by a path of indexes of arrays and keys of dictionaries from the root of
+    the message. The other values on the way are skipped without being decoded. Items of the array
+    are fully decoded one at a time, as with function deserialize. The rest of the message after the
+    array is not decoded nor validated.
+
+    Args:
+        data: Data to decode.
+        fds: File descriptors to attach to decoded items.
+        path: Non-negative indexes of arrays and keys of dictionaries leading to the array,
+            an empty path for the root.
+
+    Returns:
+        An iterator of items of the array.
+
+    Raises:
+        DecoderError: On failure while iterating.
+        IndexError: If an index of the path is out of range or negative, while iterating.
+        TypeError: If an array is indexed with a key which is not an int, e.g. a bool, while iterating.
+        KeyError: If a key of the path is not found, while iterating.
+    """
+    data, offset, fmt = _prepare(data)
+    return _iter_array(data, fds, offset, fmt, tuple(path))
+
+
+def _prepare(data: Union[bytes, bytearray, memoryview]) -> Tuple[memoryview, int, _Format]:
+    if not isinstance(data, memoryview):
+        data = memoryview(data)
+    if data.format != 'B' or data.ndim != 1:
+        data = data.cast('B')
+    if data and data[0] == VERSION_2_MAGIC:
+        return data, 1, _V2
+    return data, 0, _V1
+
+
+def _decode(data: memoryview, fds: List[Fd], offset: int, fmt: _Format) -> Tuple[int, NativeType]:
+    try:
+        return fmt.deserialize(fds, data, offset)
+    except (ValueError, IndexError, TypeError, struct.error) as e:
+        raise DecoderError(f'Decoder failure: {e}')
+
+
+def _iter_events(data: memoryview, fds: List[Fd], offset: int, fmt: _Format) -> Iterator[Event]:
+    marker_at = fmt.marker_at
+    marker_size = fmt.marker_size
+    # The expected end markers of open containers, and whether a key is expected in open dictionaries.
+    ends: List[int] = []
+    keys: List[bool] = []
+    expect_key = False
+
+    while True:
+        type_ = marker_at(data, offset)
+        if type_ == _ARRAY_START or type_ == _DICT_START:
+            if expect_key:
+                raise DecoderError(f'Key cannot be {Markers(type_)}.')
+            offset += marker_size
+            if type_ == _ARRAY_START:
+                yield Event(EventType.ARRAY_START, None, len(ends))
+            else:
+                yield Event(EventType.DICT_START, None, len(ends))
+            ends.append(type_ + 1)
+            keys.append(expect_key)
+            expect_key = type_ == _DICT_START
+            continue
+
+        if type_ == _ARRAY_END or type_ == _DICT_END:
+            if not ends or ends[-1] != type_ or (type_ == _DICT_END and not expect_key):
+                raise DecoderError(f'Value cannot be {Markers(type_)}.')
+            offset += marker_size
+            ends.pop()
+            expect_key = keys.pop()
+            if type_ == _ARRAY_END:
+                yield Event(EventType.ARRAY_END, None, len(ends))
+            else:
+                yield Event(EventType.DICT_END, None, len(ends))
+        else:
+            # Only a scalar or a typed array is decoded, because containers are handled above.
+            offset, value = _decode(data, fds, offset, fmt)
+            if expect_key:
+                yield Event(EventType.KEY, value, len(ends))
+            else:
+                yield Event(EventType.VALUE, value, len(ends))
+
+        if not ends:
+            if offset != len(data):
+                raise DecoderError(f'Decoding ended with extra data: {data[offset:].tobytes()}.')
+            return
+        if ends[-1] == _DICT_END:
+            expect_key = not expect_key
+
+
+def _iter_array(data: memoryview, fds: List[Fd], offset: int, fmt: _Format,
+                path: Tuple[NativeType, ...]) -> Iterator[NativeType]:
+    marker_at = fmt.marker_at
+    marker_size = fmt.marker_size
+    skip = fmt.skip
+
+    for depth, key in enumerate(path):
+        type_ = marker_at(data, offset)
+        offset += marker_size
+        if type_ == _ARRAY_START:
+            if not isinstance(key, int) or isinstance(key, bool):
+                raise TypeError(f'Array at {path[:depth]} cannot be indexed with {key!r}.')
+            if key < 0:
+                raise IndexError(f'Negative index: {path[:depth + 1]}.')
+            for _i in range(key):
+                if marker_at(data, offset) == _ARRAY_END:
+                    raise IndexError(f'Index out of range: {path[:depth + 1]}.')
+                offset = skip(data, offset)
+            if marker_at(data, offset) == _ARRAY_END:
+                raise IndexError(f'Index out of range: {path[:depth + 1]}.')
+        elif type_ == _DICT_START:
+            while True:
+                if marker_at(data, offset) == _DICT_END:
+                    raise KeyError(path[:depth + 1])
+                offset, found = _decode(data, fds, offset, fmt)
+                if found == key:
+                    break
+                offset = skip(data, offset)
+        else:
+            raise DecoderError(f'Value at {path[:depth]} cannot be indexed with {key!r}.')
+
+    if marker_at(data, offset) != _ARRAY_START:
+        raise DecoderError(f'Value at {path} is not an array.')
+    offset += marker_size
+    while marker_at(data, offset) != _ARRAY_END:
+        offset, value = _decode(data, fds, offset, fmt)
+        yield value
@@ -0,0 +1,583 @@
+from __future__ import annotations
+import array
+import mmap
+import struct
+import tempfile
+from socket import AF_UNIX, SOCK_SEQPACKET, CMSG_SPACE, SOL_SOCKET, SO_SNDBUF, SCM_RIGHTS, MSG_EOR, MSG_TRUNC, MSG_CTRUNC
+from socket import socket as StdSocket
+from typing import Any, Dict, Iterator, NamedTuple, List, Optional, Sequence, Tuple, Union
+
+from ipc.pool import BufferPool, PooledBuffer
+from ipc.types import Buffer, Bytes, Fd, IPCError, INT_SIZE, INT32_SIZE
+
+HEADER_SIZE = 4 * INT32_SIZE
+SINGLE_RECORD_SIZE = 64 * 1024
+"""The maximal size of a message sent as a single record by PacketFraming, including the header."""
+MAX_FDS = 253
+"""The maximal number of file descriptors passed with a single record (SCM_MAX_FD of Linux)."""
+FRAGMENT_SIZE = 1024 * 1024
+"""The maximal size of body fragments of large messages written by PacketFraming."""
+MAX_MESSAGE_SIZE = 1024 * 1024 * 1024
+"""The default maximal size of a message reassembled from fragments by PacketFraming."""
+MAX_PENDING_SIZE = 256 * 1024 * 1024
+"""The default maximal size of incomplete messages held in memory by PacketFraming."""
+BATCH_BUDGET = 64
+"""The default number of messages PacketFraming reads or writes without yielding to other tasks."""
+
+HEADER = struct.Struct('=IIII')
+"""A msg header of number, flags, body size and the number of fds, in machine byte order."""
+# A header followed by a 32bit framing word, see PacketFraming.
+_FRAMING_HEADER = struct.Struct('=IIIII')
+_FRAMING_CAPABLE = 1
+_FRAMING_SINGLE = 2
+_FRAMING_FRAGMENT = 3
+# A framing header followed by a 32bit message id, a 32bit size and a 64bit offset of a fragment.
+_FRAGMENT_HEADER = struct.Struct('=IIIIIIIQ')
+_ANCILLARY_SIZE = CMSG_SPACE(INT_SIZE * MAX_FDS)
+_RECORD_OVERHEAD = 1024
+# Integers rather than enum members, which are slow to test for every record.
+_MSG_TRUNC = int(MSG_TRUNC)
+_MSG_CTRUNC = int(MSG_CTRUNC)
+
+BATCH_SIZE = 32 * 1024
+"""The default maximal size of message bodies packed into a batch frame."""
+
+# Messages in a batch frame are prefixed with number, flags, body size and the number of fds.
+_BATCH_ENTRY = struct.Struct('=IIII')
+
+
+class Message(NamedTuple):
+    """Message sent/received over a transport."""
+
+    num: int
+    """Message number."""
+    flags: int
+    """Arbitrary flags depending on the protocol."""
+    data: Union[Bytes, List[Bytes]]
+    """
+    Message data.
+
+    Data to write may be a list of segments, which are sent as a single message body
+    without being joined first. Data read are always a single buffer.
+    """
+    fds: List[Fd]
+    """File descriptors passed along with the msg."""
+    buffer: Optional[PooledBuffer] = None
+    """
+    A buffer borrowed from `Transport.pool` holding data of a read message or None.
+
+    Data are then a view of the buffer, which is valid only until the message is released.
+    """
+
+    def release(self) -> None:
+        """Return the buffer of the message to its pool, see BufferPool."""
+        if self.buffer is not None:
+            self.buffer.release()
+
+    def __enter__(self) -> Message:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.release()
+
+
+class TransportError(IPCError):
+    pass
+
+
+class NoDataError(TransportError):
+    pass
+
+
+class WrongSocketError(TransportError):
+    pass
+
+
+class ReadError(TransportError):
+    pass
+
+
+class WriteError(TransportError):
+    pass
+
+
+class WrongDataError(TransportError):
+    pass
+
+
+class PacketFraming:
+    """
+    The framing of messages in records of AF_UNIX SOCK_SEQPACKET socket, independent of any event loop.
+
+    The records are read and written with non-blocking system calls of a standard socket.
+    Subclasses wait for the socket if it is not ready: PacketTransport for trio, AioPacketTransport,
+    QtPacketTransport and SyncPacketTransport, which are all wire-compatible.
+
+    Args:
+        socket: A standard socket.
+        max_message_size: The maximal size of a message reassembled from fragments.
+        batch_budget: The number of messages read or written without yielding to other tasks.
+        max_pending_size: The maximal size of incomplete messages held in memory.
+        spill_size: The minimal size of messages reassembled in a temporary file or None.
+
+    Raises:
+        WrongSocketError: If the passed socket is of a wrong type.
+
+    Protocol:
+        The first SEQPACKET record contains a msg header consisting of four 32bit integer values
+        in machine byte order:
+
+        1. Message number: May be used by a higher level protocol.
+        2. Flags: May be used by a higher level protocol.
+        3. Body size: the size of msg body in bytes.
+        4. FDs count: the count of file descriptors passed with msg body.
+
+        No ancillary data are sent in the first record.
+
+        The second record contains both packet data and ancillary data.
+
+        1. Packet data contain msg body of the size specified in the header.
+        2. If fds count is greater than zero, ancillary data contain that number of file
+          descriptors. Otherwise, no ancillary data is sent.
+
+        The format of msg body is not defined by the transport protocol but by a higher level
+        protocols. The meaning of message number and flags is also opaque for the transport protocol.
+
+        Note that each SEQPACKET record must be read with with a single `recv`/`recvmsg` call.
+        Otherwise, it is not considered as read and the same data are returned in the next call.
+
+        Single-record framing: The header may be followed by a 32bit framing word in machine
+        byte order, which older implementations ignore because they read only `HEADER_SIZE` bytes
+        of the first record and the rest of the record is discarded.
+
+        1. Framing word 1 means that the sender can read single-record messages and fragments.
+          The message body follows in the second record as described above.
+        2. Framing word 2 marks a single-record message. The record contains the header, the framing
+          word and the msg body, together with ancillary data with file descriptors if any.
+        3. Framing word 3 marks the header of a fragment. The framing word is followed by a 32bit
+          message id, a 32bit size of the fragment and a 64bit offset of the fragment in the msg body.
+          The header holds the size of the whole msg body. The next record contains the fragment
+          and, if it is the first fragment with offset 0, file descriptors. Fragments of a message
+          are sent in order, but records of other messages may be sent between them.
+
+        Single-record messages and fragments are sent only after the remote endpoint has sent
+        a framing word. Small messages then take a single `sendmsg` and a single `recvmsg_into` call
+        instead of two. Messages which do not fit in a record, whose size is limited by the size of
+        the socket send buffer (`SO_SNDBUF`), are split into fragments, see `fragment_size`.
+        Fragments are received directly into the buffer of the reassembled message.
+    """
+
+    # The benefit of SOCK_SEQPACKET is that we can separate individual records with MSG_EOR, e.g.
+    # to send msg header first and then msg body with file descriptors.
+    SOCKET_TYPE = AF_UNIX, SOCK_SEQPACKET
+    pool: Optional[BufferPool] = None
+    """
+    A pool to borrow buffers of read messages from or None to allocate a new buffer for each message.
+
+    Read messages must then be released with `Message.release`.
+    """
+    fragment_size: Optional[int] = None
+    """
+    The size of fragments of larger messages or None if messages are not written in fragments.
+
+    Concurrent writes of other messages may be interleaved between the fragments of a message.
+    """
+    single_record: bool = False
+    """Whether the remote endpoint has advertised that it can read single-record messages and fragments."""
+    max_message_size: int
+    """The maximal size of a message reassembled from fragments."""
+    max_pending_size: int
+    """The maximal size of incomplete messages held in memory."""
+    spill_size: Optional[int]
+    """
+    The minimal size of messages reassembled in a temporary file or None to hold them in memory.
+
+    Data of such messages are a view of the file mapped into memory, which the kernel can write
+    back to disk under memory pressure.
+    """
+    batch_budget: int
+    """The number of messages read or written without yielding to other tasks if the socket is ready."""
+    _buffer: Optional[bytearray] = None
+    _view: memoryview
+    _sock: StdSocket
+    _reads: int = 0
+    _writes: int = 0
+    _writing: bool = False
+    _next_id: int = 0
+    _pending: Dict[int, _Reassembly]
+    _pending_size: int = 0
+
+    def __init__(self, socket: StdSocket, *, max_message_size: int = MAX_MESSAGE_SIZE,
+                 max_pending_size: int = MAX_PENDING_SIZE, spill_size: Optional[int] = None,
+                 batch_budget: int = BATCH_BUDGET):
+        type_ = socket.family, socket.type
+        if type_ != self.SOCKET_TYPE:
+            raise WrongSocketError(f'Unsupported socket: {self.SOCKET_TYPE} expected, {type_} passed.')
+        self.max_message_size = max_message_size
+        self.max_pending_size = max_pending_size
+        self.spill_size = spill_size
+        self.batch_budget = batch_budget
+        self._sock = socket
+        self._pending = {}
+
+    def close(self) -> None:
+        """Release resources of the transport. The socket is not closed."""
+
+    def _allocate(self, size: int) -> Tuple[Buffer, Optional[PooledBuffer]]:
+        # Return a buffer for data of a read message, borrowed from the pool if it is set.
+        if self.pool is None:
+            return bytearray(size), None
+        pooled = self.pool.acquire(size)
+        return pooled.view, pooled
+
+    async def _read_message(self) -> Message:
+        while True:
+            msg = await self._read_record()
+            if msg is not None:
+                return msg
+
+    async def _read_record(self) -> Optional[Message]:
+        # Read a record and return a message or None if it is a fragment of an incomplete message.
+        # The first record is either a msg header, a whole single-record message or a fragment header.
+        # It is read into a buffer reused for all messages. Each SEQPACKET record must be read with
+        # with a single recv/recvmsg call with sufficient buffer size.
+        buffer = self._buffer
+        if buffer is None:
+            self._buffer = buffer = bytearray(SINGLE_RECORD_SIZE)
+            self._view = memoryview(buffer)
+        received, ancillary, msg_flags, _address = await self._recvmsg_into([buffer], _ANCILLARY_SIZE)
+        if received == 0:
+            raise NoDataError('Cannot read header.')  # Probably EOF
+        if received < HEADER_SIZE:
+            raise ReadError(f'Incomplete header read: {bytes(buffer[:received])}.')
+        if msg_flags & _MSG_CTRUNC:
+            raise WrongDataError('Ancillary data were truncated.')
+
+        num, flags, data_size, n_fds = HEADER.unpack_from(buffer)
+        framing = _FRAMING_HEADER.unpack_from(buffer)[4] if received >= _FRAMING_HEADER.size else None
+        if framing == _FRAMING_FRAGMENT:
+            self._set_single_record()
+            if msg_flags & _MSG_TRUNC or received != _FRAGMENT_HEADER.size:
+                raise ReadError(f'Incomplete fragment header read: {bytes(buffer[:received])}.')
+            if ancillary:
+                raise WrongDataError('Unexpected ancillary data in header.')
+            return await self._read_fragment(buffer)
+        if framing == _FRAMING_SINGLE:
+            self._set_single_record()
+            if msg_flags & _MSG_TRUNC or received != _FRAMING_HEADER.size + data_size:
+                raise ReadError(f'Incomplete single-record message received: {received} bytes, '
+                                f'{data_size} bytes of body expected.')
+            # The body is copied once from a view of the reused buffer. Peeking the header to receive
+            # the body directly into a pooled buffer would take another system call per record, which
+            # costs more than the copy unless the body is tens of KiB large.
+            body = self._view[_FRAMING_HEADER.size:received]
+            if self.pool is None:
+                data, pooled = bytearray(body), None
+            else:
+                pooled = self.pool.acquire(data_size)
+                data = pooled.view
+                data[:] = body
+        else:
+            if framing == _FRAMING_CAPABLE and received == _FRAMING_HEADER.size:
+                self._set_single_record()
+            elif received != HEADER_SIZE or msg_flags & _MSG_TRUNC:
+                raise ReadError(f'Incomplete header read: {bytes(buffer[:received])}.')
+            if ancillary:
+                raise WrongDataError('Unexpected ancillary data in header.')
+
+            data, pooled = self._allocate(data_size)
+            ancillary_size = CMSG_SPACE(INT_SIZE * n_fds) if n_fds else 0
+
+            # The second record contains a msg body and file descriptors. Each SEQPACKET record
+            # must be read with with a single recv/recvmsg call with sufficient buffer size.
+            try:
+                received, ancillary, _flags, _address = await self._recvmsg_into([data], ancillary_size)
+            except BaseException:
+                if pooled is not None:
+                    pooled.release()
+                raise
+            if received != data_size:
+                if pooled is not None:
+                    pooled.release()
+                raise ReadError(f'Incomplete body received: {received}/{data_size} bytes.')
+
+        return Message(num, flags, data, _receive_fds(ancillary, n_fds), pooled)
+
+    def _set_single_record(self) -> None:
+        self.single_record = True
+        if self.fragment_size is None:
+            # A record must fit in the send buffer, so fragments leave room for its overhead.
+            send_buffer = self._sock.getsockopt(SOL_SOCKET, SO_SNDBUF)
+            self.fragment_size = min(FRAGMENT_SIZE, send_buffer - _RECORD_OVERHEAD)
+
+    async def _read_fragment(self, header: bytearray) -> Optional[Message]:
+        num, flags, data_size, n_fds, _framing, id_, size, offset = _FRAGMENT_HEADER.unpack_from(header)
+        if offset == 0:
+            if id_ in self._pending:
+                raise WrongDataError(f'Fragmented message #{id_} has been already started.')
+            if data_size > self.max_message_size:
+                raise WrongDataError(f'Fragmented message is too large: {data_size}/{self.max_message_size} bytes.')
+            spilled = self.spill_size is not None and data_size >= self.spill_size
+            if spilled:
+                data: Buffer = _spill(data_size)
+                pooled = None
+            else:
+                if self._pending_size + data_size > self.max_pending_size:
+                    raise WrongDataError(f'Incomplete messages exceed {self.max_pending_size} bytes.')
+                self._pending_size += data_size
+                data, pooled = self._allocate(data_size)
+            self._pending[id_] = partial = _Reassembly(num, flags, data, pooled, spilled)
+            ancillary_size = CMSG_SPACE(INT_SIZE * n_fds) if n_fds else 0
+        else:
+            partial = self._pending.get(id_)
+            if partial is None:
+                raise WrongDataError(f'Fragment of an unknown message #{id_}.')
+            ancillary_size = 0
+
+        if offset != partial.received or offset + size > len(partial.data):
+            raise WrongDataError(f'Unexpected fragment of message #{id_}: {size} bytes at offset {offset}, '
+                                 f'{partial.received}/{len(partial.data)} bytes received.')
+
+        # The next record contains the fragment, which is received directly into the message buffer.
+        view = memoryview(partial.data)[offset:offset + size]
+        try:
+            received, ancillary, _flags, _address = await self._recvmsg_into([view], ancillary_size)
+        finally:
+            view.release()
+        if received != size:
+            raise ReadError(f'Incomplete fragment received: {received}/{size} bytes.')
+        if offset == 0:
+            partial.fds = _receive_fds(ancillary, n_fds)
+        elif ancillary:
+            raise WrongDataError('Unexpected ancillary data in fragment.')
+        partial.received += size
+        if partial.received < len(partial.data):
+            return None
+
+        del self._pending[id_]
+        if not partial.spilled:
+            self._pending_size -= len(partial.data)
+        return Message(partial.num, partial.flags, partial.data, partial.fds, partial.pooled)
+
+    async def _write_message(self, msg: Message) -> None:
+        if msg.fds:
+            # File descriptors are sent as native integer array.
+            ancillary = [(SOL_SOCKET, SCM_RIGHTS, array.array('i', [fd.get() for fd in msg.fds]))]
+            n_fds = len(msg.fds)
+        else:
+            ancillary = []
+            n_fds = 0
+
+        # Segments are passed to sendmsg as an iovec list, so they are not joined in user space.
+        segments = msg.data if isinstance(msg.data, list) else [msg.data]
+        body_size = sum(memoryview(segment).nbytes for segment in segments)
+
+        if self.fragment_size is not None and body_size > self.fragment_size:
+            await self._write_fragments(msg, segments, body_size, ancillary)
+            return
+
+        await self._acquire_writing()
+        try:
+            if self.single_record and _FRAMING_HEADER.size + body_size <= SINGLE_RECORD_SIZE:
+                # A single record contains a msg header, a msg body and file descriptors.
+                header = _FRAMING_HEADER.pack(msg.num, msg.flags, body_size, n_fds, _FRAMING_SINGLE)
+                sent = await self._sendmsg([header, *segments], ancillary, MSG_EOR)
+                if sent != len(header) + body_size:
+                    raise WriteError(f'Incomplete message written: {sent}/{len(header) + body_size} bytes.')
+                return
+
+            # The first record is a msg header without any ancillary data. MSG_EOR ends the record.
+            # The framing word advertises single-record messages and older readers ignore it.
+            header = _FRAMING_HEADER.pack(msg.num, msg.flags, body_size, n_fds, _FRAMING_CAPABLE)
+            sent = await self._sendmsg([header], [], MSG_EOR)
+            if sent != len(header):
+                raise WriteError(f'Incomplete header written: {sent}/{len(header)} bytes.')
+
+            # The second record contains a msg body and file descriptors. MSG_EOR ends the record.
+            sent = await self._sendmsg(segments, ancillary, MSG_EOR)
+            if sent != body_size:
+                raise WriteError(f'Incomplete body written: {sent}/{body_size} bytes.')
+        finally:
+            self._release_writing()
+
+    async def _recvmsg_into(self, buffers: List[Buffer], ancillary_size: int) -> Tuple[int, list, int, Any]:
+        # Receive a record with a non-blocking call and wait for the socket if it is not ready.
+        raise NotImplementedError
+
+    async def _sendmsg(self, buffers: List[Bytes], ancillary: list, flags: int) -> int:
+        # Send a record with a non-blocking call and wait for the socket if it is not ready.
+        raise NotImplementedError
+
+    async def _acquire_writing(self) -> None:
+        # Records of a message are written by a single coroutine at a time. Subclasses whose coroutines
+        # write concurrently hand writing over to waiting coroutines, see PacketTransport.
+        if self._writing:
+            raise RuntimeError('Concurrent writes are not supported.')
+        self._writing = True
+
+    def _release_writing(self) -> None:
+        self._writing = False
+
+    async def _write_fragments(self, msg: Message, segments: List[Bytes], body_size: int, ancillary: list) -> None:
+        id_ = self._next_id
+        self._next_id = (id_ + 1) & 0xFFFFFFFF
+        offset = 0
+        for chunk in _split(segments, self.fragment_size):
+            size = sum(view.nbytes for view in chunk)
+            header = _FRAGMENT_HEADER.pack(msg.num, msg.flags, body_size, len(msg.fds), _FRAMING_FRAGMENT,
+                                           id_, size, offset)
+            # Writing is acquired only for a single fragment, so that concurrent writes of other
+            # messages take turns with fragments.
+            await self._acquire_writing()
+            try:
+                sent = await self._sendmsg([header], [], MSG_EOR)
+                if sent != len(header):
+                    raise WriteError(f'Incomplete fragment header written: {sent}/{len(header)} bytes.')
+                sent = await self._sendmsg(chunk, ancillary if offset == 0 else [], MSG_EOR)
+                if sent != size:
+                    raise WriteError(f'Incomplete fragment written: {sent}/{size} bytes.')
+            finally:
+                self._release_writing()
+            offset += size
+
+
+def message_size(msg: Message) -> int:
+    """Return the size of the body of a message, whose data may be a list of segments."""
+    if isinstance(msg.data, list):
+        return sum(memoryview(segment).nbytes for segment in msg.data)
+    return memoryview(msg.data).nbytes
+
+
+def pack_batch(batch: Sequence[tuple], max_size: int, flags: int) -> List[Tuple[Message, int]]:
+    """
+    Pack messages into batch frames.
+
+    Args:
+        batch: Queued items, tuples whose first item is a message.
+        max_size: The maximal size of message bodies in a frame.
+        flags: Flags of batch frames.
+
+    Returns:
+        Pairs of (a frame, the number of messages in it). A single message is not wrapped in a frame.
+    """
+    frames = []
+    start = 0
+    while start < len(batch):
+        end = start
+        size = n_fds = 0
+        segments: List[Bytes] = []
+        fds: List[Fd] = []
+        # A frame holds at least one message and as many following messages as fit.
+        while end < len(batch):
+            msg = batch[end][0]
+            body_size = message_size(msg)
+            if end > start and (size + body_size > max_size or n_fds + len(msg.fds) > MAX_FDS):
+                break
+            segments.append(_BATCH_ENTRY.pack(msg.num, msg.flags, body_size, len(msg.fds)))
+            segments += msg.data if isinstance(msg.data, list) else [msg.data]
+            fds += msg.fds
+            size += body_size
+            n_fds += len(msg.fds)
+            end += 1
+        if end - start == 1:
+            frames.append((batch[start][0], 1))
+        else:
+            # Bodies of batched messages are small, so they are joined rather than sent as many segments.
+            frames.append((Message(0, flags, b''.join(segments), fds), end - start))
+        start = end
+    return frames
+
+
+def unpack_batch(frame: Message, pool: Optional[BufferPool]) -> List[Message]:
+    """
+    Unpack messages from a batch frame.
+
+    Data of the messages are copied, into buffers borrowed from the pool if it is set.
+
+    Raises:
+        WrongDataError: If the frame is malformed.
+    """
+    messages = []
+    data = frame.data
+    offset = n_fds = 0
+    try:
+        while offset < len(data):
+            num, flags, size, count = _BATCH_ENTRY.unpack_from(data, offset)
+            offset += _BATCH_ENTRY.size
+            if offset + size > len(data) or n_fds + count > len(frame.fds):
+                raise WrongDataError('Batch frame is truncated.')
+            if pool is None:
+                body, pooled = data[offset:offset + size], None
+            else:
+                pooled = pool.acquire(size)
+                body = pooled.view
+                body[:] = data[offset:offset + size]
+            messages.append(Message(num, flags, body, frame.fds[n_fds:n_fds + count], pooled))
+            offset += size
+            n_fds += count
+    except struct.error as e:
+        raise WrongDataError(f'Malformed batch frame: {e}')
+    if n_fds != len(frame.fds):
+        raise WrongDataError(f'Wrong number of fds in batch frame: {len(frame.fds)} received, {n_fds} used.')
+    return messages
+
+
+class _Reassembly:
+    """A message being reassembled from fragments."""
+
+    num: int
+    flags: int
+    data: Buffer
+    fds: List[Fd]
+    pooled: Optional[PooledBuffer]
+    spilled: bool
+    received: int = 0
+
+    def __init__(self, num: int, flags: int, data: Buffer, pooled: Optional[PooledBuffer], spilled: bool):
+        self.num = num
+        self.flags = flags
+        self.data = data
+        self.fds = []
+        self.pooled = pooled
+        self.spilled = spilled
+
+
+def _receive_fds(ancillary: list, n_fds: int) -> List[Fd]:
+    fds: List[Fd] = []
+    for level, type_, extra_data in ancillary:
+        if level != SOL_SOCKET or type_ != SCM_RIGHTS:
+            raise WrongDataError(
+                f'Unsupported ancillary data: level={level}, type={type_}, data={extra_data}')
+
+        # File descriptors are received as native integer array.
+        fds += [Fd(i) for i in array.array('i', extra_data)]
+
+    if len(fds) != n_fds:
+        raise WrongDataError(f'Wrong number of fds: {n_fds} expected, {len(fds)} received.')
+    return fds
+
+
+def _split(segments: List[Bytes], size: int) -> Iterator[List[memoryview]]:
+    # Split segments into chunks of the given size without copying them.
+    chunk: List[memoryview] = []
+    chunk_size = 0
+    for segment in segments:
+        view = memoryview(segment).cast('B')
+        while view.nbytes:
+            part = view[:size - chunk_size]
+            chunk.append(part)
+            chunk_size += part.nbytes
+            view = view[part.nbytes:]
+            if chunk_size == size:
+                yield chunk
+                chunk = []
+                chunk_size = 0
+    if chunk:
+        yield chunk
+
+
+def _spill(size: int) -> memoryview:
+    # A temporary file is removed at once and its mapping is kept until the view is released.
+    with tempfile.TemporaryFile(prefix='ipc-') as file:
+        file.truncate(size)
+        return memoryview(mmap.mmap(file.fileno(), size))
@@ -0,0 +1,474 @@
+from __future__ import annotations
+import struct
+from typing import List, Union, Any, Dict, Iterator, Sequence, Mapping, Optional, Tuple, NamedTuple, Callable
+
+from ipc.codecs import NativeCodec, NativeType, Markers, DecoderError, VERSION_2_MAGIC
+from ipc.codecs import _FALSE, _TRUE, _NONE, _INT64, _DOUBLE, _STRING, _BYTES, _FD, _MEMFD
+from ipc.codecs import _ARRAY_START, _ARRAY_END, _DICT_START, _DICT_END, _TYPED_ARRAY, _UINT32, _UINT64, _FLOAT64
+from ipc.codecs import _V2_FIXINT, _V2_FIXSTR, _V2_FIXBYTES, _V2_FIXREF, _MAX_NDIM, _deserialize, _deserialize_v2
+from ipc.codecs import _typed_array_at, _typed_array_at_v2, _copy_typed_array
+from ipc.convert import varint_from_bytes, zigzag_decode
+from ipc.memfd import map_sealed
+from ipc.protocol import Peer
+from ipc.types import Fd, Bytes
+
+_UNSET = object()
+# The size of values indexed by markers, -1 for values prefixed with their size, -2 for typed arrays,
+# -3 for markers valid only in version 2.
+_SIZES = (4, 4, 4, 12, 12, -1, -1, 4, 4, 4, 4, 8, -2, -3, -3, 16)
+
+
+class LazyNativeCodec(NativeCodec):
+    """
+    Native codec decoding messages lazily.
+
+    The encoding is the same as for NativeCodec, but decoding at most validates the structure of
+    the message. Arrays and dictionaries are returned as LazyList and LazyDict proxies decoding
+    their items on access, and binary data are returned as read-only memoryviews of the message
+    data instead of copies.
+
+    Decoded values may reference the message data, so they must not be used after the data
+    are modified. Use `materialize` to convert them to native Python types.
+
+    Args:
+        version: See NativeCodec.
+        connection: See NativeCodec.
+        validate: Whether to validate the structure of whole messages before returning them.
+            Skipping validation makes decoding of messages with large nested values nearly free
+            when handlers only access a few items, e.g. `msg[0]` to route on a method name.
+    """
+
+    validate: bool
+    """Whether to validate the structure of whole messages before returning them."""
+
+    def __init__(self, version: int = 1, connection: Optional[Peer] = None, *, validate: bool = True):
+        super().__init__(version, connection)
+        self.validate = validate
+
+    def decode(self, data: Bytes, fds: List[Fd]) -> NativeType:
+        """
+        Decode a message consisting of a subset of native Python types lazily.
+
+        See function deserialize_lazy for details.
+        """
+        return deserialize_lazy(data, fds, validate=self.validate)
+
+
+def deserialize_lazy(data: Union[bytes, bytearray, memoryview], fds: List[Fd], *,
+                     validate: bool = True) -> NativeType:
+    """
+    Deserialize data to subset of native Python types lazily.
+
+    The structure of the data is optionally validated first without decoding any values. Scalar
+    values are decoded, binary data are returned as read-only memoryviews of the data and arrays
+    and dictionaries are returned as LazyList and LazyDict proxies.
+
+    Args:
+        data: Data to deserialize.
+        fds: File descriptors to attach to deserialized data.
+        validate: Whether to find the end of the top-level value and check there is no extra data.
+            Otherwise, malformed data are only detected when the affected values are accessed.
+
+    Returns:
+         Deserialized data.
+
+    Raises:
+        DecoderError: On failure. Decoding of nested values may fail later when they are accessed,
+            e.g. because of invalid UTF-8 strings or file descriptor indexes.
+    """
+    if not isinstance(data, memoryview):
+        data = memoryview(data)
+    if data.format != 'B' or data.ndim != 1:
+        data = data.cast('B')
+    data = data.toreadonly()
+
+    fmt, offset = (_V2, 1) if data and data[0] == VERSION_2_MAGIC else (_V1, 0)
+    if validate:
+        end = fmt.skip(data, offset)
+        if end != len(data):
+            raise DecoderError(f'Decoding ended with extra data: {data[end:].tobytes()}.')
+    return fmt.decode_at(data, fds, offset)[0]
+
+
+def materialize(value: NativeType) -> NativeType:
+    """
+    Convert a lazily decoded value to native Python types.
+
+    LazyList and LazyDict proxies are fully decoded, binary data are copied to bytes and typed arrays
+    are copied to read-only memoryviews of the same type code and shape, so the result no longer
+    references message data. Sealed memfds nested in arrays and dictionaries stay mapped as with
+    function deserialize, because their views reference the memfd rather than message data.
+
+    Args:
+        value: The value to convert.
+
+    Returns:
+        A value without lazy proxies.
+
+    Raises:
+        DecoderError: On failure.
+    """
+    if isinstance(value, (LazyList, LazyDict)):
+        return value.materialize()
+    if isinstance(value, memoryview):
+        if value.format == 'B' and value.ndim == 1:
+            return value.tobytes()
+        return _copy_typed_array(value)
+    return value
+
+
+class LazyList(Sequence[NativeType]):
+    """
+    A read-only list decoding its items on access.
+
+    Offsets of items are found when they are first needed by skipping over the preceding items,
+    and decoded items are cached.
+
+    Args:
+        data: Message data.
+        fds: File descriptors of the message.
+        offset: The offset of the array start marker in data.
+        fmt: The wire format of data.
+    """
+
+    def __init__(self, data: memoryview, fds: List[Fd], offset: int, fmt: _Format):
+        self._data = data
+        self._fds = fds
+        self._format = fmt
+        self._start = offset
+        self._next = offset + fmt.marker_size
+        self._offsets: List[int] = []
+        self._values: List[Any] = []
+        self._complete = False
+
+    def __len__(self) -> int:
+        self._scan()
+        return len(self._offsets)
+
+    def __getitem__(self, index: Union[int, slice]) -> NativeType:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            self._scan()
+            index += len(self._offsets)
+        else:
+            self._scan(index)
+        if not 0 <= index < len(self._offsets):
+            raise IndexError('LazyList index out of range')
+
+        value = self._values[index]
+        if value is _UNSET:
+            value = self._values[index] = self._format.decode_at(self._data, self._fds, self._offsets[index])[0]
+        return value
+
+    def __iter__(self) -> Iterator[NativeType]:
+        index = 0
+        while True:
+            self._scan(index)
+            if index >= len(self._offsets):
+                return
+            yield self[index]
+            index += 1
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, (list, tuple, LazyList)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __repr__(self) -> str:
+        return repr(self.materialize())
+
+    def materialize(self) -> list:
+        """Decode the whole array to native Python types."""
+        return _materialize(self._data, self._fds, self._start, self._format)
+
+    def _scan(self, index: Optional[int] = None) -> None:
+        # Find offsets of items up to the index or of all items.
+        data = self._data
+        offsets = self._offsets
+        fmt = self._format
+        while not self._complete and (index is None or len(offsets) <= index):
+            if fmt.marker_at(data, self._next) == _ARRAY_END:
+                self._complete = True
+                self._next += fmt.marker_size
+            else:
+                offsets.append(self._next)
+                self._values.append(_UNSET)
+                self._next = fmt.skip(data, self._next)
+
+
+class LazyDict(Mapping[NativeType, NativeType]):
+    """
+    A read-only dictionary decoding its values on access.
+
+    All keys are decoded on first access, binary keys are copied to bytes. Decoded values are cached.
+
+    Args:
+        data: Message data.
+        fds: File descriptors of the message.
+        offset: The offset of the dictionary start marker in data.
+        fmt: The wire format of data.
+    """
+
+    def __init__(self, data: memoryview, fds: List[Fd], offset: int, fmt: _Format):
+        self._data = data
+        self._fds = fds
+        self._format = fmt
+        self._start = offset
+        self._offsets: Optional[Dict[Any, int]] = None
+        self._values: Dict[Any, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self._scan())
+
+    def __getitem__(self, key: NativeType) -> NativeType:
+        offsets = self._scan()
+        try:
+            return self._values[key]
+        except KeyError:
+            value = self._values[key] = self._format.decode_at(self._data, self._fds, offsets[key])[0]
+            return value
+
+    def __iter__(self) -> Iterator[NativeType]:
+        return iter(self._scan())
+
+    def __repr__(self) -> str:
+        return repr(self.materialize())
+
+    def materialize(self) -> dict:
+        """Decode the whole dictionary to native Python types."""
+        return _materialize(self._data, self._fds, self._start, self._format)
+
+    def _scan(self) -> Dict[Any, int]:
+        # Decode all keys and find offsets of values.
+        offsets = self._offsets
+        if offsets is None:
+            offsets = {}
+            data = self._data
+            fmt = self._format
+            offset = self._start + fmt.marker_size
+            while fmt.marker_at(data, offset) != _DICT_END:
+                key, offset = fmt.decode_at(data, self._fds, offset)
+                if isinstance(key, memoryview):
+                    key = key.tobytes()
+                elif isinstance(key, (LazyList, LazyDict)):
+                    raise DecoderError(f'Unhashable key: {key!r}.')
+                offsets[key] = offset
+                offset = fmt.skip(data, offset)
+            self._offsets = offsets
+        return offsets
+
+
+class _Format(NamedTuple):
+    """Functions to decode a version of the wire format lazily."""
+
+    marker_size: int
+    marker_at: Callable[[memoryview, int], int]
+    decode_at: Callable[[memoryview, List[Fd], int], Tuple[NativeType, int]]
+    skip: Callable[[memoryview, int], int]
+    deserialize: Callable[..., Tuple[int, NativeType]]
+
+
+def _materialize(data: memoryview, fds: List[Fd], offset: int, fmt: _Format) -> NativeType:
+    try:
+        return fmt.deserialize(fds, data, offset, copy_arrays=True)[1]
+    except (ValueError, IndexError, TypeError, struct.error) as e:
+        raise DecoderError(f'Decoder failure: {e}')
+
+
+def _marker_at(data: memoryview, offset: int) -> int:
+    try:
+        return _UINT32.unpack_from(data, offset)[0]
+    except struct.error as e:
+        raise DecoderError(f'Decoder failure: {e}')
+
+
+def _decode_at(data: memoryview, fds: List[Fd], offset: int) -> Tuple[NativeType, int]:
+    # Decode a value at the offset and return it with the offset of the next value.
+    try:
+        type_, = _UINT32.unpack_from(data, offset)
+        if type_ == _STRING or type_ == _BYTES:
+            end = offset + 8 + _UINT32.unpack_from(data, offset + 4)[0]
+            if end > len(data):
+                raise DecoderError(f'Value exceeds data by {end - len(data)} bytes.')
+            if type_ == _STRING:
+                return str(data[offset + 8:end], encoding='utf-8'), end
+            return data[offset + 8:end], end
+        if type_ == _INT64:
+            return _UINT64.unpack_from(data, offset + 4)[0], offset + 12
+        if type_ == _NONE:
+            return None, offset + 4
+        if type_ == _FALSE:
+            return False, offset + 4
+        if type_ == _TRUE:
+            return True, offset + 4
+        if type_ == _DOUBLE:
+            return _FLOAT64.unpack_from(data, offset + 4)[0], offset + 12
+        if type_ == _FD:
+            return fds[_UINT32.unpack_from(data, offset + 4)[0]], offset + 8
+        if type_ == _MEMFD:
+            index, = _UINT32.unpack_from(data, offset + 4)
+            return map_sealed(fds[index], _UINT64.unpack_from(data, offset + 8)[0]), offset + 16
+        if type_ == _TYPED_ARRAY:
+            return _typed_array_v1_at(data, offset)
+        # The end of a container is not known until it is scanned.
+        if type_ == _ARRAY_START:
+            return LazyList(data, fds, offset, _V1), -1
+        if type_ == _DICT_START:
+            return LazyDict(data, fds, offset, _V1), -1
+        if type_ == _ARRAY_END or type_ == _DICT_END:
+            raise DecoderError(f'Value cannot be {Markers(type_)}.')
+    except (ValueError, IndexError, struct.error) as e:
+        raise DecoderError(f'Decoder failure: {e}')
+    raise DecoderError(f'Unknown data type: {type_}.')
+
+
+def _typed_array_v1_at(data: memoryview, offset: int) -> Tuple[memoryview, int]:
+    # Decode a typed array at the offset of its marker.
+    typecode, ndim = _UINT32.unpack_from(data, offset + 4)[0], _UINT32.unpack_from(data, offset + 8)[0]
+    if ndim > _MAX_NDIM:
+        raise DecoderError(f'Too many dimensions of typed array: {ndim}.')
+    shape = struct.unpack_from(f'={ndim}Q', data, offset + 12)
+    return _typed_array_at(data, offset + 12 + 8 * ndim, typecode, shape)
+
+
+def _skip(data: memoryview, offset: int) -> int:
+    # Find the end of a value at the offset without decoding it. The stack holds expected end markers.
+    unpack_uint32 = _UINT32.unpack_from
+    sizes = _SIZES
+    stack: List[int] = []
+
+    try:
+        while True:
+            type_, = unpack_uint32(data, offset)
+            size = sizes[type_]
+            if size == -1:
+                offset += 8 + unpack_uint32(data, offset + 4)[0]
+            elif size == -2:
+                offset = _typed_array_v1_at(data, offset)[1]
+            elif size == -3:
+                raise DecoderError(f'Unknown data type: {type_}.')
+            elif type_ == _ARRAY_START or type_ == _DICT_START:
+                stack.append(type_ + 1)
+                offset += 4
+                continue
+            elif type_ == _ARRAY_END or type_ == _DICT_END:
+                if not stack or stack.pop() != type_:
+                    raise DecoderError(f'Value cannot be {Markers(type_)}.')
+                offset += 4
+            else:
+                offset += size
+
+            if not stack:
+                if offset > len(data):
+                    raise DecoderError(f'Value exceeds data by {offset - len(data)} bytes.')
+                return offset
+    except IndexError:
+        raise DecoderError(f'Unknown data type: {type_}.')
+    except struct.error as e:
+        raise DecoderError(f'Decoder failure: {e}')
+
+
+def _marker_at_v2(data: memoryview, offset: int) -> int:
+    try:
+        return data[offset]
+    except IndexError as e:
+        raise DecoderError(f'Decoder failure: {e}')
+
+
+def _decode_at_v2(data: memoryview, fds: List[Fd], offset: int) -> Tuple[NativeType, int]:
+    # Decode a value at the offset and return it with the offset of the next value.
+    try:
+        type_ = data[offset]
+        offset += 1
+        if _V2_FIXINT <= type_ < _V2_FIXSTR:
+            return type_ - _V2_FIXINT, offset
+        if _V2_FIXSTR <= type_ < _V2_FIXREF or type_ == _STRING or type_ == _BYTES:
+            if type_ >= _V2_FIXSTR:
+                end = offset + (type_ & 0x3F)
+            else:
+                end, offset = varint_from_bytes(data, offset)
+                end += offset
+            if end > len(data):
+                raise DecoderError(f'Value exceeds data by {end - len(data)} bytes.')
+            if type_ == _STRING or _V2_FIXSTR <= type_ < _V2_FIXBYTES:
+                return str(data[offset:end], encoding='utf-8'), end
+            return data[offset:end], end
+        if type_ == _INT64:
+            value, offset = varint_from_bytes(data, offset, 65)
+            return zigzag_decode(value), offset
+        if type_ == _NONE:
+            return None, offset
+        if type_ == _FALSE:
+            return False, offset
+        if type_ == _TRUE:
+            return True, offset
+        if type_ == _DOUBLE:
+            return _FLOAT64.unpack_from(data, offset)[0], offset + 8
+        if type_ == _FD:
+            index, offset = varint_from_bytes(data, offset)
+            return fds[index], offset
+        if type_ == _MEMFD:
+            index, offset = varint_from_bytes(data, offset)
+            size, offset = varint_from_bytes(data, offset)
+            return map_sealed(fds[index], size), offset
+        if type_ == _TYPED_ARRAY:
+            return _typed_array_at_v2(data, offset)
+        # The end of a container is not known until it is scanned.
+        if type_ == _ARRAY_START:
+            return LazyList(data, fds, offset - 1, _V2), -1
+        if type_ == _DICT_START:
+            return LazyDict(data, fds, offset - 1, _V2), -1
+        if type_ == _ARRAY_END or type_ == _DICT_END:
+            raise DecoderError(f'Value cannot be {Markers(type_)}.')
+    except (ValueError, IndexError, struct.error) as e:
+        raise DecoderError(f'Decoder failure: {e}')
+    raise DecoderError(f'Unknown data type: {type_}.')
+
+
+def _skip_v2(data: memoryview, offset: int) -> int:
+    # Find the end of a value at the offset without decoding it. The stack holds expected end markers.
+    stack: List[int] = []
+
+    try:
+        while True:
+            type_ = data[offset]
+            offset += 1
+            if type_ >= _V2_FIXINT:
+                if type_ >= _V2_FIXREF:
+                    raise DecoderError(f'Unknown data type: {type_}.')
+                if type_ >= _V2_FIXSTR:
+                    offset += type_ & 0x3F
+            elif type_ == _STRING or type_ == _BYTES:
+                size, offset = varint_from_bytes(data, offset)
+                offset += size
+            elif type_ == _INT64:
+                offset = varint_from_bytes(data, offset, 65)[1]
+            elif type_ == _FD:
+                offset = varint_from_bytes(data, offset)[1]
+            elif type_ == _DOUBLE:
+                offset += 8
+            elif type_ == _MEMFD:
+                offset = varint_from_bytes(data, offset)[1]
+                offset = varint_from_bytes(data, offset)[1]
+            elif type_ == _TYPED_ARRAY:
+                offset = _typed_array_at_v2(data, offset)[1]
+            elif type_ == _ARRAY_START or type_ == _DICT_START:
+                stack.append(type_ + 1)
+                continue
+            elif type_ == _ARRAY_END or type_ == _DICT_END:
+                if not stack or stack.pop() != type_:
+                    raise DecoderError(f'Value cannot be {Markers(type_)}.')
+            elif type_ > _TYPED_ARRAY:
+                raise DecoderError(f'Unknown data type: {type_}.')
+
+            if not stack:
+                if offset > len(data):
+                    raise DecoderError(f'Value exceeds data by {offset - len(data)} bytes.')
+                return offset
+    except (ValueError, IndexError) as e:
+        raise DecoderError(f'Decoder failure: {e}')
+
+
+_V1 = _Format(4, _marker_at, _decode_at, _skip, _deserialize)
+_V2 = _Format(1, _marker_at_v2, _decode_at_v2, _skip_v2, _deserialize_v2)
@@ -0,0 +1,130 @@
+from __future__ import annotations
+import mmap
+import os
+from typing import Optional
+
+from ipc.types import Fd, Bytes
+
+try:
+    from fcntl import fcntl, F_ADD_SEALS, F_GET_SEALS, F_SEAL_SEAL, F_SEAL_SHRINK, F_SEAL_GROW, F_SEAL_WRITE
+    from os import memfd_create, MFD_CLOEXEC, MFD_ALLOW_SEALING
+except ImportError:
+    # Sealed memfds are Linux-only.
+    memfd_create = None
+
+SEALS = (F_SEAL_SEAL | F_SEAL_SHRINK | F_SEAL_GROW | F_SEAL_WRITE) if memfd_create is not None else 0
+"""Seals of memfds making them immutable."""
+_NAME = 'ipc-buffer'
+
+
+class SealedBuffer:
+    """
+    A buffer in a memfd, which is sealed and sent as a file descriptor by NativeCodec.
+
+    The producer can write data directly into the buffer, so that they are never copied. The buffer
+    is sealed when it is encoded, or explicitly with `seal`. Views of `view` must be released before.
+
+    Args:
+        size: The size of the buffer in bytes.
+
+    Raises:
+        OSError: If the memfd cannot be created.
+    """
+
+    fd: Fd
+    """The file descriptor of the memfd."""
+    size: int
+    """The size of the buffer in bytes."""
+    _mmap: Optional[mmap.mmap] = None
+    _sealed: bool = False
+
+    def __init__(self, size: int):
+        if memfd_create is None:
+            raise OSError('Sealed memfds are not supported.')
+        self.fd = Fd(memfd_create(_NAME, MFD_CLOEXEC | MFD_ALLOW_SEALING))
+        self.size = size
+        os.ftruncate(self.fd.get(), size)
+
+    @classmethod
+    def from_bytes(cls, data: Bytes) -> SealedBuffer:
+        """
+        Create a sealed buffer holding a copy of data.
+
+        Args:
+            data: Data to copy.
+
+        Returns:
+            A sealed buffer.
+        """
+        view = memoryview(data).cast('B')
+        buffer = cls(view.nbytes)
+        fd = buffer.fd.get()
+        offset = 0
+        while offset < view.nbytes:
+            offset += os.pwrite(fd, view[offset:], offset)
+        buffer.seal()
+        return buffer
+
+    @property
+    def sealed(self) -> bool:
+        """Whether the buffer is sealed."""
+        return self._sealed
+
+    @property
+    def view(self) -> memoryview:
+        """A writable view of the buffer before it is sealed."""
+        if self._sealed:
+            raise ValueError('The buffer is sealed.')
+        if not self.size:
+            return memoryview(bytearray())
+        if self._mmap is None:
+            self._mmap = mmap.mmap(self.fd.get(), self.size)
+        return memoryview(self._mmap)
+
+    def seal(self) -> None:
+        """
+        Seal the buffer, so that it can be neither modified nor resized.
+
+        Raises:
+            BufferError: If views of `view` have not been released.
+            OSError: If the buffer cannot be sealed.
+        """
+        if self._sealed:
+            return
+        if self._mmap is not None:
+            # A writable shared mapping prevents the write seal.
+            self._mmap.close()
+            self._mmap = None
+        fcntl(self.fd.get(), F_ADD_SEALS, SEALS)
+        self._sealed = True
+
+
+def map_sealed(fd: Fd, size: int) -> memoryview:
+    """
+    Map a sealed memfd received as a file descriptor.
+
+    Args:
+        fd: The file descriptor of the memfd.
+        size: The expected size of the memfd.
+
+    Returns:
+        A read-only view of the memfd.
+
+    Raises:
+        ValueError: If the file descriptor is not a memfd sealed against writing and resizing
+            or if its size is wrong.
+    """
+    if memfd_create is None:
+        raise ValueError('Sealed memfds are not supported.')
+    required = SEALS & ~F_SEAL_SEAL
+    try:
+        if fcntl(fd.get(), F_GET_SEALS) & required != required:
+            raise ValueError(f'The file descriptor {fd} is not a sealed memfd.')
+        actual = os.fstat(fd.get()).st_size
+        if actual != size:
+            raise ValueError(f'The size of the sealed memfd {fd} is {actual} instead of {size} bytes.')
+        if not size:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(fd.get(), size, mmap.MAP_SHARED, mmap.PROT_READ))
+    except OSError as e:
+        raise ValueError(f'Cannot map the sealed memfd {fd}: {e}')
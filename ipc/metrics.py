@@ -0,0 +1,246 @@
+from __future__ import annotations
+import json
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+BUCKETS = 32
+"""The number of buckets of Histogram, the last one holds durations of 2**30 µs and more."""
+MAX_METHODS = 256
+"""The default maximal number of methods ConnectionStats keeps statistics of, see `ConnectionStats.method`."""
+OTHER_METHOD = 'other'
+"""The name of methods beyond `ConnectionStats.max_methods`."""
+
+
+class Histogram:
+    """
+    A histogram of durations in buckets of powers of two of microseconds.
+
+    Adding a duration takes a few operations, so histograms can be updated for every message.
+    Quantiles are estimated as upper bounds of buckets, i.e. within a factor of two.
+    """
+
+    count: int = 0
+    """The number of durations."""
+    total: float = 0.0
+    """The sum of durations in seconds."""
+    max: float = 0.0
+    """The maximal duration in seconds."""
+    buckets: List[int]
+    """The number of durations of at least 2**(i-1) µs and less than 2**i µs in each bucket i."""
+
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+
+    @property
+    def mean(self) -> float:
+        """The mean duration in seconds."""
+        return self.total / self.count if self.count else 0.0
+
+    def add(self, duration: float) -> None:
+        """
+        Add a duration.
+
+        Args:
+            duration: A duration in seconds.
+        """
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        self.buckets[min(int(duration * 1e6).bit_length(), BUCKETS - 1)] += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile.
+
+        Args:
+            q: The quantile between 0 and 1, e.g. 0.99.
+
+        Returns:
+            The upper bound of the bucket holding the quantile in seconds, at most `max`.
+        """
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    def merge(self, other: Histogram) -> None:
+        """Add durations of another histogram."""
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the count, the mean, the maximum and quantiles in seconds as a dictionary."""
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+        }
+
+
+class MethodStats:
+    """Statistics of messages of a single method, see `Connection.method_key`."""
+
+    sent: int = 0
+    """The number of sent requests and notifications."""
+    handled: int = 0
+    """The number of handled requests and notifications."""
+    errors: int = 0
+    """The number of failed requests and handlers."""
+    round_trip: Histogram
+    """Round-trip times of sent requests."""
+    handler: Histogram
+    """Durations of handlers of received requests and notifications."""
+
+    def __init__(self):
+        self.round_trip = Histogram()
+        self.handler = Histogram()
+
+    def merge(self, other: MethodStats) -> None:
+        """Add statistics of another method."""
+        self.sent += other.sent
+        self.handled += other.handled
+        self.errors += other.errors
+        self.round_trip.merge(other.round_trip)
+        self.handler.merge(other.handler)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return statistics as a dictionary."""
+        return {
+            'sent': self.sent,
+            'handled': self.handled,
+            'errors': self.errors,
+            'round_trip': self.round_trip.snapshot(),
+            'handler': self.handler.snapshot(),
+        }
+
+
+class ConnectionStats:
+    """
+    Statistics of a connection, see `Connection.stats`.
+
+    Frames are messages of the transport, which may be batch frames carrying several messages.
+    Sizes are sizes of bodies of frames.
+    """
+
+    messages_in: int = 0
+    """The number of received messages."""
+    messages_out: int = 0
+    """The number of sent messages."""
+    frames_in: int = 0
+    """The number of frames read from the transport."""
+    frames_out: int = 0
+    """The number of frames written to the transport."""
+    bytes_in: int = 0
+    """The size of frames read from the transport."""
+    bytes_out: int = 0
+    """The size of frames written to the transport."""
+    fds_in: int = 0
+    """The number of received file descriptors."""
+    fds_out: int = 0
+    """The number of sent file descriptors."""
+    errors: Counter[str]
+    """The number of errors of encoding, handlers and the transport by the name of their type."""
+    round_trip: Histogram
+    """Round-trip times of sent requests."""
+    handler: Histogram
+    """Durations of handlers of received requests and notifications."""
+    queue_wait: Histogram
+    """Times from queuing of messages to writing them to the transport."""
+    methods: Dict[str, MethodStats]
+    """Statistics of methods by their name."""
+    max_methods: int
+    """The maximal number of methods in `methods`, further methods are counted as `OTHER_METHOD`."""
+
+    def __init__(self, max_methods: int = MAX_METHODS):
+        self.errors = Counter()
+        self.round_trip = Histogram()
+        self.handler = Histogram()
+        self.queue_wait = Histogram()
+        self.methods = {}
+        self.max_methods = max_methods
+
+    def method(self, name: Any) -> MethodStats:
+        """
+        Return statistics of a method, which are created if they do not exist.
+
+        The name is converted to str, so that statistics can be serialized as JSON. Once there are
+        `max_methods` methods, statistics of new methods are added to `OTHER_METHOD`, so that
+        peers sending arbitrary method names cannot grow them without bounds.
+        """
+        name = str(name)
+        try:
+            return self.methods[name]
+        except KeyError:
+            if len(self.methods) >= self.max_methods:
+                name = OTHER_METHOD
+                if name in self.methods:
+                    return self.methods[name]
+            self.methods[name] = stats = MethodStats()
+            return stats
+
+    def error(self, error: BaseException) -> None:
+        """Count an error by the name of its type."""
+        self.errors[type(error).__name__] += 1
+
+    def merge(self, other: ConnectionStats) -> None:
+        """Add statistics of another connection."""
+        self.messages_in += other.messages_in
+        self.messages_out += other.messages_out
+        self.frames_in += other.frames_in
+        self.frames_out += other.frames_out
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        self.fds_in += other.fds_in
+        self.fds_out += other.fds_out
+        self.errors.update(other.errors)
+        self.round_trip.merge(other.round_trip)
+        self.handler.merge(other.handler)
+        self.queue_wait.merge(other.queue_wait)
+        for name, stats in other.methods.items():
+            self.method(name).merge(stats)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return statistics as a dictionary, which can be serialized as JSON."""
+        return {
+            'messages_in': self.messages_in,
+            'messages_out': self.messages_out,
+            'frames_in': self.frames_in,
+            'frames_out': self.frames_out,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'fds_in': self.fds_in,
+            'fds_out': self.fds_out,
+            'errors': dict(self.errors),
+            'round_trip': self.round_trip.snapshot(),
+            'handler': self.handler.snapshot(),
+            'queue_wait': self.queue_wait.snapshot(),
+            'methods': {name: stats.snapshot() for name, stats in self.methods.items()},
+        }
+
+
+def encode_stats(provider: Optional[Callable[[], Dict[str, Any]]], stats: ConnectionStats) -> bytes:
+    """
+    Encode the response to a request of statistics as JSON, see `Connection.request_stats`.
+
+    Args:
+        provider: A callable returning statistics or None, see `Connection.stats_provider`.
+        stats: Statistics of the connection to count an error of the provider in.
+
+    Returns:
+        Statistics or null if there is no provider, it fails or its result cannot be serialized.
+        Errors are counted rather than closing the connection.
+    """
+    try:
+        return json.dumps(provider() if provider is not None else None).encode()
+    except Exception as e:
+        stats.error(e)
+        return b'null'
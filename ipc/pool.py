@@ -0,0 +1,146 @@
+from __future__ import annotations
+from typing import List, Optional
+
+
+class BufferPool:
+    """
+    A pool of receive buffers in size classes of powers of two.
+
+    Transports borrow a buffer for each read message, see `Transport.pool`. The buffer is returned
+    with `PooledBuffer.release` when the message has been handled, so that the next message of
+    a similar size reuses it instead of allocating a new one.
+
+    A buffer is returned to the pool only if nothing references its data anymore. Values which
+    outlive the message, e.g. memoryviews of binary data decoded by NativeCodec, keep their buffer
+    out of the pool, so that it is never overwritten by another message. Copy such values with
+    `bytes()` to let the buffer be reused.
+
+    Args:
+        min_size: The size of the smallest size class, a power of two.
+        max_size: The size of the largest size class. Larger buffers are never pooled.
+        max_buffers: The maximal number of free buffers of each size class.
+    """
+
+    min_size: int
+    """The size of the smallest size class."""
+    max_size: int
+    """The size of the largest size class. Larger buffers are never pooled."""
+    max_buffers: int
+    """The maximal number of free buffers of each size class."""
+    allocations: int = 0
+    """The number of allocated buffers."""
+    hits: int = 0
+    """The number of buffers borrowed from the pool."""
+    misses: int = 0
+    """The number of buffers which had to be allocated."""
+    retained: int = 0
+    """The number of released buffers not returned to the pool because their data are still referenced."""
+    _free: List[List[bytearray]]
+
+    def __init__(self, min_size: int = 256, max_size: int = 1024 * 1024, max_buffers: int = 64):
+        if min_size <= 0 or min_size & (min_size - 1):
+            raise ValueError(f'The minimal size must be a power of two: {min_size}.')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_buffers = max_buffers
+        self._free = [[] for _i in range(self._size_class(max_size) + 1)]
+
+    @property
+    def hit_rate(self) -> float:
+        """The ratio of buffers borrowed from the pool to all borrowed buffers."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def acquire(self, size: int) -> PooledBuffer:
+        """
+        Borrow a buffer.
+
+        Args:
+            size: The size of data.
+
+        Returns:
+            A buffer of at least the given size.
+        """
+        if size > self.max_size:
+            self.misses += 1
+            self.allocations += 1
+            return PooledBuffer(bytearray(size), size, None)
+
+        size_class = self._size_class(size)
+        free = self._free[size_class]
+        if free:
+            self.hits += 1
+            buffer = free.pop()
+        else:
+            self.misses += 1
+            self.allocations += 1
+            buffer = bytearray(self.min_size << size_class)
+        return PooledBuffer(buffer, size, self, size_class)
+
+    def clear(self) -> None:
+        """Drop free buffers and reset counters."""
+        for free in self._free:
+            free.clear()
+        self.allocations = self.hits = self.misses = self.retained = 0
+
+    def _size_class(self, size: int) -> int:
+        return max(size - 1, self.min_size - 1).bit_length() - (self.min_size - 1).bit_length()
+
+    def _release(self, buffer: bytearray, size_class: int) -> None:
+        try:
+            # A bytearray cannot be resized while its data are referenced by memoryviews.
+            buffer.append(0)
+            buffer.pop()
+        except BufferError:
+            self.retained += 1
+            return
+        free = self._free[size_class]
+        if len(free) < self.max_buffers:
+            free.append(buffer)
+
+
+class PooledBuffer:
+    """
+    A buffer borrowed from BufferPool.
+
+    The buffer is returned with `release` or at the end of a `with` block.
+    """
+
+    view: memoryview
+    """A view of data of the requested size. It is released with the buffer."""
+    _buffer: Optional[bytearray]
+    _pool: Optional[BufferPool]
+    _size_class: int
+
+    def __init__(self, buffer: bytearray, size: int, pool: Optional[BufferPool], size_class: int = 0):
+        self._buffer = buffer
+        self._pool = pool
+        self._size_class = size_class
+        self.view = memoryview(buffer)[:size]
+
+    def __enter__(self) -> PooledBuffer:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.release()
+
+    @property
+    def released(self) -> bool:
+        """Whether the buffer has been released."""
+        return self._buffer is None
+
+    def release(self) -> None:
+        """Release the view and return the buffer to its pool, if it is no longer referenced."""
+        buffer = self._buffer
+        if buffer is None:
+            return
+        self._buffer = None
+        try:
+            self.view.release()
+        except BufferError:
+            # The view is referenced by another object, e.g. a NumPy array.
+            if self._pool is not None:
+                self._pool.retained += 1
+            return
+        if self._pool is not None:
+            self._pool._release(buffer, self._size_class)
@@ -0,0 +1,52 @@
+from __future__ import annotations
+from enum import Flag
+from typing import Protocol
+
+
+class Flags(Flag):
+    """Message flags."""
+
+    NONE = 0
+    """No flags."""
+    REQUEST = 1 << 0
+    """This message is a request."""
+    RESPONSE = 1 << 1
+    """This message is a response to a request."""
+    NOTIFICATION = 1 << 2
+    """This message is a notification not receiving any response."""
+    CODEC_V2 = 1 << 8
+    """The sender accepts message bodies encoded with version 2 of NativeCodec."""
+    CODEC_INTERNING = 1 << 9
+    """The sender accepts message bodies encoded with InterningCodec."""
+    CODEC_COMPRESSION = 1 << 10
+    """The sender accepts message bodies compressed by CompressingCodec."""
+    COMPRESSED = 1 << 11
+    """The body of this message is compressed by CompressingCodec."""
+    BATCHING = 1 << 12
+    """The sender accepts batch frames."""
+    BATCH = 1 << 13
+    """This message is a batch frame carrying multiple messages, see Connection."""
+    STATS = 1 << 14
+    """This message is a request or a response of statistics, see `Connection.request_stats`."""
+
+
+FEATURE_FLAGS = Flags.CODEC_V2 | Flags.CODEC_INTERNING | Flags.CODEC_COMPRESSION | Flags.BATCHING
+"""
+Flags advertising features of the sender, which are set on all sent messages.
+
+Older peers ignore unknown flags, so they can be used for negotiation without a handshake.
+"""
+
+
+class Peer(Protocol):
+    """
+    The part of a connection which codecs are bound to, see `Codec.bind`.
+
+    Connection, AioConnection, QtConnection and SyncClient all implement it, so codecs do not
+    depend on any event loop.
+    """
+
+    features: Flags
+    """Feature flags advertised to the remote endpoint with every message."""
+    peer_features: Flags
+    """Feature flags advertised by the remote endpoint."""
@@ -0,0 +1,563 @@
+from __future__ import annotations
+import json
+import socket as stdlib_socket
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine, Deque, Dict, Generator, List, Optional, Tuple, Type, TYPE_CHECKING
+
+from PySide2.QtCore import QObject, QSocketNotifier, Signal, Slot
+
+from ipc.aio import ConnectionClosedError
+from ipc.framing import PacketFraming, Message, NoDataError, BATCH_BUDGET, MAX_MESSAGE_SIZE, MAX_PENDING_SIZE
+from ipc.framing import BATCH_SIZE, message_size, pack_batch, unpack_batch
+from ipc.metrics import ConnectionStats, MethodStats, encode_stats
+from ipc.pool import BufferPool
+from ipc.protocol import Flags, FEATURE_FLAGS
+from ipc.types import Buffer, Bytes, Fd, INT32_MAX, IPCError
+from ipc.utils import WrappedCounter
+
+if TYPE_CHECKING:
+    from ipc.codecs import Codec
+
+QtRequestHandler = Callable[['QtConnection', Any, List[Fd]], Tuple[Any, List[Fd]]]
+QtNotificationHandler = Callable[['QtConnection', Any, List[Fd]], None]
+
+# A queued message, the number of its request or None, the time it was queued
+# and a received request to release when the message is written or None.
+_Item = Tuple[Message, Optional[int], float, Optional[Message]]
+
+
+class QtPacketTransport(PacketFraming):
+    """
+    PacketFraming driven by the Qt event loop, which is wire-compatible with the trio one.
+
+    It takes a standard socket, which is switched to non-blocking mode. Its coroutines never wait
+    for an event loop: if the socket is not ready, they yield to QtConnection, which resumes them when
+    a QSocketNotifier signals that the socket is ready. Records available at once are thus read
+    and written without leaving the coroutine.
+
+    See PacketFraming for information about parameters.
+    """
+
+    socket: stdlib_socket.socket
+
+    def __init__(self, socket: stdlib_socket.socket, *, max_message_size: int = MAX_MESSAGE_SIZE,
+                 max_pending_size: int = MAX_PENDING_SIZE, spill_size: Optional[int] = None,
+                 batch_budget: int = BATCH_BUDGET):
+        super().__init__(socket, max_message_size=max_message_size, max_pending_size=max_pending_size,
+                         spill_size=spill_size, batch_budget=batch_budget)
+        self.socket = socket
+        socket.setblocking(False)
+
+    @classmethod
+    def create_socket(cls) -> stdlib_socket.socket:
+        """
+        Create a non-blocking standard socket suitable for this implementation.
+
+        Returns:
+            New socket.
+        """
+        socket = stdlib_socket.socket(*cls.SOCKET_TYPE)
+        socket.setblocking(False)
+        return socket
+
+    async def read(self) -> Message:
+        """
+        Read a message from a SEQPACKET socket.
+
+        See PacketTransport.read for information about returned values and raised errors.
+        The coroutine must be run by QtConnection.
+        """
+        return await self._read_message()
+
+    async def write(self, msg: Message) -> None:
+        """
+        Write a message to a SEQPACKET socket.
+
+        See PacketTransport.write for information about parameters and raised errors.
+        The coroutine must be run by QtConnection.
+        """
+        await self._write_message(msg)
+
+    async def _recvmsg_into(self, buffers: List[Buffer], ancillary_size: int) -> Tuple[int, list, int, Any]:
+        while True:
+            try:
+                return self._sock.recvmsg_into(buffers, ancillary_size)
+            except BlockingIOError:
+                await _Wait()
+
+    async def _sendmsg(self, buffers: List[Bytes], ancillary: list, flags: int) -> int:
+        while True:
+            try:
+                return self._sock.sendmsg(buffers, ancillary, flags)
+            except BlockingIOError:
+                await _Wait()
+
+
+class QtConnection(QObject):
+    """
+    A duplex client <-> server connection driven by the Qt event loop.
+
+    It is wire-compatible with Connection, but needs neither trio nor another thread. QSocketNotifier
+    signals that the socket is ready, and messages are read and handled on the thread of the connection,
+    typically the GUI thread, so that remote updates reach widgets and QML without cross-thread hops.
+    Up to `QtPacketTransport.batch_budget` messages are read per notification, so that the event loop
+    stays responsive.
+
+    Handlers are plain callables rather than coroutines. Responses, notifications and the closure
+    of the connection are emitted as signals.
+
+    Messages are written at once if the socket is ready. Otherwise, they are queued and packed into
+    batch frames when the socket is ready again. Unlike Connection, other messages are not written
+    between fragments of large messages.
+
+    Args:
+        num: Connection number.
+        transport_factory: A callable to provide transport for this connection, e.g. QtPacketTransport.
+        request_handler: A callable to handle incoming requests, which returns a response and file
+            descriptors. Any exception will close the connection.
+        notification_handler: A callable to handle incoming notifications or None to only emit
+            `notificationReceived`. Any exception will close the connection.
+        codec: A codec to encode and decode messages or None. See `Connection.codec`.
+        max_batch_size: The maximal size of message bodies packed into a batch frame, 0 to disable batching.
+            See `Connection.max_batch_size`.
+        pool: A pool of receive buffers or None. See `Connection.pool`.
+        method_key: A callable returning method names of messages or None. See `Connection.method_key`.
+        parent: The parent object.
+
+    Signals:
+        responseReceived(num: int, data: object, fds: object): Emitted when the response to the request `num`
+            returned by `send` or `request_stats` is received.
+        requestFailed(num: int, error: object): Emitted when the request `num` cannot be written or the connection
+            is closed before its response is received.
+        notificationReceived(data: object, fds: object): Emitted when a notification has been handled.
+            Data are valid only during the emission if `pool` is set.
+        closed(error: object): Emitted when the connection is closed with the error which closed it or None.
+    """
+    responseReceived = Signal(int, object, object)
+    requestFailed = Signal(int, object)
+    notificationReceived = Signal(object, object)
+    closed = Signal(object)
+
+    num: int
+    """Connection number."""
+    transport_factory: Type[QtPacketTransport]
+    """A callable to provide transport for this connection."""
+    request_handler: QtRequestHandler
+    """A callable to handle incoming requests."""
+    notification_handler: Optional[QtNotificationHandler]
+    """A callable to handle incoming notifications or None."""
+    address: bytes = None
+    """The address of the remote endpoint or None."""
+    features: Flags = Flags.NONE
+    """Feature flags advertised to the remote endpoint with every message."""
+    peer_features: Flags = Flags.NONE
+    """Feature flags advertised by the remote endpoint."""
+    codec: Optional[Codec] = None
+    """A codec bound to this connection to encode and decode messages or None, see `Connection.codec`."""
+    max_batch_size: int
+    """The maximal size of message bodies packed into a batch frame, 0 if batching is disabled."""
+    pool: Optional[BufferPool] = None
+    """A pool to borrow buffers of received messages from or None, see `Connection.pool`."""
+    stats: ConnectionStats
+    """Statistics of messages, handlers and errors of this connection."""
+    method_key: Optional[Callable[[Any], str]] = None
+    """A callable returning the method name of a request or a notification or None, see `Connection.method_key`."""
+    stats_provider: Optional[Callable[[], Dict[str, Any]]] = None
+    """A callable returning statistics sent in response to `request_stats` of the remote endpoint or None."""
+    error: Optional[Exception] = None
+    """The error which closed the connection or None."""
+    _socket: stdlib_socket.socket = None
+    _transport: Optional[QtPacketTransport] = None
+    _closed: bool = False
+    _readNotifier: Optional[QSocketNotifier] = None
+    _writeNotifier: Optional[QSocketNotifier] = None
+    _reader: Optional[Coroutine] = None
+    _writer: Optional[Coroutine] = None
+    _written: List[_Item]
+    _outbox: Deque[_Item]
+    _requests: Dict[int, Tuple[float, Optional[MethodStats]]]
+
+    def __init__(self,
+                 num: int,
+                 transport_factory: Type[QtPacketTransport],
+                 request_handler: QtRequestHandler,
+                 notification_handler: Optional[QtNotificationHandler] = None,
+                 codec: Optional[Codec] = None,
+                 max_batch_size: int = BATCH_SIZE,
+                 pool: Optional[BufferPool] = None,
+                 method_key: Optional[Callable[[Any], str]] = None,
+                 parent: Optional[QObject] = None) -> None:
+        super().__init__(parent)
+        self.num = num
+        self.transport_factory = transport_factory
+        self.request_handler = request_handler
+        self.notification_handler = notification_handler
+        self.max_batch_size = max_batch_size
+        self.pool = pool
+        self.method_key = method_key
+        self.stats = ConnectionStats()
+        if max_batch_size > 0:
+            self.features |= Flags.BATCHING
+        if codec is not None:
+            self.codec = codec.bind(self)
+        self._written = []
+        self._outbox = deque()
+        self._requests = {}
+        self._counter = WrappedCounter(1, INT32_MAX)
+
+    def __repr__(self) -> str:
+        return f'QtConn#{self.num}: {self._socket}'
+
+    def connect(self, address: bytes) -> None:
+        """
+        Connect to a remote endpoint and start handling messages.
+
+        Connecting a Unix domain socket does not block.
+
+        Args:
+            address: The address to connect to.
+
+        Raises:
+            OSError: If the connection cannot be established, e.g. BlockingIOError if the backlog
+                of the server is full.
+        """
+        socket = self.transport_factory.create_socket()
+        try:
+            socket.connect(address)
+        except BaseException:
+            socket.close()
+            raise
+        self.attach(socket, address)
+
+    def attach(self, socket: stdlib_socket.socket, address: bytes) -> None:
+        """
+        Attach an already connected socket and start handling messages.
+
+        Unlike `Connection.attach`, it returns at once and messages are handled by the Qt event loop
+        until the connection is closed, see `closed`.
+
+        Args:
+            socket: The socket to attach to.
+            address: The address of the remote endpoint.
+
+        Raises:
+            RuntimeError: If the connection has been already attached or closed.
+        """
+        if self._socket is not None or self._closed:
+            raise RuntimeError('Already running.')
+
+        self.address = address
+        self._socket = socket
+        self._transport = self.transport_factory(socket)
+        self._transport.pool = self.pool
+        self._readNotifier = QSocketNotifier(socket.fileno(), QSocketNotifier.Read, self)
+        self._readNotifier.activated.connect(self._onReadable)
+        self._writeNotifier = QSocketNotifier(socket.fileno(), QSocketNotifier.Write, self)
+        self._writeNotifier.setEnabled(False)
+        self._writeNotifier.activated.connect(self._onWritable)
+
+    def close(self) -> None:
+        """Close the connection and fail pending requests."""
+        self._shutdown(None)
+
+    def send(self, data: Any, fds: List[Fd] = None) -> int:
+        """
+        Send a request.
+
+        Args:
+            data: Data to send or a message to encode if `codec` is set.
+            fds: File descriptors to send. If `codec` is set, they follow file descriptors
+                of the encoded message.
+
+        Returns:
+            The number of the request, which is passed to `responseReceived` or `requestFailed`.
+
+        Raises:
+            CodecError: If the message cannot be encoded.
+            Exception: If the connection is closed.
+        """
+        self._check_not_closed()
+        method = self._method_stats(data)
+        if method is not None:
+            method.sent += 1
+        return self._request(Flags.REQUEST.value, data, fds or [], method)
+
+    def notify(self, data: Any, fds: List[Fd] = None) -> None:
+        """
+        Send a notification.
+
+        Args:
+            data: Data to send or a message to encode if `codec` is set.
+            fds: File descriptors to send. If `codec` is set, they follow file descriptors
+                of the encoded message.
+
+        Raises:
+            CodecError: If the message cannot be encoded.
+            Exception: If the connection is closed.
+        """
+        self._check_not_closed()
+        method = self._method_stats(data)
+        if method is not None:
+            method.sent += 1
+        try:
+            self._queue(Message(0, Flags.NOTIFICATION.value | self.features.value, data, fds or []), None, None)
+        except IPCError:
+            if method is not None:
+                method.errors += 1
+            raise
+
+    def request_stats(self) -> int:
+        """
+        Request statistics of the remote endpoint, see `Connection.request_stats`.
+
+        Returns:
+            The number of the request. Statistics or None are passed to `responseReceived` as data.
+
+        Raises:
+            Exception: If the connection is closed.
+        """
+        self._check_not_closed()
+        return self._request(Flags.REQUEST.value | Flags.STATS.value, b'', [], None)
+
+    def _request(self, flags: int, data: Any, fds: List[Fd], method: Optional[MethodStats]) -> int:
+        while True:
+            num = next(self._counter)
+            if num not in self._requests:
+                break
+
+        self._requests[num] = time.perf_counter(), method
+        try:
+            self._queue(Message(num, flags | self.features.value, data, fds), num, None)
+        except IPCError:
+            del self._requests[num]
+            if method is not None:
+                method.errors += 1
+            raise
+        return num
+
+    def _check_not_closed(self) -> None:
+        if self.error is not None:
+            raise self.error
+        if self._transport is None:
+            raise ConnectionClosedError()
+
+    def _queue(self, msg: Message, num: Optional[int], request: Optional[Message]) -> None:
+        # Messages are encoded in the order they are queued, which is the order they are written.
+        if self.codec is not None and not msg.flags & Flags.STATS.value:
+            try:
+                data, fds, flags = self.codec.encode_message(msg.data)
+            except IPCError as e:
+                self.stats.error(e)
+                raise
+            msg = msg._replace(flags=msg.flags | flags, data=data, fds=fds + msg.fds)
+        self._outbox.append((msg, num, time.perf_counter(), request))
+        if self._writer is None:
+            self._flush()
+
+    def _flush(self) -> None:
+        # Write queued messages until the outbox is empty or the socket is not ready.
+        while self._transport is not None:
+            if self._writer is None:
+                if not self._outbox:
+                    self._writeNotifier.setEnabled(False)
+                    return
+                frame, self._written = self._next_frame()
+                self._count_written(frame, self._written)
+                self._writer = self._transport.write(frame)
+            try:
+                self._writer.send(None)
+            except StopIteration:
+                self._writer = None
+                written, self._written = self._written, []
+                for _msg, _num, _queued, request in written:
+                    if request is not None:
+                        request.release()
+            except Exception as e:
+                self._writer = None
+                self.stats.error(e)
+                self._shutdown(e)
+            else:
+                self._writeNotifier.setEnabled(True)
+                return
+
+    def _next_frame(self) -> Tuple[Message, List[_Item]]:
+        # Queued messages are packed into a batch frame if the remote endpoint accepts them.
+        if self.max_batch_size <= 0 or not self.peer_features & Flags.BATCHING:
+            item = self._outbox.popleft()
+            return item[0], [item]
+        size = 0
+        items = []
+        while self._outbox and (not items or size + message_size(self._outbox[0][0]) <= self.max_batch_size):
+            item = self._outbox.popleft()
+            items.append(item)
+            size += message_size(item[0])
+        frame, count = pack_batch(items, self.max_batch_size, Flags.BATCH.value | self.features.value)[0]
+        # Messages which do not fit in the frame, e.g. due to the limit of file descriptors, are kept queued.
+        self._outbox.extendleft(reversed(items[count:]))
+        return frame, items[:count]
+
+    def _count_written(self, frame: Message, items: List[_Item]) -> None:
+        stats = self.stats
+        now = time.perf_counter()
+        for _msg, _num, queued, _request in items:
+            stats.queue_wait.add(now - queued)
+        stats.messages_out += len(items)
+        stats.frames_out += 1
+        stats.bytes_out += message_size(frame)
+        stats.fds_out += len(frame.fds)
+
+    @Slot()
+    def _onReadable(self):
+        """The socket is readable."""
+        for _i in range(self._transport.batch_budget):
+            if self._reader is None:
+                self._reader = self._transport.read()
+            try:
+                self._reader.send(None)
+            except StopIteration as e:
+                self._reader = None
+                frame = e.value
+            except Exception as e:
+                self._reader = None
+                if isinstance(e, NoDataError):
+                    e = None
+                else:
+                    self.stats.error(e)
+                self._shutdown(e)
+                return
+            else:
+                return  # The rest of the message has not arrived yet.
+
+            try:
+                self._receive(frame)
+            except Exception as e:
+                self._shutdown(e)
+            if self._transport is None:
+                return  # Closed by a handler.
+
+    @Slot()
+    def _onWritable(self):
+        """The socket is writable."""
+        self._flush()
+
+    def _receive(self, frame: Message) -> None:
+        stats = self.stats
+        stats.frames_in += 1
+        stats.bytes_in += len(frame.data)
+        stats.fds_in += len(frame.fds)
+        if frame.flags & Flags.BATCH.value:
+            with frame:
+                messages = unpack_batch(frame, self.pool)
+        else:
+            messages = [frame]
+        for msg in messages:
+            if self._transport is None:
+                msg.release()
+                continue
+            if msg.flags & FEATURE_FLAGS.value:
+                self.peer_features |= Flags(msg.flags & FEATURE_FLAGS.value)
+            stats.messages_in += 1
+            if self.codec is not None and not msg.flags & Flags.STATS.value:
+                # Decoded values referencing the buffer keep it out of the pool.
+                with msg:
+                    data = self.codec.decode_message(msg.data, msg.fds, msg.flags)
+                msg = msg._replace(data=data, buffer=None)
+            self._dispatch(msg)
+
+    def _dispatch(self, msg: Message) -> None:
+        if msg.flags & Flags.REQUEST.value:
+            # The response may reference data of the request, so they are released when it is written.
+            try:
+                if msg.flags & Flags.STATS.value:
+                    data, fds = encode_stats(self.stats_provider, self.stats), []
+                    flags = Flags.RESPONSE.value | Flags.STATS.value | self.features.value
+                else:
+                    data, fds = self._handle(self.request_handler, msg)
+                    flags = Flags.RESPONSE.value | self.features.value
+                self._queue(Message(msg.num, flags, data, fds or []), None, msg)
+            except BaseException:
+                msg.release()
+                raise
+        elif msg.flags & Flags.NOTIFICATION.value:
+            with msg:
+                if self.notification_handler is not None:
+                    self._handle(self.notification_handler, msg)
+                self.notificationReceived.emit(msg.data, msg.fds)
+        elif msg.flags & Flags.RESPONSE.value:
+            # The receiver of `responseReceived` may keep response data, so they are not returned to the pool.
+            request = self._requests.pop(msg.num, None)
+            if request is None:
+                return
+            start, method = request
+            elapsed = time.perf_counter() - start
+            self.stats.round_trip.add(elapsed)
+            if method is not None:
+                method.round_trip.add(elapsed)
+            data = json.loads(bytes(msg.data)) if msg.flags & Flags.STATS.value else msg.data
+            self.responseReceived.emit(msg.num, data, msg.fds)
+        else:
+            raise RuntimeError('Unknown message type')
+
+    def _handle(self, handler: Callable[..., Any], msg: Message) -> Any:
+        method = self._method_stats(msg.data)
+        start = time.perf_counter()
+        try:
+            return handler(self, msg.data, msg.fds)
+        except Exception as e:
+            self.stats.error(e)
+            if method is not None:
+                method.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stats.handler.add(elapsed)
+            if method is not None:
+                method.handled += 1
+                method.handler.add(elapsed)
+
+    def _method_stats(self, data: Any) -> Optional[MethodStats]:
+        if self.method_key is None:
+            return None
+        return self.stats.method(self.method_key(data))
+
+    def _shutdown(self, error: Optional[Exception]) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self.error = error
+        transport, self._transport = self._transport, None
+        if transport is None:
+            return
+
+        # Notifiers are disabled before the socket is closed, so that they do not watch a closed descriptor.
+        for notifier in (self._readNotifier, self._writeNotifier):
+            notifier.setEnabled(False)
+            notifier.deleteLater()
+        self._readNotifier = self._writeNotifier = None
+        for coro in (self._reader, self._writer):
+            if coro is not None:
+                coro.close()
+        self._reader = self._writer = None
+
+        failure = error if error is not None else ConnectionClosedError()
+        items = self._written + list(self._outbox)
+        self._written = []
+        self._outbox.clear()
+        for _msg, _num, _queued, request in items:
+            if request is not None:
+                request.release()
+        # Requests already written will never receive a response.
+        requests = list(self._requests)
+        self._requests.clear()
+        self._socket.close()
+        for num in requests:
+            self.requestFailed.emit(num, failure)
+        self.closed.emit(error)
+
+
+class _Wait:
+    """Yielded by coroutines of QtPacketTransport to QtConnection, which resumes them when the socket is ready."""
+
+    def __await__(self) -> Generator[_Wait, None, None]:
+        yield self
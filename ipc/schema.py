@@ -0,0 +1,431 @@
+from __future__ import annotations
+import struct
+from collections import namedtuple
+from typing import Any, Dict, List, Tuple, Type, Union, Optional, get_args, get_origin
+
+from ipc.codecs import (
+    Codec, NativeType, EncoderError, DecoderError, _plan, _pack, _deserialize,
+    _FALSE, _TRUE, _NONE, _INT64, _DOUBLE, _STRING, _BYTES, _ARRAY_START, _ARRAY_END, _FD)
+from ipc.types import Fd, Bytes
+
+_NONE_TYPE = type(None)
+
+
+class Schema(Codec[tuple]):
+    """
+    A codec of messages of a fixed shape declared by a schema.
+
+    A message is a sequence of fields, which is encoded as an array of NativeCodec (version 1 of the wire
+    format), so that the messages can be decoded with function deserialize too. Decoded messages are
+    instances of the named tuple `type`.
+
+    Specialized encode and decode functions are generated for the schema, so that values are not
+    dispatched by their type, and the shape of a message is validated while it is encoded or decoded.
+
+    Supported field types are bool, int, float, str, bytes, Fd, Optional of them, another Schema for
+    a nested message and Any or NativeType for any value supported by NativeCodec.
+
+    Args:
+        name: The name of the message type.
+        fields: Names and types of the fields in order.
+
+    Raises:
+        TypeError: If a field type is not supported.
+    """
+
+    name: str
+    """The name of the message type."""
+    fields: Dict[str, Any]
+    """Names and types of the fields in order."""
+    type: Type[tuple]
+    """The named tuple of decoded messages."""
+    source: str
+    """The source code of the generated functions."""
+
+    def __init__(self, name: str, fields: Dict[str, Any]):
+        self.name = name
+        self.fields = dict(fields)
+        self.type = namedtuple(name, self.fields)
+        self.source, self._encode, self._decode = _compile(self)
+
+    def encode(self, msg: tuple) -> Tuple[bytearray, List[Fd]]:
+        """
+        Encode a message of this schema.
+
+        Args:
+            msg: A sequence of field values, e.g. an instance of `type`.
+
+        Returns:
+            A tuple (data, fds) where data are encoded data and fds are file descriptors
+            to send along with the data.
+
+        Raises:
+            EncoderError: If the message does not match the schema or cannot be encoded.
+        """
+        return self._encode(msg)
+
+    def decode(self, data: Bytes, fds: List[Fd]) -> tuple:
+        """
+        Decode a message of this schema.
+
+        Args:
+            data: Data to decode.
+            fds: File descriptors to attach to decoded message.
+
+        Returns:
+            An instance of `type`.
+
+        Raises:
+            DecoderError: If the data do not match the schema or cannot be decoded.
+        """
+        return self._decode(data, fds)
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{name}: {_type_name(tp)}' for name, tp in self.fields.items())
+        return f'<Schema {self.name}({fields})>'
+
+
+def _type_name(tp: Any) -> str:
+    inner = _optional(tp)
+    if inner is not None:
+        return f'Optional[{_type_name(inner)}]'
+    if isinstance(tp, Schema):
+        return tp.name
+    if tp is NativeType:
+        return 'NativeType'
+    return getattr(tp, '__name__', repr(tp))
+
+
+def _optional(tp: Any) -> Optional[Any]:
+    """Return the type of Optional[type] or None."""
+    if get_origin(tp) is Union:
+        args = get_args(tp)
+        if len(args) == 2 and _NONE_TYPE in args:
+            return args[0] if args[1] is _NONE_TYPE else args[1]
+    return None
+
+
+class _Source:
+    """Lines of generated source code."""
+
+    def __init__(self):
+        self.lines: List[str] = []
+        self.indent = 1
+        self._counter = 0
+
+    def add(self, line: str) -> None:
+        self.lines.append('    ' * self.indent + line)
+
+    def var(self, prefix: str) -> str:
+        self._counter += 1
+        return f'{prefix}{self._counter}'
+
+
+class _Encoder(_Source):
+    """
+    Generated source code of an encoder.
+
+    Struct format items and arguments are buffered while generating the code, so that consecutive
+    fields are added with a single call. If a schema has no optional and no generic fields, the whole
+    message is packed with a single call.
+    """
+
+    flat: bool
+    """Whether the whole message is buffered."""
+
+    def __init__(self):
+        super().__init__()
+        self.flat = True
+        self._fmt: List[str] = []
+        self._args: List[str] = []
+
+    def fmt(self, item: str) -> None:
+        self._fmt.append(item)
+
+    def arg(self, expr: str) -> None:
+        self._args.append(expr)
+
+    def flush(self) -> None:
+        if self._fmt:
+            fmt = ''.join(self._fmt)
+            self.add(f"add_fmt({'f' if '{' in fmt else ''}'{fmt}')")
+            self._fmt.clear()
+        if len(self._args) == 1:
+            self.add(f'add_arg({self._args[0]})')
+        elif self._args:
+            self.add(f'add_args(({", ".join(self._args)}))')
+        self._args.clear()
+
+    def fields(self, schema: Schema, value: str, path: str) -> None:
+        names = [self.var('f') for _name in schema.fields]
+        self.add(f'if not isinstance({value}, (tuple, list)) or len({value}) != {len(names)}:')
+        self.add(f"    raise EncoderError(f'{path} must be a sequence of {len(names)} fields: {{{value}!r}}.')")
+        if names:
+            self.add(f'{", ".join(names)}{"," if len(names) == 1 else ""} = {value}')
+        self.fmt('I')
+        self.arg(str(_ARRAY_START))
+        for var, (name, tp) in zip(names, schema.fields.items()):
+            self.field(tp, var, f'{path}.{name}')
+        self.fmt('I')
+        self.arg(str(_ARRAY_END))
+
+    def field(self, tp: Any, value: str, path: str) -> None:
+        inner = _optional(tp)
+        if inner is not None:
+            self.flat = False
+            self.flush()
+            self.add(f'if {value} is None:')
+            self.indent += 1
+            self.fmt('I')
+            self.arg(str(_NONE))
+            self.flush()
+            self.indent -= 1
+            self.add('else:')
+            self.indent += 1
+            self.field(inner, value, path)
+            self.flush()
+            self.indent -= 1
+        elif isinstance(tp, Schema):
+            self.fields(tp, value, path)
+        elif tp is bool:
+            self.check(f'{value} is not True and {value} is not False', path, 'bool', value)
+            self.fmt('I')
+            self.arg(f'{_TRUE} if {value} else {_FALSE}')
+        elif tp is int:
+            self.check(f'not isinstance({value}, int) or {value} is True or {value} is False', path, 'int', value)
+            self.fmt('IQ')
+            self.arg(str(_INT64))
+            self.arg(value)
+        elif tp is float:
+            self.check(f'not isinstance({value}, float)', path, 'float', value)
+            self.fmt('Id')
+            self.arg(str(_DOUBLE))
+            self.arg(value)
+        elif tp is str or tp is bytes:
+            if tp is str:
+                self.check(f'not isinstance({value}, str)', path, 'str', value)
+                self.add(f"{value} = {value}.encode('utf-8')")
+            else:
+                self.check(f'not isinstance({value}, (bytes, bytearray))', path, 'bytes', value)
+            size = self.var('n')
+            self.add(f'{size} = len({value})')
+            self.fmt(f'II{{{size}}}s')
+            self.arg(str(_STRING if tp is str else _BYTES))
+            self.arg(size)
+            self.arg(value)
+        elif tp is Fd:
+            self.check(f'not isinstance({value}, Fd)', path, 'Fd', value)
+            index = self.var('i')
+            self.add(f'{index} = len(fds)')
+            self.add(f'fds.append({value})')
+            self.fmt('II')
+            self.arg(str(_FD))
+            self.arg(index)
+        elif tp is Any or tp is NativeType:
+            self.flat = False
+            self.flush()
+            self.add(f'sub_fmt, sub_args, sub_views = _plan({value}, fds, None)')
+            self.add('if sub_views:')
+            self.add('    fmt_offset, args_offset = len(fmt), len(args)')
+            self.add('    views.extend((fmt_offset + i, args_offset + j, view) for i, j, view in sub_views)')
+            self.add('fmt.extend(sub_fmt)')
+            self.add('args.extend(sub_args)')
+        else:
+            raise TypeError(f'Unsupported type of field {path}: {tp!r}.')
+
+    def pack(self, namespace: Dict[str, Any]) -> None:
+        """Add a header and a footer to pack the message."""
+        if not self.flat:
+            self.flush()
+            self.lines[:0] = [
+                '    fmt = []',
+                '    args = []',
+                '    views = []',
+                '    fds = []',
+                '    add_fmt = fmt.append',
+                '    add_arg = args.append',
+                '    add_args = args.extend',
+            ]
+            self.add('return _pack(fmt, args, views), fds')
+            return
+
+        self.lines.insert(0, '    fds = []')
+        fmt = '=' + ''.join(self._fmt)
+        args = ', '.join(self._args)
+        self.add('try:')
+        if '{' in fmt:
+            self.add(f"    fmt = f'{fmt}'")
+            self.add('    data = bytearray(calcsize(fmt))')
+            self.add(f'    pack_into(fmt, data, 0, {args})')
+        else:
+            packer = struct.Struct(fmt)
+            namespace['packer_pack_into'] = packer.pack_into
+            self.add(f'    data = bytearray({packer.size})')
+            self.add(f'    packer_pack_into(data, 0, {args})')
+        self.add('except struct.error as e:')
+        self.add("    raise EncoderError(f'Encoder failure: {e}')")
+        self.add('return data, fds')
+
+    def check(self, condition: str, path: str, name: str, value: str) -> None:
+        self.add(f'if {condition}:')
+        self.add(f"    raise EncoderError(f'{path} must be {name}: {{{value}!r}}.')")
+
+
+class _Decoder(_Source):
+    """
+    Generated source code of a decoder.
+
+    Consecutive fixed-size items are buffered while generating the code, so that they are unpacked
+    with a single call and their markers are checked afterwards.
+    """
+
+    def __init__(self, namespace: Dict[str, Any]):
+        super().__init__()
+        self.namespace = namespace
+        self._fmt: List[str] = []
+        self._targets: List[str] = []
+        self._checks: List[str] = []
+
+    def flush(self) -> None:
+        if not self._fmt:
+            return
+        unpacker = struct.Struct('=' + ''.join(self._fmt))
+        name = f'unpack_{"".join(self._fmt)}'
+        self.namespace[name] = unpacker.unpack_from
+        targets = self._targets
+        self.add(f'{", ".join(targets)}{"," if len(targets) == 1 else ""} = {name}(data, offset)')
+        for line in self._checks:
+            self.add(line)
+        self.add(f'offset += {unpacker.size}')
+        self._fmt.clear()
+        self._targets.clear()
+        self._checks.clear()
+
+    def item(self, fmt: str, target: str) -> None:
+        self._fmt.append(fmt)
+        self._targets.append(target)
+
+    def marker(self, marker: int, path: str) -> None:
+        var = self.var('m')
+        self.item('I', var)
+        self.check(f'{var} != {marker}', path)
+
+    def check(self, condition: str, path: str) -> None:
+        self._checks.append(f'if {condition}:')
+        self._checks.append(f"    raise DecoderError(f'Invalid {path} at offset {{offset}}.')")
+
+    def fields(self, schema: Schema, target: str, path: str) -> None:
+        self.marker(_ARRAY_START, path)
+        names = [self.var('f') for _name in schema.fields]
+        for var, (name, tp) in zip(names, schema.fields.items()):
+            self.field(tp, var, f'{path}.{name}')
+        self.marker(_ARRAY_END, path)
+        self.flush()
+        values = f'{", ".join(names)}{"," if len(names) == 1 else ""}'
+        self.add(f'{target} = tuple_new({schema.name}_{id(schema)}, ({values}))')
+
+    def field(self, tp: Any, target: str, path: str) -> None:
+        inner = _optional(tp)
+        if inner is not None:
+            self.flush()
+            self.add(f'if unpack_uint32(data, offset)[0] == {_NONE}:')
+            self.add(f'    {target} = None')
+            self.add('    offset += 4')
+            self.add('else:')
+            self.indent += 1
+            self.field(inner, target, path)
+            self.flush()
+            self.indent -= 1
+        elif isinstance(tp, Schema):
+            self.fields(tp, target, path)
+        elif tp is bool:
+            var = self.var('m')
+            self.item('I', var)
+            self.check(f'{var} != {_TRUE} and {var} != {_FALSE}', path)
+            self._checks.append(f'{target} = {var} == {_TRUE}')
+        elif tp is int or tp is float:
+            self.marker(_INT64 if tp is int else _DOUBLE, path)
+            self.item('Q' if tp is int else 'd', target)
+        elif tp is str or tp is bytes:
+            size = self.var('n')
+            self.marker(_STRING if tp is str else _BYTES, path)
+            self.item('I', size)
+            self.flush()
+            self.add(f'end = offset + {size}')
+            self.add('if end > len(data):')
+            self.add("    raise DecoderError(f'Value exceeds data by {end - len(data)} bytes.')")
+            if tp is str:
+                self.add(f"{target} = str(data[offset:end], encoding='utf-8')")
+            else:
+                self.add(f'{target} = data[offset:end].tobytes()')
+            self.add('offset = end')
+        elif tp is Fd:
+            index = self.var('i')
+            self.marker(_FD, path)
+            self.item('I', index)
+            self._checks.append(f'{target} = fds[{index}]')
+        elif tp is Any or tp is NativeType:
+            self.flush()
+            self.add(f'offset, {target} = _deserialize(fds, data, offset)')
+        else:
+            raise TypeError(f'Unsupported type of field {path}: {tp!r}.')
+
+
+def _schemas(schema: Schema) -> List[Schema]:
+    """Return the schema and all nested schemas."""
+    result = [schema]
+    for tp in schema.fields.values():
+        tp = _optional(tp) or tp
+        if isinstance(tp, Schema):
+            result.extend(_schemas(tp))
+    return result
+
+
+def _compile(schema: Schema) -> Tuple[str, Any, Any]:
+    """Generate the source code of encode and decode functions of the schema and compile them."""
+    namespace: Dict[str, Any] = {
+        'struct': struct,
+        'calcsize': struct.calcsize,
+        'pack_into': struct.pack_into,
+        'tuple_new': tuple.__new__,
+        'Fd': Fd,
+        'EncoderError': EncoderError,
+        'DecoderError': DecoderError,
+        '_plan': _plan,
+        '_pack': _pack,
+        '_deserialize': _deserialize,
+        'unpack_uint32': struct.Struct('=I').unpack_from,
+    }
+    encoder = _Encoder()
+    encoder.fields(schema, 'msg', schema.name)
+    encoder.pack(namespace)
+
+    decoder = _Decoder(namespace)
+    decoder.add('if not isinstance(data, memoryview):')
+    decoder.add('    data = memoryview(data)')
+    decoder.add("if data.format != 'B' or data.ndim != 1:")
+    decoder.add("    data = data.cast('B')")
+    decoder.add('offset = 0')
+    decoder.add('try:')
+    decoder.indent += 1
+    decoder.fields(schema, 'msg', schema.name)
+    decoder.indent -= 1
+    decoder.add('except (ValueError, IndexError, TypeError, struct.error) as e:')
+    decoder.add("    raise DecoderError(f'Decoder failure: {e}')")
+    decoder.add('if offset != len(data):')
+    decoder.add("    raise DecoderError(f'Decoding ended with extra data: {data[offset:].tobytes()}.')")
+    decoder.add('return msg')
+
+    source = '\n'.join([
+        'def encode(msg):',
+        *encoder.lines,
+        '',
+        '',
+        'def decode(data, fds):',
+        *decoder.lines,
+        '',
+    ])
+    for nested in _schemas(schema):
+        namespace[f'{nested.name}_{id(nested)}'] = nested.type
+    exec(compile(source, f'<schema {schema.name}>', 'exec'), namespace)
+    return source, namespace['encode'], namespace['decode']
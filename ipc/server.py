@@ -1,16 +1,22 @@
 from __future__ import annotations
 import os
 
-from typing import Type, Callable, Awaitable, Dict
+from typing import Type, Callable, Awaitable, Dict, Optional, Any, TYPE_CHECKING
 
 import trio
 from trio import ClosedResourceError, CancelScope
 
 from ipc.connection import Connection, RequestHandler, NotificationHandler
+from ipc.framing import BATCH_SIZE
+from ipc.metrics import ConnectionStats
+from ipc.pool import BufferPool
 from ipc.transport import Transport, SocketType
 from ipc.types import INT32_MAX
 from ipc.utils import WrappedCounter
 
+if TYPE_CHECKING:
+    from ipc.codecs import Codec
+
 ErrorHandler = Callable[[Connection, Exception], Awaitable[None]]
 
 
@@ -24,6 +30,12 @@ class Server:
         notification_handler: A callable to handle incoming notifications. Any exception will close the connection.
         error_handler: A callable to handle errors of individual client connections. An exception terminates the server.
         backlog: The number of client connections to be allowed to wait in a queue.
+        codec: A codec to be bound to client connections, see `Connection.codec`.
+        max_batch_size: See `Connection.max_batch_size`.
+        batch_delay: See `Connection.batch_delay`.
+        pool: A pool of receive buffers shared by client connections, see `Connection.pool`.
+        method_key: See `Connection.method_key`.
+        serve_stats: Whether to respond to `Connection.request_stats` with `stats`.
     """
 
     transport_factory: Type[Transport]
@@ -36,6 +48,20 @@ class Server:
     """A callable to handle errors of individual client connections. An exception terminates the server."""
     backlog: int
     """The number of client connections to be allowed to wait in a queue."""
+    codec: Optional[Codec]
+    """A codec to be bound to client connections or None."""
+    max_batch_size: int
+    """The maximal size of message bodies packed into a batch frame, 0 if batching is disabled."""
+    batch_delay: float
+    """The time in seconds to wait for more messages to batch."""
+    pool: Optional[BufferPool]
+    """A pool of receive buffers shared by client connections or None."""
+    method_key: Optional[Callable[[Any], str]]
+    """A callable returning method names of messages or None, see `Connection.method_key`."""
+    serve_stats: bool
+    """Whether to respond to `Connection.request_stats` of clients with `stats`."""
+    closed_stats: ConnectionStats
+    """Statistics of closed client connections."""
     address: bytes = None
     """Server address."""
     connections: Dict[int, Connection]
@@ -49,12 +75,25 @@ class Server:
                  request_handler: RequestHandler,
                  notification_handler: NotificationHandler,
                  error_handler: ErrorHandler,
-                 backlog: int = 0) -> None:
+                 backlog: int = 0,
+                 codec: Optional[Codec] = None,
+                 max_batch_size: int = BATCH_SIZE,
+                 batch_delay: float = 0.0,
+                 pool: Optional[BufferPool] = None,
+                 method_key: Optional[Callable[[Any], str]] = None,
+                 serve_stats: bool = False) -> None:
         self.transport_factory = transport_factory
         self.request_handler = request_handler
         self.notification_handler = notification_handler
         self.error_handler = error_handler
         self.backlog = backlog
+        self.codec = codec
+        self.max_batch_size = max_batch_size
+        self.batch_delay = batch_delay
+        self.pool = pool
+        self.method_key = method_key
+        self.serve_stats = serve_stats
+        self.closed_stats = ConnectionStats()
         self.connections = {}
         self._counter = WrappedCounter(1, INT32_MAX)
 
@@ -76,8 +115,8 @@ class Server:
         self.address = address
         with CancelScope() as self._scope:
             # Abstract sockets address starts with a zero byte.
-            # Other addresses are filesystem paths.
-            if self.address[0]:
+            # Other addresses are filesystem paths or (host, port) tuples of TCP sockets.
+            if not isinstance(self.address, tuple) and self.address[0]:
                 # Remove dangling socket.
                 try:
                     os.unlink(self.address)
@@ -105,13 +144,35 @@ class Server:
                 break
 
         self.connections[num] = conn = Connection(
-            num, self.transport_factory, self.request_handler, self.notification_handler)
+            num, self.transport_factory, self.request_handler, self.notification_handler, self.codec,
+            self.max_batch_size, self.batch_delay, self.pool, self.method_key)
+        if self.serve_stats:
+            conn.stats_provider = self.stats
         try:
             await conn.attach(socket, address)
         except Exception as e:
             await self.error_handler(conn, e)
         finally:
             del self.connections[num]
+            self.closed_stats.merge(conn.stats)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of statistics of client connections.
+
+        Returns:
+            A dictionary with statistics of all connections including closed ones under 'total'
+            and statistics of open connections by their number under 'connections',
+            see `ConnectionStats.snapshot`.
+        """
+        total = ConnectionStats()
+        total.merge(self.closed_stats)
+        for conn in self.connections.values():
+            total.merge(conn.stats)
+        return {
+            'total': total.snapshot(),
+            'connections': {str(num): conn.stats.snapshot() for num, conn in self.connections.items()},
+        }
 
     def close(self) -> None:
         """Close the server and client connections."""
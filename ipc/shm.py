@@ -0,0 +1,520 @@
+from __future__ import annotations
+import ctypes
+import mmap
+import os
+import platform
+import select
+import struct
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+import trio
+from trio.lowlevel import ParkingLot, cancel_shielded_checkpoint, checkpoint_if_cancelled, wait_readable
+
+from ipc.transport import Transport, PacketTransport, Message, SocketType, TransportError, WriteError, WrongDataError
+from ipc.transport import BATCH_BUDGET
+from ipc.types import Buffer, Bytes, Fd
+
+try:
+    from os import memfd_create, eventfd, eventfd_write, MFD_CLOEXEC, EFD_CLOEXEC, EFD_NONBLOCK
+except ImportError:
+    # Memfds and eventfds are Linux-only.
+    eventfd = None
+
+RING_SIZE = 1024 * 1024
+"""The default size of the data area of a ring buffer in bytes."""
+READ_YIELDS = 3
+"""The number of times a reader yields to other tasks before it sleeps waiting for data."""
+POLL_INTERVAL = 0.01
+"""The maximal time in seconds to sleep without checking a ring buffer if memory barriers are not supported."""
+
+# The control block of a ring buffer: the write position, the read position, and flags whether
+# the reader and the writer sleep. Positions only grow and are masked by the size of the data area.
+_WRITE_POS = 0
+_READ_POS = 8
+_READER_SLEEPING = 16
+_WRITER_SLEEPING = 20
+_DATA_OFFSET = 64
+_UINT32 = struct.Struct('=I')
+_UINT64 = struct.Struct('=Q')
+
+# A record consists of a header (message number, flags, body size, kind) and a body padded to 8 bytes.
+_RECORD = struct.Struct('=IIII')
+_INLINE = 0
+_OUT_OF_BAND = 1
+
+# Numbers of messages of the socket.
+_SETUP = 1
+_BODY = 2
+
+# Processors whose stores are seen by other processors in order and are not reordered with older loads,
+# see ShmTransport.
+_TSO_MACHINES = ('x86_64', 'amd64', 'i386', 'i686')
+# The membarrier system call and its commands, see membarrier(2).
+_SYS_MEMBARRIER = {'x86_64': 324, 'amd64': 324, 'i386': 375, 'i686': 375}
+_MEMBARRIER_CMD_GLOBAL_EXPEDITED = 1 << 1
+_MEMBARRIER_CMD_REGISTER_GLOBAL_EXPEDITED = 1 << 2
+_membarrier = None
+
+
+class ShmTransport(Transport):
+    """
+    A transport exchanging messages through shared memory ring buffers over AF_UNIX SOCK_SEQPACKET socket.
+
+    Each endpoint creates a ring buffer in a memfd for messages it writes and passes it to the other
+    endpoint before the first message. Messages are then copied into and out of shared memory without
+    any system call, so that co-located processes exchange many more messages per second with lower
+    latency under sustained load. An eventfd wakes up the reader only when it sleeps waiting for data
+    and another eventfd wakes up the writer only when it sleeps waiting for free space.
+
+    Messages with file descriptors and messages larger than a quarter of the ring buffer are sent
+    over the socket, in order with other messages, as PacketTransport does. The socket also
+    signals that the remote endpoint has closed the connection.
+
+    Like PacketTransport, messages in the ring buffer are read and written without yielding to other
+    tasks, which happens only if the task waits or after `batch_budget` messages. A reader finding
+    the ring buffer empty yields to other tasks up to READ_YIELDS times before it goes to sleep,
+    so that a reply produced in the meantime costs no system call to wake up the reader.
+
+    Memory ordering: Data of a record are stored before the write position, which is loaded before the data
+    by the reader, and the read position is stored after the data have been loaded. CPython has no memory
+    fences, so this relies on the total store order of x86 processors, which never reorder stores with
+    other stores and loads with other loads. The transport is therefore not supported on other processors,
+    whose weaker ordering would let the reader see the write position before the data.
+
+    Even x86 processors reorder a store with a later load, so an endpoint going to sleep could miss
+    a wakeup: it stores its sleeping flag and loads the position, while the other endpoint stores the
+    position and loads the flag. The sleeping endpoint therefore issues the `membarrier` system call
+    after the flag is stored, which executes a memory barrier on all processors running the other
+    endpoint. If the kernel does not support it, sleeping endpoints check the ring buffer again
+    after POLL_INTERVAL at the latest.
+
+    See Transport for information about parameters.
+
+    Args:
+        ring_size: The size of the data area of the ring buffer, a power of two. RING_SIZE by default.
+        batch_budget: The number of messages read or written without yielding to other tasks.
+
+    Raises:
+        WrongSocketError: If the passed socket is of a wrong type.
+        TransportError: If shared memory is not supported.
+        ValueError: If the ring size is not a power of two.
+
+    Protocol:
+        Messages of the socket are sent by PacketTransport. The first message has number 1 and holds
+        the size of the data area of the ring buffer as a 64bit integer in machine byte order and three
+        file descriptors: the memfd, an eventfd to wake up the reader and an eventfd to wake up the writer.
+
+        The memfd starts with a control block of 64 bytes holding 64bit write and read positions
+        and 32bit flags whether the reader and the writer sleep, in machine byte order. It is followed
+        by the data area. A writer copies a record at the write position and then advances it.
+        A reader copies a record at the read position and then advances it.
+
+        A record consists of a header of four 32bit integers (message number, flags, body size, kind)
+        and a body padded to 8 bytes. Records of kind 0 hold the body. Records of kind 1 have an empty
+        body and the body and file descriptors of the message are sent as a message of the socket
+        with number 2 before the record, so that the reader never waits for a body which has not been
+        sent. The reader may thus receive the bodies of out-of-band messages before their records.
+    """
+
+    SOCKET_TYPE = PacketTransport.SOCKET_TYPE
+    ring_size: int
+    """The size of the data area of the ring buffer of written messages."""
+    batch_budget: int
+    """The number of messages read or written without yielding to other tasks if they need not wait."""
+    _packets: PacketTransport
+    _tx: Optional[_Ring] = None
+    _rx: Optional[_Ring] = None
+    _epoll: Optional[select.epoll] = None
+    _space_epoll: Optional[select.epoll] = None
+    _bodies: Deque[Message]
+    _reads: int = 0
+    _writes: int = 0
+    _writing: bool = False
+    _writers: ParkingLot
+
+    def __init__(self, socket: SocketType, *, ring_size: int = RING_SIZE, batch_budget: int = BATCH_BUDGET):
+        super().__init__(socket)
+        self._packets = PacketTransport(socket)
+        if eventfd is None:
+            raise TransportError('Shared memory is not supported.')
+        if platform.machine().lower() not in _TSO_MACHINES:
+            raise TransportError(f'Shared memory is not supported on {platform.machine()} processors.')
+        if ring_size < _RECORD.size or ring_size & (ring_size - 1):
+            raise ValueError(f'The ring size must be a power of two: {ring_size}.')
+        self.ring_size = ring_size
+        self.batch_budget = batch_budget
+        self._bodies = deque()
+        self._writers = ParkingLot()
+        # The process must be registered before the remote endpoint issues memory barriers.
+        _register_membarrier()
+
+    async def read(self) -> Message:
+        """
+        Read a message from the ring buffer of the remote endpoint.
+
+        See Transport.read for information about returned values.
+
+        This method checks for cancellation, but it yields to other tasks only if it waits for data
+        or after `batch_budget` messages read without waiting.
+
+        Raises:
+            NoDataError: If the remote endpoint has closed the connection.
+            ReadError: If an incomplete read of header/body occurs.
+            WrongDataError: If the ring buffer or messages of the socket are malformed.
+        """
+        await checkpoint_if_cancelled()
+        self._reads += 1
+        if self._reads >= self.batch_budget:
+            self._reads = 0
+            await cancel_shielded_checkpoint()
+
+        while self._rx is None:
+            msg = await self._packets.read()
+            if msg.num != _SETUP or len(msg.data) != 8 or len(msg.fds) != 3:
+                raise WrongDataError(f'Expected the setup of a ring buffer, got message #{msg.num}.')
+            self._rx = _Ring.attach(msg.fds, _UINT64.unpack_from(msg.data)[0])
+
+        ring = self._rx
+        available = ring.readable()
+        yields = 0
+        while available < _RECORD.size:
+            self._reads = 0
+            if yields < READ_YIELDS:
+                # Checking the ring buffer costs no system call, so the reader first yields to other tasks,
+                # which may produce a record in the meantime, before it goes to sleep.
+                yields += 1
+                await cancel_shielded_checkpoint()
+            else:
+                await self._wait_data(ring)
+            available = ring.readable()
+
+        num, flags, size, kind = ring.header()
+        if kind == _OUT_OF_BAND:
+            # The record is consumed only when its body has been received, so that a cancelled read
+            # does not leave the body in the socket.
+            body = self._bodies.popleft() if self._bodies else await self._read_body()
+            ring.consume(_RECORD.size)
+            return Message(num, flags, body.data, body.fds, body.buffer)
+        if kind != _INLINE:
+            raise WrongDataError(f'Unknown kind of record: {kind}.')
+        record_size = _RECORD.size + _padded(size)
+        if available < record_size:
+            raise WrongDataError(f'Incomplete record: {record_size} bytes expected, {available} available.')
+        data, pooled = self._allocate(size)
+        ring.read(data, _RECORD.size)
+        ring.consume(record_size)
+        return Message(num, flags, data, [], pooled)
+
+    async def write(self, msg: Message) -> None:
+        """
+        Write a message to the ring buffer.
+
+        See Transport.write for information about parameters.
+
+        The method may be called by concurrent tasks. Their messages are written one at a time.
+
+        This method checks for cancellation, but it yields to other tasks only if it waits for free space
+        or the socket or after `batch_budget` messages written without waiting.
+
+        Raises:
+            WriteError: When a socket write fails or the remote endpoint has closed the connection
+                while waiting for free space.
+            WrongDataError: If the ring buffer is malformed.
+        """
+        await checkpoint_if_cancelled()
+        self._writes += 1
+        if self._writes >= self.batch_budget:
+            self._writes = 0
+            await cancel_shielded_checkpoint()
+
+        await self._acquire_writing()
+        try:
+            if self._tx is None:
+                ring = _Ring.create(self.ring_size)
+                try:
+                    await self._packets.write(Message(_SETUP, 0, _UINT64.pack(ring.size), ring.fds))
+                except BaseException:
+                    ring.close()
+                    raise
+                self._tx = ring
+
+            ring = self._tx
+            if isinstance(msg.data, list):
+                segments = msg.data
+                views = [memoryview(segment).cast('B') for segment in segments]
+                size = sum(view.nbytes for view in views)
+            else:
+                segments = [msg.data]
+                views = [memoryview(msg.data).cast('B')]
+                size = views[0].nbytes
+            out_of_band = bool(msg.fds) or size > ring.size // 4
+            record_size = _RECORD.size if out_of_band else _RECORD.size + _padded(size)
+            while ring.writable() < record_size:
+                self._writes = 0
+                await self._wait_space(ring, record_size)
+
+            if out_of_band:
+                # The body is sent before the record, so that a cancelled write never leaves the reader
+                # waiting for the body of a visible record. The record follows without yielding.
+                await self._packets.write(Message(_BODY, 0, segments, msg.fds))
+                ring.append(msg.num, msg.flags, _OUT_OF_BAND, [], 0)
+            else:
+                ring.append(msg.num, msg.flags, _INLINE, views, size)
+        finally:
+            self._release_writing()
+
+    def close(self) -> None:
+        """Unmap the ring buffers and close their file descriptors. The socket is not closed."""
+        for epoll in (self._epoll, self._space_epoll):
+            if epoll is not None:
+                epoll.close()
+        self._epoll = self._space_epoll = None
+        for ring in (self._tx, self._rx):
+            if ring is not None:
+                ring.close()
+        self._tx = self._rx = None
+        while self._bodies:
+            self._bodies.popleft().release()
+
+    async def _read_body(self) -> Message:
+        # Receive the body of an out-of-band message from the socket.
+        self._packets.pool = self.pool
+        msg = await self._packets.read()
+        if msg.num != _BODY:
+            msg.release()
+            raise WrongDataError(f'Expected the body of a message, got message #{msg.num}.')
+        return msg
+
+    async def _wait_data(self, ring: _Ring) -> None:
+        # The flag is set before checking the ring buffer again, so that a writer wakes up the reader
+        # if it advances the write position in the meantime, see ShmTransport.
+        ring.set_flag(_READER_SLEEPING, True)
+        try:
+            fenced = _membarrier is not None and _membarrier()
+            if ring.readable() >= _RECORD.size:
+                return
+            socket_fd = self.socket.fileno()
+            if self._epoll is None:
+                self._epoll = _wait_set(ring.data_fd, socket_fd, select.EPOLLIN)
+            await _wait(self._epoll, fenced)
+            # Polling consumes the wakeup of the eventfd.
+            socket_ready = any(fd == socket_fd for fd, _events in self._epoll.poll(0))
+            # The remote endpoint may have advanced the write position before the socket became readable.
+            if not socket_ready or ring.readable() >= _RECORD.size:
+                return
+            # The socket is readable without a record in the ring buffer. It is either the body of an out-of-band
+            # message whose record follows, or the read raises NoDataError if the remote endpoint has closed
+            # the connection.
+            self._bodies.append(await self._read_body())
+        finally:
+            ring.set_flag(_READER_SLEEPING, False)
+
+    async def _wait_space(self, ring: _Ring, size: int) -> None:
+        ring.set_flag(_WRITER_SLEEPING, True)
+        try:
+            fenced = _membarrier is not None and _membarrier()
+            if ring.writable() >= size:
+                return
+            socket_fd = self.socket.fileno()
+            if self._space_epoll is None:
+                # The writer waits for the remote endpoint closing the socket too.
+                self._space_epoll = _wait_set(ring.space_fd, socket_fd, select.EPOLLRDHUP)
+            await _wait(self._space_epoll, fenced)
+            socket_closed = any(fd == socket_fd for fd, _events in self._space_epoll.poll(0))
+            if socket_closed and ring.writable() < size:
+                raise WriteError('The remote endpoint has closed the connection.')
+        finally:
+            ring.set_flag(_WRITER_SLEEPING, False)
+
+    async def _acquire_writing(self) -> None:
+        # Messages are written by a single task at a time, so that the free space found by a writer
+        # is not taken by another one and bodies of out-of-band messages are sent in order of their records.
+        if self._writing:
+            await self._writers.park()
+        else:
+            self._writing = True
+
+    def _release_writing(self) -> None:
+        if self._writers:
+            self._writers.unpark()
+        else:
+            self._writing = False
+
+
+class _Ring:
+    """A ring buffer in a memfd shared by a writer and a reader."""
+
+    size: int
+    fds: List[Fd]
+    data_fd: int
+    space_fd: int
+    _mmap: mmap.mmap
+    _control: memoryview
+    _data: memoryview
+    _header: bytearray
+    _mask: int
+    _pos: int
+
+    def __init__(self, fds: List[Fd], size: int, mapping: mmap.mmap):
+        self.size = size
+        self.fds = fds
+        self.data_fd = fds[1].get()
+        self.space_fd = fds[2].get()
+        self._mmap = mapping
+        self._control = memoryview(mapping)[:_DATA_OFFSET]
+        self._data = memoryview(mapping)[_DATA_OFFSET:]
+        self._header = bytearray(_RECORD.size)
+        self._mask = size - 1
+        self._pos = 0
+
+    @classmethod
+    def create(cls, size: int) -> _Ring:
+        """Create a ring buffer to write to."""
+        memfd = Fd(memfd_create('ipc-ring', MFD_CLOEXEC))
+        os.ftruncate(memfd.get(), _DATA_OFFSET + size)
+        fds = [memfd, Fd(eventfd(0, EFD_CLOEXEC | EFD_NONBLOCK)), Fd(eventfd(0, EFD_CLOEXEC | EFD_NONBLOCK))]
+        return cls(fds, size, mmap.mmap(memfd.get(), _DATA_OFFSET + size))
+
+    @classmethod
+    def attach(cls, fds: List[Fd], size: int) -> _Ring:
+        """Attach a ring buffer of the remote endpoint to read from."""
+        if size < _RECORD.size or size & (size - 1):
+            raise WrongDataError(f'The ring size must be a power of two: {size}.')
+        try:
+            if os.fstat(fds[0].get()).st_size != _DATA_OFFSET + size:
+                raise WrongDataError(f'The ring buffer {fds[0]} is not {size} bytes large.')
+            for fd in fds[1:]:
+                os.set_blocking(fd.get(), False)
+            return cls(fds, size, mmap.mmap(fds[0].get(), _DATA_OFFSET + size))
+        except OSError as e:
+            raise WrongDataError(f'Cannot map the ring buffer {fds[0]}: {e}')
+
+    def readable(self) -> int:
+        """Return the number of bytes available to the reader."""
+        available = _UINT64.unpack_from(self._control, _WRITE_POS)[0] - self._pos
+        if not 0 <= available <= self.size:
+            raise WrongDataError(f'Invalid write position of the ring buffer: {self._pos + available}.')
+        return available
+
+    def writable(self) -> int:
+        """Return the number of bytes available to the writer."""
+        used = self._pos - _UINT64.unpack_from(self._control, _READ_POS)[0]
+        if not 0 <= used <= self.size:
+            raise WrongDataError(f'Invalid read position of the ring buffer: {self._pos - used}.')
+        return self.size - used
+
+    def header(self) -> Tuple[int, int, int, int]:
+        """Unpack the header of the record at the read position."""
+        start = self._pos & self._mask
+        if start + _RECORD.size <= self.size:
+            return _RECORD.unpack_from(self._data, start)
+        return _RECORD.unpack(self.read(self._header))
+
+    def read(self, data: Buffer, offset: int = 0) -> Buffer:
+        """Copy data at the offset from the read position into a buffer and return it."""
+        size = len(data)
+        start = (self._pos + offset) & self._mask
+        first = min(size, self.size - start)
+        data[:first] = self._data[start:start + first]
+        if first < size:
+            data[first:] = self._data[:size - first]
+        return data
+
+    def write(self, data: Bytes, offset: int = 0) -> None:
+        """Copy data at the offset from the write position."""
+        view = memoryview(data)
+        size = view.nbytes
+        start = (self._pos + offset) & self._mask
+        first = min(size, self.size - start)
+        self._data[start:start + first] = view[:first]
+        if first < size:
+            self._data[:size - first] = view[first:]
+
+    def append(self, num: int, flags: int, kind: int, body: List[memoryview], size: int) -> None:
+        """Copy a record at the write position and produce it."""
+        start = self._pos & self._mask
+        end = start + _RECORD.size
+        if end + size <= self.size:
+            # The record does not wrap around, which is the common case.
+            _RECORD.pack_into(self._data, start, num, flags, size, kind)
+            for view in body:
+                self._data[end:end + view.nbytes] = view
+                end += view.nbytes
+        else:
+            self.write(_RECORD.pack(num, flags, size, kind))
+            offset = _RECORD.size
+            for view in body:
+                self.write(view, offset)
+                offset += view.nbytes
+        self.produce(_RECORD.size + _padded(size))
+
+    def consume(self, size: int) -> None:
+        """Advance the read position and wake up the writer if it sleeps."""
+        self._pos += size
+        _UINT64.pack_into(self._control, _READ_POS, self._pos)
+        if _UINT32.unpack_from(self._control, _WRITER_SLEEPING)[0]:
+            # The flag is reset, so that the writer is woken up only once for each wait.
+            _UINT32.pack_into(self._control, _WRITER_SLEEPING, 0)
+            eventfd_write(self.space_fd, 1)
+
+    def produce(self, size: int) -> None:
+        """Advance the write position and wake up the reader if it sleeps."""
+        # Data are stored before the position, see ShmTransport for memory ordering.
+        self._pos += size
+        _UINT64.pack_into(self._control, _WRITE_POS, self._pos)
+        if _UINT32.unpack_from(self._control, _READER_SLEEPING)[0]:
+            # The flag is reset, so that the reader is woken up only once for each wait.
+            _UINT32.pack_into(self._control, _READER_SLEEPING, 0)
+            eventfd_write(self.data_fd, 1)
+
+    def set_flag(self, offset: int, value: bool) -> None:
+        """Set whether the reader or the writer sleeps."""
+        _UINT32.pack_into(self._control, offset, value)
+
+    def close(self) -> None:
+        """Unmap the ring buffer and close its file descriptors."""
+        self._control.release()
+        self._data.release()
+        self._mmap.close()
+        for fd in self.fds:
+            fd.close()
+
+
+def _padded(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def _wait_set(eventfd_: int, socket_fd: int, socket_events: int) -> select.epoll:
+    # Create an epoll instance to wait for both an eventfd and the socket. The eventfd is edge-triggered,
+    # so that polling consumes its wakeups without resetting it by another system call.
+    epoll = select.epoll()
+    epoll.register(eventfd_, select.EPOLLIN | select.EPOLLET)
+    epoll.register(socket_fd, socket_events)
+    return epoll
+
+
+async def _wait(epoll: select.epoll, fenced: bool) -> None:
+    # Without memory barriers, a wakeup may be missed, see ShmTransport.
+    if fenced:
+        await wait_readable(epoll.fileno())
+    else:
+        with trio.move_on_after(POLL_INTERVAL):
+            await wait_readable(epoll.fileno())
+
+
+def _register_membarrier() -> None:
+    # Set _membarrier to a function issuing memory barriers in other processes if the kernel supports them.
+    global _membarrier
+    if _membarrier is not None:
+        return
+    number = _SYS_MEMBARRIER.get(platform.machine().lower())
+    if number is None:
+        return
+    try:
+        syscall = ctypes.CDLL(None, use_errno=True).syscall
+    except (OSError, AttributeError):
+        return
+    if syscall(number, _MEMBARRIER_CMD_REGISTER_GLOBAL_EXPEDITED, 0) != 0:
+        return
+    _membarrier = lambda: syscall(number, _MEMBARRIER_CMD_GLOBAL_EXPEDITED, 0) == 0  # noqa: E731
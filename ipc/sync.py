@@ -0,0 +1,445 @@
+from __future__ import annotations
+import json
+import socket as stdlib_socket
+import threading
+import time
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Type, TYPE_CHECKING
+
+from ipc.aio import ConnectionClosedError
+from ipc.framing import PacketFraming, Message, NoDataError, BATCH_BUDGET, MAX_MESSAGE_SIZE, MAX_PENDING_SIZE, message_size
+from ipc.metrics import ConnectionStats
+from ipc.protocol import Flags, FEATURE_FLAGS
+from ipc.types import Buffer, Bytes, Fd, INT32_MAX, IPCError
+from ipc.utils import WrappedCounter
+
+if TYPE_CHECKING:
+    from ipc.codecs import Codec
+
+SyncRequestHandler = Callable[['SyncClient', Any, List[Fd]], Tuple[Any, List[Fd]]]
+SyncNotificationHandler = Callable[['SyncClient', Any, List[Fd]], None]
+
+# Flags as integers, because operations with enum members are relatively slow for every message.
+_REQUEST = Flags.REQUEST.value
+_RESPONSE = Flags.RESPONSE.value
+_NOTIFICATION = Flags.NOTIFICATION.value
+_STATS = Flags.STATS.value
+_FEATURE_FLAGS = FEATURE_FLAGS.value
+
+
+class SyncPacketTransport(PacketFraming):
+    """
+    PacketFraming for blocking calls, which is wire-compatible with the trio one.
+
+    It takes a standard socket, which is switched to blocking mode. Its coroutines never suspend,
+    because system calls block instead, so `read_blocking` and `write_blocking` run them to completion
+    without any event loop. A single-record message then takes a single `sendmsg` or `recvmsg_into` call.
+
+    The transport is not thread-safe, see SyncClient.
+
+    See PacketFraming for information about parameters.
+    """
+
+    socket: stdlib_socket.socket
+
+    def __init__(self, socket: stdlib_socket.socket, *, max_message_size: int = MAX_MESSAGE_SIZE,
+                 max_pending_size: int = MAX_PENDING_SIZE, spill_size: Optional[int] = None,
+                 batch_budget: int = BATCH_BUDGET):
+        super().__init__(socket, max_message_size=max_message_size, max_pending_size=max_pending_size,
+                         spill_size=spill_size, batch_budget=batch_budget)
+        self.socket = socket
+        socket.setblocking(True)
+
+    @classmethod
+    def create_socket(cls) -> stdlib_socket.socket:
+        """
+        Create a blocking standard socket suitable for this implementation.
+
+        Returns:
+            New socket.
+        """
+        return stdlib_socket.socket(*cls.SOCKET_TYPE)
+
+    async def read(self) -> Message:
+        """
+        Read a message from a SEQPACKET socket.
+
+        See PacketTransport.read for information about returned values and raised errors.
+        The coroutine blocks, see `read_blocking`.
+        """
+        return await self._read_message()
+
+    async def write(self, msg: Message) -> None:
+        """
+        Write a message to a SEQPACKET socket.
+
+        See PacketTransport.write for information about parameters and raised errors.
+        The coroutine blocks, see `write_blocking`.
+        """
+        await self._write_message(msg)
+
+    def read_blocking(self) -> Message:
+        """Read a message and block until it is received, see `read`."""
+        return _run(self.read())
+
+    def write_blocking(self, msg: Message) -> None:
+        """Write a message and block until it is sent, see `write`."""
+        _run(self.write(msg))
+
+    async def _recvmsg_into(self, buffers: List[Buffer], ancillary_size: int) -> Tuple[int, list, int, Any]:
+        return self._sock.recvmsg_into(buffers, ancillary_size)
+
+    async def _sendmsg(self, buffers: List[Bytes], ancillary: list, flags: int) -> int:
+        return self._sock.sendmsg(buffers, ancillary, flags)
+
+
+class SyncClient:
+    """
+    A blocking client speaking the protocol of Connection, for scripts and threads without an event loop.
+
+    The socket is persistent, and many threads may call `send` and `notify` concurrently over one client.
+    Writes are serialized by a lock. A thread waiting for a response reads messages from the socket
+    and hands responses of other threads over to them, until its own response arrives. Then
+    another waiting thread takes over reading. A single caller thus pays one `sendmsg` and one
+    `recvmsg_into` call per request, and no thread is switched to deliver its response.
+
+    Requests and notifications of the remote endpoint are handled only by threads waiting for
+    a response, with the handlers called on the reading thread. Batch frames are not accepted,
+    so the remote endpoint sends messages one by one.
+
+    Args:
+        codec: A codec to encode and decode messages or None, see `Connection.codec`.
+        request_handler: A callable to handle requests of the remote endpoint or None.
+            Any exception or a request without a handler will close the client.
+        notification_handler: A callable to handle notifications of the remote endpoint or None to ignore them.
+            Any exception will close the client.
+        transport_factory: A callable to provide transport for the client.
+    """
+
+    transport_factory: Type[SyncPacketTransport]
+    """A callable to provide transport for the client."""
+    request_handler: Optional[SyncRequestHandler] = None
+    """A callable to handle requests of the remote endpoint or None."""
+    notification_handler: Optional[SyncNotificationHandler] = None
+    """A callable to handle notifications of the remote endpoint or None."""
+    address: bytes = None
+    """The address of the remote endpoint or None."""
+    features: Flags = Flags.NONE
+    """Feature flags advertised to the remote endpoint with every message."""
+    peer_features: Flags = Flags.NONE
+    """Feature flags advertised by the remote endpoint."""
+    codec: Optional[Codec] = None
+    """A codec bound to this client to encode and decode messages or None, see `Connection.codec`."""
+    stats: ConnectionStats
+    """Statistics of messages and errors of this client. Method statistics are not collected."""
+    _socket: stdlib_socket.socket = None
+    _transport: SyncPacketTransport = None
+    _error: Optional[Exception] = None
+    _features: int = 0
+    _peer_features: int = 0
+    _lock: threading.Lock
+    _write_lock: threading.Lock
+    _read_lock: threading.Lock
+    _calls: Dict[int, _Call]
+
+    def __init__(self,
+                 codec: Optional[Codec] = None,
+                 request_handler: Optional[SyncRequestHandler] = None,
+                 notification_handler: Optional[SyncNotificationHandler] = None,
+                 transport_factory: Type[SyncPacketTransport] = SyncPacketTransport) -> None:
+        self.transport_factory = transport_factory
+        self.request_handler = request_handler
+        self.notification_handler = notification_handler
+        self.stats = ConnectionStats()
+        if codec is not None:
+            self.codec = codec.bind(self)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._calls = {}
+        self._counter = WrappedCounter(1, INT32_MAX)
+
+    def __repr__(self) -> str:
+        return f'SyncClient: {self._socket}'
+
+    def __enter__(self) -> SyncClient:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def connect(self, address: bytes) -> None:
+        """
+        Connect to a remote endpoint.
+
+        Args:
+            address: The address to connect to.
+
+        Raises:
+            OSError: If the connection cannot be established.
+        """
+        socket = self.transport_factory.create_socket()
+        try:
+            socket.connect(address)
+        except BaseException:
+            socket.close()
+            raise
+        self.attach(socket, address)
+
+    def attach(self, socket: stdlib_socket.socket, address: bytes) -> None:
+        """
+        Attach an already connected socket.
+
+        Args:
+            socket: The socket to attach to.
+            address: The address of the remote endpoint.
+
+        Raises:
+            RuntimeError: If the client has been already attached.
+        """
+        if self._socket is not None:
+            raise RuntimeError('Already attached.')
+        self.address = address
+        self._socket = socket
+        self._transport = self.transport_factory(socket)
+        self._features = self.features.value
+
+    def close(self) -> None:
+        """Close the client. Threads waiting for responses fail with ConnectionClosedError."""
+        with self._lock:
+            if self._socket is None or self._socket.fileno() < 0:
+                return
+            self._set_error(ConnectionClosedError())
+        # A thread blocked reading the socket receives the end of file.
+        try:
+            self._socket.shutdown(stdlib_socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._fail_calls()
+        self._socket.close()
+
+    def send(self, data: Any, fds: List[Fd] = None) -> Tuple[Any, List[Fd]]:
+        """
+        Send a request and block until its response is received.
+
+        It may be called by many threads concurrently.
+
+        Args:
+            data: Data to send or a message to encode if `codec` is set.
+            fds: File descriptors to send. If `codec` is set, they follow file descriptors
+                of the encoded message.
+
+        Returns: Response of the request.
+
+        Raises:
+            Exception: An error occurred when sending request or receiving response.
+        """
+        start = time.perf_counter()
+        data, fds = self._request(_REQUEST, data, fds or [])
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.stats.round_trip.add(elapsed)
+        return data, fds
+
+    def notify(self, data: Any, fds: List[Fd] = None) -> None:
+        """
+        Send a notification.
+
+        It may be called by many threads concurrently.
+
+        Args:
+            data: Data to send or a message to encode if `codec` is set.
+            fds: File descriptors to send. If `codec` is set, they follow file descriptors
+                of the encoded message.
+
+        Raises:
+            Exception: An error occurred when sending the notification.
+        """
+        self._check_not_closed()
+        self._write(Message(0, _NOTIFICATION, data, fds or []))
+
+    def request_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        Request statistics of the remote endpoint, see `Connection.request_stats`.
+
+        Returns: Statistics or None if the remote endpoint does not provide them or fails to.
+
+        Raises:
+            Exception: An error occurred when sending request or receiving response.
+        """
+        data, _fds = self._request(_REQUEST | _STATS, b'', [])
+        return json.loads(bytes(data))
+
+    def _request(self, flags: int, data: Any, fds: List[Fd]) -> Tuple[Any, List[Fd]]:
+        self._check_not_closed()
+        call = _Call()
+        with self._lock:
+            while True:
+                num = next(self._counter)
+                if num not in self._calls:
+                    break
+            self._calls[num] = call
+        try:
+            self._write(Message(num, flags, data, fds))
+            self._wait(call)
+        finally:
+            with self._lock:
+                del self._calls[num]
+        if call.error is not None:
+            raise call.error
+        return call.data, call.fds
+
+    def _check_not_closed(self) -> None:
+        if self._error is not None:
+            raise self._error
+        if self._transport is None:
+            raise ConnectionClosedError()
+
+    def _write(self, msg: Message) -> None:
+        with self._write_lock:
+            # Messages are encoded in the order they are written, so that stateful codecs can be used.
+            if self.codec is not None and not msg.flags & _STATS:
+                try:
+                    data, fds, flags = self.codec.encode_message(msg.data)
+                except IPCError as e:
+                    self.stats.error(e)
+                    raise
+                msg = Message(msg.num, msg.flags | flags | self._features, data, fds + msg.fds)
+            else:
+                msg = Message(msg.num, msg.flags | self._features, msg.data, msg.fds)
+            try:
+                self._transport.write_blocking(msg)
+            except Exception as e:
+                self.stats.error(e)
+                self._set_error(e)
+                self.close()
+                raise
+            stats = self.stats
+            stats.messages_out += 1
+            stats.frames_out += 1
+            stats.bytes_out += message_size(msg)
+            stats.fds_out += len(msg.fds)
+
+    def _wait(self, call: _Call) -> None:
+        # The first waiting thread reads messages, others wait until their response is handed over to them
+        # or until they are woken up to take over reading.
+        while not call.done:
+            if self._read_lock.acquire(blocking=False):
+                try:
+                    while not call.done:
+                        self._read()
+                finally:
+                    self._read_lock.release()
+                    self._wake_reader()
+            else:
+                call.lock.acquire()
+                with self._lock:
+                    call.woken = False
+
+    def _wake_reader(self) -> None:
+        with self._lock:
+            for call in self._calls.values():
+                if not call.done:
+                    call.wake()
+                    return
+
+    def _read(self) -> None:
+        try:
+            msg = self._transport.read_blocking()
+        except Exception as e:
+            if isinstance(e, NoDataError):
+                e = ConnectionClosedError(str(e))
+            else:
+                self.stats.error(e)
+            with self._lock:
+                self._set_error(e)
+            self._fail_calls()
+            return
+
+        stats = self.stats
+        stats.frames_in += 1
+        stats.messages_in += 1
+        stats.bytes_in += len(msg.data)
+        stats.fds_in += len(msg.fds)
+        features = msg.flags & _FEATURE_FLAGS
+        if features & ~self._peer_features:
+            self._peer_features |= features
+            self.peer_features = Flags(self._peer_features)
+        try:
+            if self.codec is not None and not msg.flags & _STATS:
+                msg = msg._replace(data=self.codec.decode_message(msg.data, msg.fds, msg.flags))
+            self._dispatch(msg)
+        except Exception as e:
+            self.stats.error(e)
+            with self._lock:
+                self._set_error(e)
+            self.close()
+
+    def _dispatch(self, msg: Message) -> None:
+        if msg.flags & _RESPONSE:
+            with self._lock:
+                call = self._calls.get(msg.num)
+                if call is not None:
+                    call.data = msg.data
+                    call.fds = msg.fds
+                    call.done = True
+                    call.wake()
+        elif msg.flags & _REQUEST:
+            if msg.flags & _STATS:
+                data, fds = json.dumps(None).encode(), []
+                flags = _RESPONSE | _STATS
+            elif self.request_handler is not None:
+                data, fds = self.request_handler(self, msg.data, msg.fds)
+                flags = _RESPONSE
+            else:
+                raise IPCError(f'Request #{msg.num} cannot be handled without a request handler.')
+            self._write(Message(msg.num, flags, data, fds or []))
+        elif msg.flags & _NOTIFICATION:
+            if self.notification_handler is not None:
+                self.notification_handler(self, msg.data, msg.fds)
+        else:
+            raise RuntimeError('Unknown message type')
+
+    def _set_error(self, error: Exception) -> Exception:
+        if self._error is None:
+            self._error = error
+        return self._error
+
+    def _fail_calls(self) -> None:
+        with self._lock:
+            for call in self._calls.values():
+                if not call.done:
+                    call.error = self._error
+                    call.done = True
+                    call.wake()
+
+
+class _Call:
+    """A request waiting for its response."""
+
+    __slots__ = ('lock', 'woken', 'done', 'data', 'fds', 'error')
+
+    def __init__(self):
+        # The lock is held until the waiting thread is woken up.
+        self.lock = threading.Lock()
+        self.lock.acquire()
+        self.woken = False
+        self.done = False
+        self.data = None
+        self.fds = None
+        self.error = None
+
+    def wake(self) -> None:
+        """Wake up the waiting thread, it must be called with SyncClient._lock held."""
+        if not self.woken:
+            self.woken = True
+            self.lock.release()
+
+
+def _run(coro: Coroutine) -> Any:
+    # Coroutines of SyncPacketTransport return without suspending.
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    coro.close()
+    raise RuntimeError('A coroutine of SyncPacketTransport has suspended.')
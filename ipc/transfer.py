@@ -0,0 +1,291 @@
+from __future__ import annotations
+import errno
+import os
+import time
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import trio
+
+from ipc.connection import Connection
+from ipc.types import Fd, IPCError
+
+METHODS = ('copy_file_range', 'sendfile', 'splice', 'copy')
+"""Methods of copying data between file descriptors in the order they are tried."""
+CHUNK_SIZE = 16 * 1024 * 1024
+"""The maximal size of data copied by a worker thread at once, see copy_fd."""
+COPY_SIZE = 1024 * 1024
+"""The size of the buffer of the `copy` method."""
+PIPE_SIZE = 1024 * 1024
+"""The requested size of the pipe of the `splice` method."""
+TRANSFER = 'transfer'
+"""The method name of transfer requests, see request_transfer."""
+
+# Errors meaning that a method is not supported for given file descriptors, so the next one is tried.
+_UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF, errno.ESPIPE}
+
+try:
+    from fcntl import fcntl, F_SETPIPE_SZ
+except ImportError:
+    # Added in Python 3.10 and Linux-only.
+    F_SETPIPE_SZ = None
+
+
+class TransferError(IPCError):
+    """An error reported by the remote endpoint of a transfer."""
+
+
+class TransferResult(NamedTuple):
+    """The result of a transfer of data between file descriptors."""
+
+    size: int
+    """The number of bytes copied. It is smaller than the requested length at the end of file."""
+    method: str
+    """The method which copied data, see METHODS."""
+    elapsed: float
+    """The duration of the transfer in seconds."""
+
+    @property
+    def rate(self) -> float:
+        """The transfer rate in bytes per second."""
+        return self.size / self.elapsed if self.elapsed > 0 else 0.0
+
+
+async def copy_fd(src: Union[Fd, int], dst: Union[Fd, int], length: int, *,
+                  src_offset: Optional[int] = None, dst_offset: Optional[int] = None,
+                  methods: Sequence[str] = METHODS, chunk_size: int = CHUNK_SIZE) -> TransferResult:
+    """
+    Copy data between file descriptors in the kernel.
+
+    Methods are tried in the given order and the next one is used if a method does not support
+    the file descriptors, e.g. `copy_file_range` between file systems or `sendfile` to a given
+    offset. Only the last resort, `copy`, copies data through a buffer in Python memory.
+
+    Data are copied by worker threads in chunks of `chunk_size` bytes, so that trio is not blocked
+    and the transfer can be cancelled between chunks.
+
+    Args:
+        src: The file descriptor to read from.
+        dst: The file descriptor to write to.
+        length: The number of bytes to copy.
+        src_offset: The offset to read from or None to read from the current position and advance it.
+        dst_offset: The offset to write to or None to write at the current position and advance it.
+        methods: Methods to try, see METHODS.
+        chunk_size: The maximal size of data copied by a worker thread at once.
+
+    Returns:
+        The result of the transfer.
+
+    Raises:
+        OSError: If data cannot be copied.
+        ValueError: If a method is not known.
+    """
+    unknown = set(methods) - set(METHODS)
+    if unknown or not methods:
+        raise ValueError(f'Unknown methods: {methods!r}.')
+    if dst_offset is not None:
+        # sendfile writes only at the current position.
+        methods = [method for method in methods if method != 'sendfile'] or ['copy']
+
+    copier = _Copier(src.get() if isinstance(src, Fd) else src, dst.get() if isinstance(dst, Fd) else dst,
+                     src_offset, dst_offset)
+    candidates = list(methods)
+    start = time.perf_counter()
+    try:
+        while copier.copied < length:
+            count = min(chunk_size, length - copier.copied)
+            copied = copier.copied
+            try:
+                await trio.to_thread.run_sync(copier.copy, candidates[0], count)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED or len(candidates) == 1:
+                    raise
+                candidates.pop(0)
+                continue
+            if copier.copied == copied:
+                break  # The end of file.
+    finally:
+        copier.close()
+    return TransferResult(copier.copied, candidates[0], time.perf_counter() - start)
+
+
+async def request_transfer(conn: Connection, src: Fd, dst: Fd, length: int, *,
+                           src_offset: Optional[int] = None, dst_offset: Optional[int] = None) -> TransferResult:
+    """
+    Ask the remote endpoint to copy data between file descriptors.
+
+    The remote endpoint handles the request with `handle_transfer`, so data do not pass through
+    the memory of either process. The connection must have a codec encoding lists and file
+    descriptors, e.g. NativeCodec.
+
+    Args:
+        conn: The connection to send the request with.
+        src: The file descriptor to read from.
+        dst: The file descriptor to write to.
+        length: The number of bytes to copy.
+        src_offset: See copy_fd.
+        dst_offset: See copy_fd.
+
+    Returns:
+        The result of the transfer.
+
+    Raises:
+        TransferError: If the remote endpoint fails to copy data.
+    """
+    response, _fds = await conn.send([TRANSFER, src, dst, length, src_offset, dst_offset])
+    ok, *result = response
+    if not ok:
+        raise TransferError(result[0])
+    size, method, elapsed = result
+    return TransferResult(size, method, elapsed)
+
+
+async def handle_transfer(msg: List[Any]) -> Tuple[Any, ...]:
+    """
+    Handle a request sent by `request_transfer`.
+
+    The received file descriptors are closed when data are copied.
+
+    Args:
+        msg: The decoded request.
+
+    Returns:
+        A response for `request_transfer`: (True, size, method, elapsed) or (False, error).
+    """
+    try:
+        _method, src, dst, length, src_offset, dst_offset = msg
+        if not isinstance(src, Fd) or not isinstance(dst, Fd):
+            raise ValueError(f'File descriptors expected: {src!r}, {dst!r}.')
+        try:
+            result = await copy_fd(src, dst, length, src_offset=src_offset, dst_offset=dst_offset)
+        finally:
+            src.close()
+            dst.close()
+    except (OSError, ValueError, TypeError) as e:
+        return False, str(e)
+    return (True, *result)
+
+
+class _Copier:
+    """The state of copy_fd shared with worker threads."""
+
+    src: int
+    dst: int
+    src_offset: Optional[int]
+    dst_offset: Optional[int]
+    copied: int = 0
+    _pipe: Optional[Tuple[int, int]] = None
+    _splice_error: Optional[OSError] = None
+    _buffer: Optional[bytearray] = None
+
+    def __init__(self, src: int, dst: int, src_offset: Optional[int], dst_offset: Optional[int]):
+        self.src = src
+        self.dst = dst
+        self.src_offset = src_offset
+        self.dst_offset = dst_offset
+
+    def copy(self, method: str, count: int) -> None:
+        """Copy up to count bytes with the given method and advance offsets."""
+        copy = getattr(self, '_' + method)
+        start = self.copied
+        end = start + count
+        while self.copied < end:
+            try:
+                size = copy(end - self.copied)
+            except OSError:
+                if self.copied == start:
+                    raise
+                # Data copied so far are kept, the error is raised by the next call.
+                return
+            if size == 0:
+                return
+            self.copied += size
+            if self.src_offset is not None:
+                self.src_offset += size
+            if self.dst_offset is not None:
+                self.dst_offset += size
+
+    def close(self) -> None:
+        """Close the pipe of splice."""
+        if self._pipe is not None:
+            for fd in self._pipe:
+                os.close(fd)
+            self._pipe = None
+
+    def _copy_file_range(self, count: int) -> int:
+        return os.copy_file_range(self.src, self.dst, count, self.src_offset, self.dst_offset)
+
+    def _sendfile(self, count: int) -> int:
+        return os.sendfile(self.dst, self.src, self.src_offset, count)
+
+    def _splice(self, count: int) -> int:
+        # Data are moved from the source to a pipe and from the pipe to the destination in the kernel.
+        if self._splice_error is not None:
+            # The destination has failed, see below, so copy_fd falls back to another method.
+            raise self._splice_error
+        if self._pipe is None:
+            self._pipe = os.pipe()
+            if F_SETPIPE_SZ is not None:
+                try:
+                    fcntl(self._pipe[1], F_SETPIPE_SZ, PIPE_SIZE)
+                except OSError:
+                    pass  # Limited by /proc/sys/fs/pipe-max-size.
+        read_end, write_end = self._pipe
+        size = os.splice(self.src, write_end, count, offset_src=self.src_offset)
+        # All data in the pipe are written, even if the destination accepts fewer bytes at once.
+        offset = self.dst_offset
+        remaining = size
+        try:
+            while remaining:
+                written = os.splice(read_end, self.dst, remaining, offset_dst=offset)
+                remaining -= written
+                if offset is not None:
+                    offset += written
+        except OSError as e:
+            # Data in the pipe have been read from the source already, so they are written through
+            # a buffer and the error is raised by the next call.
+            self._splice_error = e
+            try:
+                while remaining:
+                    view = memoryview(os.read(read_end, remaining))
+                    while view:
+                        written = os.write(self.dst, view) if offset is None else os.pwrite(self.dst, view, offset)
+                        view = view[written:]
+                        remaining -= written
+                        if offset is not None:
+                            offset += written
+            except OSError as e:
+                # Data left in the pipe are lost with it, so the source is rewound to read them again.
+                self._splice_error = e
+                self.close()
+                self._rewind(remaining)
+                size -= remaining
+                if not size:
+                    raise
+            self.close()
+        return size
+
+    def _rewind(self, size: int) -> None:
+        # Only the current position is rewound, an explicit offset is advanced by copied data only.
+        if self.src_offset is None and size:
+            try:
+                os.lseek(self.src, -size, os.SEEK_CUR)
+            except OSError as e:
+                self._splice_error = OSError(errno.EIO, f'{size} bytes read from the source were lost: {e}')
+                raise self._splice_error from e
+
+    def _copy(self, count: int) -> int:
+        if self._buffer is None:
+            self._buffer = bytearray(COPY_SIZE)
+        view = memoryview(self._buffer)[:min(count, COPY_SIZE)]
+        if self.src_offset is None:
+            size = os.readv(self.src, [view])
+        else:
+            size = os.preadv(self.src, [view], self.src_offset)
+        offset = self.dst_offset
+        written = 0
+        while written < size:
+            if offset is None:
+                written += os.write(self.dst, view[written:size])
+            else:
+                written += os.pwrite(self.dst, view[written:size], offset + written)
+        return size
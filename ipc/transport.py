@@ -1,10 +1,13 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
 import array
-from socket import AF_UNIX, SOCK_SEQPACKET, CMSG_SPACE, SOL_SOCKET, SCM_RIGHTS, MSG_EOR
-from typing import NamedTuple, List
+from collections import deque
+from socket import AF_UNIX, AF_INET, AF_INET6, SOCK_STREAM, IPPROTO_TCP, TCP_NODELAY
+from socket import CMSG_SPACE, SOL_SOCKET, SCM_RIGHTS, MSG_CTRUNC
+from typing import Any, Deque, List, Optional, Tuple
 
 import trio
+from trio.lowlevel import ParkingLot, cancel_shielded_checkpoint, checkpoint_if_cancelled, wait_readable, wait_writable
 from trio.socket import socket as create_socket
 
 
@@ -14,47 +17,17 @@ except ImportError:
     # This class is just a dummy without any methods.
     from trio.socket import SocketType
 
-from ipc.types import Bytes, Fd, IPCError, INT_SIZE, INT32_SIZE
-from ipc.convert import int32_to_bytes, int_from_bytes
+from ipc.framing import PacketFraming, Message, HEADER, HEADER_SIZE, MAX_FDS, MAX_MESSAGE_SIZE, MAX_PENDING_SIZE, BATCH_BUDGET
+from ipc.framing import TransportError, NoDataError, WrongSocketError, ReadError, WriteError, WrongDataError
+from ipc.pool import BufferPool, PooledBuffer
+from ipc.types import Buffer, Bytes, Fd, INT_SIZE
 
-HEADER_SIZE = 4 * INT32_SIZE
+READ_SIZE = 256 * 1024
+"""The default size of chunks read by StreamTransport."""
 
-
-class Message(NamedTuple):
-    """Message sent/received over a transport."""
-
-    num: int
-    """Message number."""
-    flags: int
-    """Arbitrary flags depending on the protocol."""
-    data: Bytes
-    """Message data."""
-    fds: List[Fd]
-    """File descriptors passed along with the msg."""
-
-
-class TransportError(IPCError):
-    pass
-
-
-class NoDataError(TransportError):
-    pass
-
-
-class WrongSocketError(TransportError):
-    pass
-
-
-class ReadError(TransportError):
-    pass
-
-
-class WriteError(TransportError):
-    pass
-
-
-class WrongDataError(TransportError):
-    pass
+_ANCILLARY_SIZE = CMSG_SPACE(INT_SIZE * MAX_FDS)
+# Integers rather than enum members, which are slow to test for every record.
+_MSG_CTRUNC = int(MSG_CTRUNC)
 
 
 class Transport(ABC):
@@ -66,6 +39,18 @@ class Transport(ABC):
     """
     SOCKET_TYPE = None, None
     socket: SocketType
+    pool: Optional[BufferPool] = None
+    """
+    A pool to borrow buffers of read messages from or None to allocate a new buffer for each message.
+
+    Read messages must then be released with `Message.release`.
+    """
+    fragment_size: Optional[int] = None
+    """
+    The size of fragments of larger messages or None if messages are not written in fragments.
+
+    Concurrent writes of other messages may be interleaved between the fragments of a message.
+    """
 
     def __init__(self, socket: SocketType):
         self.socket = socket
@@ -83,6 +68,13 @@ class Transport(ABC):
         """
         return create_socket(*cls.SOCKET_TYPE)
 
+    def _allocate(self, size: int) -> Tuple[Buffer, Optional[PooledBuffer]]:
+        # Return a buffer for data of a read message, borrowed from the pool if it is set.
+        if self.pool is None:
+            return bytearray(size), None
+        pooled = self.pool.acquire(size)
+        return pooled.view, pooled
+
     @abstractmethod
     async def read(self) -> Message:
         """
@@ -101,6 +93,8 @@ class Transport(ABC):
         """
         Write a message to a socket.
 
+        Implementations must accept message data as a list of segments too.
+
         Args:
             msg: The message to send.
 
@@ -109,18 +103,129 @@ class Transport(ABC):
         """
         raise NotImplementedError
 
+    def close(self) -> None:
+        """Release resources of the transport. The socket is not closed."""
+
 
-class PacketTransport(Transport):
+class PacketTransport(PacketFraming, Transport):
     """
     A transport backed by AF_UNIX SOCK_SEQPACKET socket.
 
+    See Transport and PacketFraming for information about parameters and the protocol.
+
+    Non-blocking I/O: Records are read and written with non-blocking system calls and the task waits
+    for the socket only if it is not ready. Messages available at once are thus read in a row, e.g.
+    by Connection, without a round trip through the scheduler for each of them. The task still
+    yields after `batch_budget` messages, so that other tasks are not starved.
+    """
+
+    _writers: ParkingLot
+
+    def __init__(self, socket: SocketType, *, max_message_size: int = MAX_MESSAGE_SIZE,
+                 max_pending_size: int = MAX_PENDING_SIZE, spill_size: Optional[int] = None,
+                 batch_budget: int = BATCH_BUDGET):
+        Transport.__init__(self, socket)
+        # The underlying non-blocking socket is called directly, see _recvmsg_into and _sendmsg.
+        PacketFraming.__init__(self, socket._sock if isinstance(socket, SocketType) else socket,
+                               max_message_size=max_message_size, max_pending_size=max_pending_size,
+                               spill_size=spill_size, batch_budget=batch_budget)
+        self._writers = ParkingLot()
+
+    async def read(self) -> Message:
+        """
+        Read a message from a SEQPACKET socket.
+
+        See Transport.read for information about returned values.
+
+        This method checks for cancellation, but it yields to other tasks only if it waits for the socket
+        or after `batch_budget` messages read without waiting.
+
+        Raises:
+            NoDataError: If a read of zero bytes occurs. It may signalize a closed connection.
+            ReadError: If an incomplete read of header/body occurs.
+            WrongDataError: If socket msg contains unsupported ancillary data, the number
+                of file descriptors is wrong or fragments are malformed or too large.
+        """
+        await checkpoint_if_cancelled()
+        self._reads += 1
+        if self._reads >= self.batch_budget:
+            self._reads = 0
+            await cancel_shielded_checkpoint()
+        return await self._read_message()
+
+    async def write(self, msg: Message) -> None:
+        """
+        Write a message to a SEQPACKET socket.
+
+        See Transport.write for information about parameters.
+
+        The method may be called by concurrent tasks. Their messages may then be written between
+        fragments of a large message.
+
+        This method checks for cancellation, but it yields to other tasks only if it waits for the socket
+        or after `batch_budget` messages written without waiting.
+
+        Raises:
+            WriteError: When a socket write fails.
+        """
+        await checkpoint_if_cancelled()
+        self._writes += 1
+        if self._writes >= self.batch_budget:
+            self._writes = 0
+            await cancel_shielded_checkpoint()
+        await self._write_message(msg)
+
+    async def _recvmsg_into(self, buffers: List[Buffer], ancillary_size: int) -> Tuple[int, list, int, Any]:
+        # Unlike trio sockets, which always yield, the task waits only if no record is available.
+        while True:
+            try:
+                return self._sock.recvmsg_into(buffers, ancillary_size)
+            except BlockingIOError:
+                self._reads = 0
+                await wait_readable(self._sock)
+
+    async def _sendmsg(self, buffers: List[Bytes], ancillary: list, flags: int) -> int:
+        # Unlike trio sockets, which always yield, the task waits only if the send buffer is full.
+        while True:
+            try:
+                return self._sock.sendmsg(buffers, ancillary, flags)
+            except BlockingIOError:
+                self._writes = 0
+                await wait_writable(self._sock)
+
+    async def _acquire_writing(self) -> None:
+        # Records of a message are written by a single task at a time. Unlike trio.Lock, it does not
+        # yield if no other task writes, and it is handed over to waiting tasks in turn.
+        if self._writing:
+            await self._writers.park()
+        else:
+            self._writing = True
+
+    def _release_writing(self) -> None:
+        if self._writers:
+            self._writers.unpark()
+        else:
+            self._writing = False
+
+
+class StreamTransport(Transport):
+    """
+    A transport backed by a SOCK_STREAM socket, AF_UNIX by default. See also TcpTransport.
+
     See Transport for information about parameters.
 
+    Unlike PacketTransport, messages are not limited by the size of socket records. Data are read in large
+    chunks, so that a single `recvmsg_into` call often reads many messages, which are then returned
+    without any further system call.
+
+    Args:
+        read_size: The size of chunks to read, READ_SIZE by default.
+
     Raises:
         WrongSocketError: If the passed socket is of a wrong type.
 
     Protocol:
-        The first SEQPACKET record contains a msg header consisting of four 32bit integer values
+        Each message consists of a header and a body. The header consists of four 32bit integer values
         in machine byte order:
 
         1. Message number: May be used by a higher level protocol.
@@ -128,112 +233,145 @@ class PacketTransport(Transport):
         3. Body size: the size of msg body in bytes.
         4. FDs count: the count of file descriptors passed with msg body.
 
-        No ancillary data are sent in the first record.
-
-        The second record contains both packet data and ancillary data.
-
-        1. Packet data contain msg body of the size specified in the header.
-        2. If fds count is greater than zero, ancillary data contain that number of file
-          descriptors. Otherwise, no ancillary data is sent.
+        The header and the body are written with a single `sendmsg` call if possible. File descriptors
+        are sent as ancillary data of that call, so that they are received no later than the header.
+        They are supported only by AF_UNIX sockets.
 
         The format of msg body is not defined by the transport protocol but by a higher level
         protocols. The meaning of message number and flags is also opaque for the transport protocol.
-
-        Note that each SEQPACKET record must be read with with a single `recv`/`recvmsg` call.
-        Otherwise, it is not considered as read and the same data are returned in the next call.
     """
 
-    # The benefit of SOCK_SEQPACKET is that we can separate individual records with MSG_EOR, e.g.
-    # to send msg header first and then msg body with file descriptors.
-    SOCKET_TYPE = AF_UNIX, SOCK_SEQPACKET
+    SOCKET_TYPE = AF_UNIX, SOCK_STREAM
+    read_size: int
+    """The size of chunks to read."""
+    _buffer: bytearray
+    _start: int = 0
+    _end: int = 0
+    _fds: Deque[Fd]
 
-    def __init__(self, socket: SocketType):
+    def __init__(self, socket: SocketType, *, read_size: int = READ_SIZE):
         super().__init__(socket)
         type_ = socket.family, socket.type
-        if type_ != self.SOCKET_TYPE:
+        if socket.type != SOCK_STREAM or socket.family not in (AF_UNIX, AF_INET, AF_INET6):
             raise WrongSocketError(f'Unsupported socket: {self.SOCKET_TYPE} expected, {type_} passed.')
+        if socket.family != AF_UNIX:
+            # Small messages must not wait for more data.
+            socket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        self.read_size = read_size
+        self._buffer = bytearray(read_size)
+        self._fds = deque()
 
     async def read(self) -> Message:
         """
-        Read a message from a SEQPACKET socket.
+        Read a message from a SOCK_STREAM socket.
 
         See Transport.read for information about returned values.
 
         This method is an unconditional trio checkpoint.
 
         Raises:
-            NoDataError: If a read of zero bytes occurs. It may signalize a closed connection.
-            ReadError: If an incomplete read of header/body occurs.
+            NoDataError: If EOF occurs before a message. It may signalize a closed connection.
+            ReadError: If EOF occurs in the middle of a message.
             WrongDataError: If socket msg contains unsupported ancillary data or the number
                 of file descriptors is wrong.
         """
         await trio.sleep(0)
 
-        # The first record is a msg header without any ancillary data. Each SEQPACKET record
-        # must be read with with a single recv/recvmsg call with sufficient buffer size.
-        header = await self.socket.recv(HEADER_SIZE)
-        if len(header) == 0:
-            raise NoDataError('Cannot read header.')  # Probably EOF
-        if len(header) != HEADER_SIZE:
-            raise ReadError(f'Incomplete header read: {header}.')
-
-        num = int_from_bytes(header[0:INT32_SIZE])
-        flags = int_from_bytes(header[INT32_SIZE:2 * INT32_SIZE])
-        data_size = int_from_bytes(header[2 * INT32_SIZE:3 * INT32_SIZE])
-        data = bytearray(data_size)
-        n_fds = int_from_bytes(header[3 * INT32_SIZE:4 * INT32_SIZE])
-        ancillary_size = CMSG_SPACE(INT_SIZE * n_fds) if n_fds else 0
-
-        # The second record contains a msg body and file descriptors. Each SEQPACKET record
-        # must be read with with a single recv/recvmsg call with sufficient buffer size.
-        received, ancillary, _flags, _address = await self.socket.recvmsg_into([data], ancillary_size)
-        if received != data_size:
-            raise ReadError(f'Incomplete body received: {received}/{data_size} bytes.')
-
-        fds: List[Fd] = []
-        for level, type_, extra_data in ancillary:
-            if level != SOL_SOCKET or type_ != SCM_RIGHTS:
-                raise WrongDataError(
-                    f'Unsupported ancillary data: level={level}, type={type_}, data={extra_data}')
-
-            # File descriptors are received as native integer array.
-            fds += [Fd(i) for i in array.array('i', extra_data)]
-
-        if len(fds) != n_fds:
-            raise WrongDataError(f'Wrong number of fds: {n_fds} expected, {len(fds)} received.')
-
-        return Message(num, flags, data, fds)
+        while self._end - self._start < HEADER_SIZE:
+            if self._start == self._end:
+                self._start = self._end = 0
+            elif len(self._buffer) - self._start < HEADER_SIZE:
+                # Move an incomplete header to the start of the buffer.
+                self._buffer[:self._end - self._start] = self._buffer[self._start:self._end]
+                self._end -= self._start
+                self._start = 0
+            received = await self._recv_into(memoryview(self._buffer)[self._end:])
+            if not received:
+                if self._start == self._end:
+                    raise NoDataError('Cannot read header.')  # Probably EOF
+                raise ReadError(f'Incomplete header read: {bytes(self._buffer[self._start:self._end])}.')
+            self._end += received
+
+        num, flags, data_size, n_fds = HEADER.unpack_from(self._buffer, self._start)
+        self._start += HEADER_SIZE
+
+        # Buffered data are copied, the rest of a large body is read into its buffer directly.
+        data, pooled = self._allocate(data_size)
+        buffered = min(data_size, self._end - self._start)
+        data[:buffered] = self._buffer[self._start:self._start + buffered]
+        self._start += buffered
+        view = memoryview(data)
+        while buffered < data_size:
+            received = await self._recv_into(view[buffered:])
+            if not received:
+                if pooled is not None:
+                    pooled.release()
+                raise ReadError(f'Incomplete body received: {buffered}/{data_size} bytes.')
+            buffered += received
+
+        if len(self._fds) < n_fds:
+            raise WrongDataError(f'Wrong number of fds: {n_fds} expected, {len(self._fds)} received.')
+        fds = [self._fds.popleft() for _i in range(n_fds)]
+        return Message(num, flags, data, fds, pooled)
 
     async def write(self, msg: Message) -> None:
         """
-        Write a message to a SEQPACKET socket.
+        Write a message to a SOCK_STREAM socket.
 
         See Transport.write for information about parameters.
 
         This method is an unconditional trio checkpoint.
 
         Raises:
-            WriteError: When a socket write fails.
+            WriteError: When a socket write fails or file descriptors cannot be sent.
         """
         await trio.sleep(0)
 
         if msg.fds:
+            if self.socket.family != AF_UNIX:
+                raise WriteError(f'File descriptors cannot be sent over socket family {self.socket.family}.')
             # File descriptors are sent as native integer array.
             ancillary = [(SOL_SOCKET, SCM_RIGHTS, array.array('i', [fd.get() for fd in msg.fds]))]
-            n_fds = len(msg.fds)
         else:
             ancillary = []
-            n_fds = 0
 
-        body_size = len(msg.data)
-        header = int32_to_bytes(msg.num) + int32_to_bytes(msg.flags) + int32_to_bytes(body_size) + int32_to_bytes(n_fds)
+        segments = msg.data if isinstance(msg.data, list) else [msg.data]
+        views = [memoryview(segment).cast('B') for segment in segments]
+        body_size = sum(view.nbytes for view in views)
+        views.insert(0, memoryview(HEADER.pack(msg.num, msg.flags, body_size, len(msg.fds))))
+
+        # A stream socket may accept only a part of data. File descriptors are sent with the first part.
+        while views:
+            sent = await self.socket.sendmsg(views, ancillary)
+            if not sent:
+                raise WriteError('Nothing written.')
+            ancillary = []
+            while views and sent >= views[0].nbytes:
+                sent -= views.pop(0).nbytes
+            if sent:
+                views[0] = views[0][sent:]
+
+    async def _recv_into(self, view: memoryview) -> int:
+        # Read data and queue received file descriptors, which are received along with their message.
+        ancillary_size = _ANCILLARY_SIZE if self.socket.family == AF_UNIX else 0
+        received, ancillary, msg_flags, _address = await self.socket.recvmsg_into([view], ancillary_size)
+        if msg_flags & _MSG_CTRUNC:
+            raise WrongDataError('Ancillary data were truncated.')
+        for level, type_, extra_data in ancillary:
+            if level != SOL_SOCKET or type_ != SCM_RIGHTS:
+                raise WrongDataError(
+                    f'Unsupported ancillary data: level={level}, type={type_}, data={extra_data}')
+
+            # File descriptors are received as native integer array.
+            self._fds.extend(Fd(i) for i in array.array('i', extra_data))
+        return received
+
 
-        # The first record is a msg header without any ancillary data. MSG_EOR ends the record.
-        sent = await self.socket.send(header, MSG_EOR)
-        if sent != HEADER_SIZE:
-            raise WriteError(f'Incomplete header written: {sent}/{HEADER_SIZE} bytes.')
+class TcpTransport(StreamTransport):
+    """
+    A StreamTransport backed by AF_INET SOCK_STREAM socket, e.g. for loopback TCP connections.
+
+    File descriptors cannot be sent. See StreamTransport for details.
+    """
 
-        # The second record contains a msg body and file descriptors. MSG_EOR ends the record.
-        sent = await self.socket.sendmsg([msg.data], ancillary, MSG_EOR)
-        if sent != body_size:
-            raise WriteError(f'Incomplete body written: {sent}/{body_size} bytes.')
+    SOCKET_TYPE = AF_INET, SOCK_STREAM
@@ -13,6 +13,8 @@ INT32_MAX = 2147483647
 """The value of the largest 32bit signed integer."""
 DOUBLE_SIZE = 8
 """The size of a double precision floating point number in bytes."""
+VARINT_MAX_SIZE = 10
+"""The maximal size of a variable-length integer in bytes, enough for 65 bits of zigzag varints."""
 
 Buffer = Union[bytearray, memoryview]
 """Types accepted as read-write byte buffers."""
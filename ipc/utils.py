@@ -1,3 +1,4 @@
+import time
 from typing import Iterator, TypeVar, Generic, Optional
 
 import trio
@@ -57,9 +58,12 @@ class Result(Generic[T]):
     """The result of an asynchronous task."""
     error: Optional[Exception] = None
     """The failure of an asynchronous task."""
+    created: float
+    """The time of creation according to `time.perf_counter`, e.g. to measure waiting for the result."""
 
     def __init__(self):
         self._event = trio.Event()
+        self.created = time.perf_counter()
 
     def set(self, value: Optional[T] = None) -> None:
         """Set the result of an asynchronous task and mark it as finished."""
@@ -0,0 +1,59 @@
+import itertools
+import os
+import threading
+
+import pytest
+import trio
+
+from ipc.codecs import NativeCodec
+from ipc.server import Server
+from ipc.transport import PacketTransport
+
+_counter = itertools.count()
+
+
+@pytest.fixture
+def trio_server():
+    """
+    Run a trio Server with NativeCodec in another thread and yield its address.
+
+    Requests are echoed with their file descriptors, except 'notifications', which returns notifications
+    received so far, and 'push', which is preceded by a notification 'pushed' to the client.
+    """
+    address = f'\0ipc-test-trio-server-{os.getpid()}-{next(_counter)}'.encode()
+    notifications = []
+    errors = []
+
+    async def on_request(conn, msg, fds):
+        if msg == 'notifications':
+            return notifications, []
+        if msg == 'push':
+            await conn.notify('pushed')
+        return msg, fds
+
+    async def on_notification(_conn, msg, _fds):
+        notifications.append(msg)
+
+    async def on_error(_conn, error):
+        errors.append(error)
+
+    server = Server(PacketTransport, on_request, on_notification, on_error, codec=NativeCodec())
+    started = threading.Event()
+    tokens = []
+
+    async def main():
+        tokens.append(trio.lowlevel.current_trio_token())
+        async with trio.open_nursery() as nursery:
+            await nursery.start(server.serve, address)
+            started.set()
+
+    thread = threading.Thread(target=trio.run, args=(main,))
+    thread.start()
+    assert started.wait(5)
+    try:
+        yield address
+    finally:
+        trio.from_thread.run_sync(server.close, trio_token=tokens[0])
+        thread.join(5)
+    assert not thread.is_alive()
+    assert not errors
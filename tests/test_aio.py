@@ -0,0 +1,80 @@
+import asyncio
+import os
+
+from ipc.aio import AioConnection, AioServer, AioPacketTransport
+from ipc.codecs import NativeCodec
+from ipc.types import Fd
+
+
+async def _ignore(_conn, _data, _fds):
+    pass
+
+
+def test_server_client_address():
+    server_address = f'\0ipc-test-aio-server-{os.getpid()}'.encode()
+    client_address = f'\0ipc-test-aio-client-{os.getpid()}'.encode()
+
+    async def on_request(conn, _data, _fds):
+        return conn.address, []
+
+    async def on_error(_conn, error):
+        raise error
+
+    async def main():
+        server = AioServer(AioPacketTransport, on_request, _ignore, on_error)
+        started = asyncio.Event()
+        serving = asyncio.ensure_future(server.serve(server_address, started=started))
+        await started.wait()
+
+        client = AioConnection(1, AioPacketTransport, _ignore, _ignore)
+        socket = AioPacketTransport.create_socket()
+        socket.bind(client_address)
+        await asyncio.get_running_loop().sock_connect(socket, server_address)
+        started = asyncio.Event()
+        running = asyncio.ensure_future(client.attach(socket, server_address, started=started))
+        await started.wait()
+        assert await client.send(b'address') == (client_address, [])
+        client.close()
+        await running
+        server.close()
+        await serving
+
+    asyncio.run(main())
+
+
+def test_trio_server(trio_server):
+    pushed = []
+
+    async def on_notification(_conn, msg, _fds):
+        pushed.append(msg)
+
+    async def main():
+        client = AioConnection(1, AioPacketTransport, _ignore, on_notification, codec=NativeCodec())
+        started = asyncio.Event()
+        running = asyncio.ensure_future(client.connect(trio_server, started=started))
+        await started.wait()
+
+        assert await client.send(['hello', 1]) == (['hello', 1], [])
+        fd = Fd(os.open(os.devnull, os.O_RDONLY))
+        try:
+            _msg, fds = await client.send('fd', [fd])
+            assert len(fds) == 1
+            assert os.path.samestat(os.fstat(fds[0].get()), os.fstat(fd.get()))
+            fds[0].close()
+        finally:
+            fd.close()
+        # Large messages are sent in fragments.
+        large = os.urandom(1024 * 1024)
+        assert await client.send(large) == (large, [])
+        # Concurrent notifications are sent in batch frames.
+        await asyncio.gather(*(client.notify(i) for i in range(100)))
+        while len((await client.send('notifications'))[0]) < 100:
+            await asyncio.sleep(0.01)
+        assert sorted((await client.send('notifications'))[0]) == list(range(100))
+        assert client.stats.frames_out < client.stats.messages_out
+        assert await client.send('push') == ('push', [])
+        assert pushed == ['pushed']
+        client.close()
+        await running
+
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+import json
+import os
+
+import pytest
+
+from ipc.cache import EncodingCache
+from ipc.codecs import serialize, deserialize
+from ipc.types import Fd
+
+PAYLOAD = {'rows': [[i, f'row {i}', i / 2] for i in range(50)]}
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_cache_hit(version):
+    cache = EncodingCache()
+    expected = bytes(serialize(['msg', PAYLOAD], version)[0])
+    # The container is cached when it is encoded the second time and reused afterwards.
+    for _i in range(3):
+        data, fds = serialize(['msg', PAYLOAD], version, cache=cache)
+        assert bytes(data) == expected
+        assert deserialize(data, fds) == ['msg', PAYLOAD]
+    assert cache.hits == 1
+    assert len(cache) == 1
+
+
+def test_cache_hit_array():
+    cache = EncodingCache()
+    rows = list(range(100))
+    for _i in range(3):
+        serialize({'a': rows}, cache=cache)
+    assert cache.hits == 1
+    assert deserialize(*serialize({'b': rows}, cache=cache)) == {'b': rows}
+    assert cache.hits == 2
+
+
+def test_cache_key():
+    # Equal containers are identified by their value.
+    cache = EncodingCache(key=lambda value: json.dumps(value, sort_keys=True))
+    for _i in range(3):
+        data, fds = serialize(json.loads(json.dumps(PAYLOAD)), cache=cache)
+    assert cache.hits == 1
+    assert deserialize(data, fds) == PAYLOAD
+
+
+def test_cache_fds():
+    cache = EncodingCache()
+    fd = Fd(os.open(os.devnull, os.O_RDONLY))
+    try:
+        value = [fd, 'fd']
+        for _i in range(3):
+            _data, fds = serialize(value, cache=cache)
+            assert fds == [fd]
+        assert cache.hits == 0
+        assert len(cache) == 0
+    finally:
+        fd.close()
+
+
+def test_cache_eviction():
+    cache = EncodingCache(max_entries=2)
+    values = [[i] * 10 for i in range(3)]
+    for value in values:
+        serialize(['msg', value], cache=cache)
+        serialize(['msg', value], cache=cache)
+    assert len(cache) == 2
+    # The least recently used entry has been evicted.
+    serialize(['msg', values[0]], cache=cache)
+    assert cache.hits == 0
+    serialize(['msg', values[2]], cache=cache)
+    assert cache.hits == 1
+    cache = EncodingCache(max_bytes=16)
+    for _i in range(3):
+        serialize(PAYLOAD, cache=cache)
+    assert len(cache) == 0
+    assert cache.size == 0
@@ -0,0 +1,152 @@
+import array
+import os
+
+import pytest
+
+from ipc.codecs import serialize, deserialize, DecoderError, EncoderError, StringTable
+from ipc.memfd import SealedBuffer
+from ipc.types import Fd
+
+VALUES = [
+    None,
+    True,
+    False,
+    0,
+    31,
+    32,
+    0x3FFF,
+    0x4000,
+    2 ** 64 - 1,
+    1.5,
+    '',
+    'hello',
+    'ž' * 100,
+    b'',
+    b'\x00\xff',
+    b'x' * 100000,
+    [],
+    {},
+    [1, 'two', [3.0, None], {'four': [True, False]}],
+    {'key': {'nested': [b'bytes', 'string']}, 'empty': []},
+    list(range(1000)),
+]
+
+
+def _v2_values():
+    return VALUES + [-1, -0x2000, -0x2001, -(2 ** 63), [-5, 5, -70000, 70000]]
+
+
+@pytest.fixture
+def fd():
+    fd = Fd(os.open(os.devnull, os.O_RDONLY))
+    yield fd
+    fd.close()
+
+
+@pytest.mark.parametrize('value', VALUES)
+def test_round_trip_v1(value):
+    data, fds = serialize(value, 1)
+    assert deserialize(data, fds) == value
+
+
+@pytest.mark.parametrize('value', _v2_values())
+def test_round_trip_v2(value):
+    data, fds = serialize(value, 2)
+    assert data[0] == 0xC2
+    assert deserialize(data, fds) == value
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_round_trip_fds(version, fd):
+    data, fds = serialize([fd, {'fd': fd}], version)
+    assert fds == [fd, fd]
+    assert deserialize(data, fds) == [fd, {'fd': fd}]
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_round_trip_segments(version):
+    value = [b'x' * 100000, 'small', bytearray(b'y' * 70000)]
+    segments, fds = serialize(value, version, segment_size=64 * 1024)
+    assert isinstance(segments, list)
+    assert deserialize(b''.join(segments), fds) == value
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_round_trip_typed_arrays(version):
+    value = [array.array('d', [1.0, 2.5]), array.array('i', range(10)), array.array('B')]
+    data, fds = serialize(value, version)
+    decoded = deserialize(data, fds)
+    assert [item.format for item in decoded] == ['d', 'i', 'B']
+    assert [item.tolist() for item in decoded] == [[1.0, 2.5], list(range(10)), []]
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_round_trip_packed_sequences(version):
+    data, fds = serialize([list(range(100)), [0.5] * 100], version, pack_sequences=16)
+    assert [item.tolist() for item in deserialize(data, fds)] == [list(range(100)), [0.5] * 100]
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_round_trip_memfd_followed_by_data(version):
+    payload = os.urandom(1024)
+    # The memfd is followed by more data than it holds.
+    strings = [f'string number {i}' for i in range(100)]
+    data, fds = serialize([SealedBuffer.from_bytes(payload), strings], version)
+    assert len(data) > len(payload)
+    decoded = deserialize(data, fds)
+    assert decoded[0].tobytes() == payload
+    assert decoded[1] == strings
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_round_trip_memfd_size(version):
+    payload = os.urandom(100000)
+    data, fds = serialize([payload, 'tail'], version, memfd_size=64 * 1024)
+    assert len(fds) == 1
+    assert len(data) < len(payload)
+    decoded = deserialize(data, fds)
+    assert decoded[0].tobytes() == payload
+    assert decoded[1] == 'tail'
+
+
+def test_interned_strings():
+    sender, receiver = StringTable(), StringTable()
+    for _i in range(3):
+        value = {'method': 'write', 'args': ['method', 'write']}
+        data, fds = serialize(value, 2, strings=sender)
+        assert deserialize(data, fds, strings=receiver) == value
+
+
+def test_v1_negative_int():
+    with pytest.raises(EncoderError):
+        serialize(-1, 1)
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_int_out_of_range(version):
+    with pytest.raises(EncoderError):
+        serialize(2 ** 64, version)
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_truncated_data(version):
+    data, fds = serialize(['truncated', list(range(10))], version)
+    with pytest.raises(DecoderError):
+        deserialize(data[:-1], fds)
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_extra_data(version):
+    data, fds = serialize('value', version)
+    with pytest.raises(DecoderError):
+        deserialize(bytes(data) + b'\x00' * 4, fds)
+
+
+@pytest.mark.parametrize('data', [
+    bytes([0xC2, 0x03]) + b'\xff' * 9 + b'\x04',  # INT64 of 66 bits
+    bytes([0xC2, 0x03]) + b'\xff' * 10 + b'\x01',  # INT64 of 11 bytes
+    bytes([0xC2, 0x05]) + b'\xff' * 9 + b'\x02',  # the size of STRING of 65 bits
+])
+def test_varint_out_of_range(data):
+    with pytest.raises(DecoderError):
+        deserialize(data, [])
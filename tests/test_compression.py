@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+from ipc.codecs import DecoderError
+from ipc.compression import CompressingCodec
+from ipc.protocol import Flags
+
+COMPRESSIBLE = ['compressible'] * 1000
+
+
+class _Peer:
+    def __init__(self, peer_features=Flags.CODEC_COMPRESSION):
+        self.features = Flags.NONE
+        self.peer_features = peer_features
+
+
+def _codecs(sender_method='zlib', receiver_method='zlib', **kwargs):
+    sender = CompressingCodec(method=sender_method, **kwargs).bind(_Peer())
+    receiver = CompressingCodec(method=receiver_method, **kwargs).bind(_Peer())
+    return sender, receiver
+
+
+@pytest.mark.parametrize('method', ['zlib', 'lzma'])
+def test_round_trip(method):
+    sender, receiver = _codecs(method, method)
+    data, fds, flags = sender.encode_message(COMPRESSIBLE)
+    assert flags & Flags.COMPRESSED.value
+    assert len(data) < len(sender.encode(COMPRESSIBLE)[0]) / 10
+    assert receiver.decode_message(data, fds, flags) == COMPRESSIBLE
+    assert sender.compressed == 1
+
+
+def test_round_trip_dictionary():
+    zdict = b'compressible' * 10
+    sender, receiver = _codecs(zdict=zdict)
+    assert receiver.decode_message(*sender.encode_message(COMPRESSIBLE)) == COMPRESSIBLE
+
+
+@pytest.mark.parametrize('sender_method, receiver_method', [('zlib', 'lzma'), ('lzma', 'zlib')])
+def test_method_on_wire(sender_method, receiver_method):
+    # Bodies are decompressed with the method of the sender.
+    sender, receiver = _codecs(sender_method, receiver_method)
+    assert receiver.decode_message(*sender.encode_message(COMPRESSIBLE)) == COMPRESSIBLE
+
+
+def test_not_negotiated():
+    sender = CompressingCodec().bind(_Peer(Flags.NONE))
+    _data, _fds, flags = sender.encode_message(COMPRESSIBLE)
+    assert not flags & Flags.COMPRESSED.value
+
+
+def test_bind_advertises():
+    peer = _Peer()
+    CompressingCodec().bind(peer)
+    assert peer.features & Flags.CODEC_COMPRESSION
+
+
+def test_threshold():
+    sender, _receiver = _codecs(threshold=1024)
+    _data, _fds, flags = sender.encode_message('small')
+    assert not flags & Flags.COMPRESSED.value
+
+
+def test_adaptive_skip():
+    sender, receiver = _codecs()
+    incompressible = os.urandom(4096)
+    # A poor ratio skips one message, then twice as many after another poor result.
+    for _i in range(5):
+        data, fds, flags = sender.encode_message(incompressible)
+        assert not flags & Flags.COMPRESSED.value
+        assert receiver.decode_message(data, fds, flags) == incompressible
+    assert sender.skipped == 3
+    # Compressible messages are compressed again once the skipped messages are sent.
+    _data, _fds, flags = sender.encode_message(COMPRESSIBLE)
+    assert flags & Flags.COMPRESSED.value
+    assert sender.compressed == 1
+
+
+@pytest.mark.parametrize('body', [b'', b'\x09' + b'x' * 100, b'\x01not zlib'])
+def test_malformed(body):
+    _sender, receiver = _codecs()
+    with pytest.raises(DecoderError):
+        receiver.decode_message(body, [], Flags.COMPRESSED.value)
+
+
+def test_truncated():
+    sender, receiver = _codecs()
+    data, fds, flags = sender.encode_message(COMPRESSIBLE)
+    with pytest.raises(DecoderError):
+        receiver.decode_message(data[:-4], fds, flags)
+
+
+def test_max_size():
+    sender, receiver = _codecs(max_size=1024)
+    with pytest.raises(DecoderError):
+        receiver.decode_message(*sender.encode_message(COMPRESSIBLE))
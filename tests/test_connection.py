@@ -0,0 +1,111 @@
+import os
+from socket import AF_UNIX, SOCK_SEQPACKET
+
+import trio
+import trio.socket
+
+from ipc.connection import Connection
+from ipc.transport import PacketTransport
+
+
+async def _ignore(_conn, _data, _fds):
+    pass
+
+
+def test_cancelled_request():
+    async def main():
+        a, b = trio.socket.socketpair(AF_UNIX, SOCK_SEQPACKET)
+        responded = trio.Event()
+
+        async def on_request(_conn, data, _fds):
+            if data == b'slow':
+                await trio.sleep(0.1)
+                responded.set()
+            return bytes(data).upper(), []
+
+        client = Connection(1, PacketTransport, on_request, _ignore)
+        server = Connection(2, PacketTransport, on_request, _ignore)
+        async with trio.open_nursery() as nursery:
+            await nursery.start(client.attach, a, b'')
+            await nursery.start(server.attach, b, b'')
+            with trio.move_on_after(0.01) as scope:
+                await client.send(b'slow')
+            assert scope.cancelled_caught
+
+            # The response to the cancelled request arrives later and is dropped.
+            await responded.wait()
+            assert await client.send(b'fast') == (b'FAST', [])
+            client.close()
+            server.close()
+
+    trio.run(main)
+
+
+def test_request_stats():
+    async def main():
+        a, b = trio.socket.socketpair(AF_UNIX, SOCK_SEQPACKET)
+
+        async def on_request(_conn, data, _fds):
+            return bytes(data).upper(), []
+
+        def method_key(data):
+            return bytes(data[:1])
+
+        client = Connection(1, PacketTransport, on_request, _ignore, method_key=method_key)
+        server = Connection(2, PacketTransport, on_request, _ignore, method_key=method_key)
+        async with trio.open_nursery() as nursery:
+            await nursery.start(client.attach, a, b'')
+            await nursery.start(server.attach, b, b'')
+            assert await client.request_stats() is None
+
+            server.stats_provider = server.stats.snapshot
+            await client.send(b'read')
+            await client.notify(b'write')
+            stats = await client.request_stats()
+            # Requests of statistics are counted too.
+            assert stats['messages_in'] == 4
+            assert stats['methods']["b'r'"]['handled'] == 1
+            assert client.stats.methods["b'r'"].sent == 1
+            assert client.stats.methods["b'r'"].round_trip.count == 1
+
+            # A failing provider is answered with None and the connection stays open.
+            server.stats_provider = lambda: 1 / 0
+            assert await client.request_stats() is None
+            assert server.stats.errors['ZeroDivisionError'] == 1
+            assert await client.send(b'read') == (b'READ', [])
+            client.close()
+            server.close()
+
+    trio.run(main)
+
+
+def test_fragmented_request():
+    async def main():
+        a, b = trio.socket.socketpair(AF_UNIX, SOCK_SEQPACKET)
+        large = os.urandom(4 * 1024 * 1024)
+        pending = []
+
+        async def on_request(_conn, data, _fds):
+            # Incomplete fragmented messages read before this one.
+            pending.append((len(data), len(server._transport._pending)))
+            return bytes(data[:1]), []
+
+        client = Connection(1, PacketTransport, on_request, _ignore)
+        server = Connection(2, PacketTransport, on_request, _ignore)
+        async with trio.open_nursery() as nursery:
+            await nursery.start(client.attach, a, b'')
+            await nursery.start(server.attach, b, b'')
+            await client.send(b'hello')
+            pending.clear()
+            async with trio.open_nursery() as senders:
+                senders.start_soon(client.send, large)
+                while not server._transport._pending:
+                    await trio.sleep(0)
+                # Small requests are written between fragments of the large one.
+                for i in range(3):
+                    senders.start_soon(client.send, bytes([i]) * 10)
+            assert pending == [(10, 1)] * 3 + [(len(large), 0)]
+            client.close()
+            server.close()
+
+    trio.run(main)
@@ -0,0 +1,172 @@
+import array
+
+import pytest
+
+from ipc.codecs import serialize, deserialize, DecoderError
+from ipc.events import iter_events, iter_array, EventType
+from ipc.lazy import deserialize_lazy, materialize, LazyList, LazyDict
+
+MESSAGES = [
+    None,
+    123,
+    'string',
+    b'binary',
+    [],
+    {},
+    ['write', 123, True, None, 1.5],
+    {'key': {'nested': [b'bytes', 'string', [[], {}]]}, 'list': list(range(100))},
+    [{'id': i, 'name': f'item {i}', 'tags': ['a', 'b']} for i in range(50)],
+]
+
+
+def _build(events):
+    """Build a value from events, checking their depths."""
+    # Open containers with a pending key of dictionaries.
+    stack = []
+    key = None
+    for event in events:
+        if event.type in (EventType.ARRAY_END, EventType.DICT_END):
+            value, key = stack.pop()
+            assert event.depth == len(stack)
+        else:
+            assert event.depth == len(stack)
+            if event.type == EventType.KEY:
+                key = event.value
+                continue
+            if event.type in (EventType.ARRAY_START, EventType.DICT_START):
+                stack.append(([] if event.type == EventType.ARRAY_START else {}, key))
+                continue
+            value = event.value
+        if not stack:
+            return value
+        container = stack[-1][0]
+        if isinstance(container, dict):
+            container[key] = value
+        else:
+            container.append(value)
+    raise AssertionError('Incomplete events.')
+
+
+@pytest.mark.parametrize('version', [1, 2])
+@pytest.mark.parametrize('msg', MESSAGES)
+@pytest.mark.parametrize('validate', [True, False])
+def test_lazy_materialize(version, msg, validate):
+    data, fds = serialize(msg, version)
+    assert materialize(deserialize_lazy(data, fds, validate=validate)) == deserialize(data, fds)
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_lazy_access(version):
+    msg = MESSAGES[-2]
+    data, fds = serialize(msg, version)
+    lazy = deserialize_lazy(data, fds)
+    assert isinstance(lazy, LazyDict)
+    assert isinstance(lazy['list'], LazyList)
+    assert lazy['list'][99] == 99
+    assert lazy['list'][-1] == 99
+    assert len(lazy['list']) == 100
+    assert materialize(lazy['key']['nested'][2]) == [[], {}]
+    assert bytes(lazy['key']['nested'][0]) == b'bytes'
+    assert sorted(lazy) == ['key', 'list']
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_lazy_binary_is_view(version):
+    data, fds = serialize([b'x' * 1000], version)
+    value = deserialize_lazy(data, fds)[0]
+    assert isinstance(value, memoryview)
+    assert value.readonly
+    assert value == b'x' * 1000
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_lazy_extra_data(version):
+    data, fds = serialize(['value'], version)
+    with pytest.raises(DecoderError):
+        deserialize_lazy(bytes(data) + bytes(8), fds)
+
+
+@pytest.mark.parametrize('version', [1, 2])
+@pytest.mark.parametrize('msg', MESSAGES)
+def test_events(version, msg):
+    data, fds = serialize(msg, version)
+    assert _build(iter_events(data, fds)) == deserialize(data, fds)
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_events_typed_array(version):
+    data, fds = serialize({'samples': array.array('h', [1, -2, 3])}, version)
+    events = list(iter_events(data, fds))
+    assert [event.type for event in events] == [
+        EventType.DICT_START, EventType.KEY, EventType.VALUE, EventType.DICT_END]
+    assert events[2].value.tolist() == [1, -2, 3]
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_events_truncated(version):
+    data, fds = serialize(['a', 'b', 'c'], version)
+    events = iter_events(data[:-4 if version == 1 else -1], fds)
+    with pytest.raises(DecoderError):
+        list(events)
+
+
+@pytest.mark.parametrize('version', [1, 2])
+@pytest.mark.parametrize('path, expected', [
+    ((), None),
+    ((0, 'tags'), ['a', 'b']),
+    ((49, 'tags'), ['a', 'b']),
+])
+def test_iter_array(version, path, expected):
+    msg = MESSAGES[-1]
+    data, fds = serialize(msg, version)
+    if expected is None:
+        expected = deserialize(data, fds)
+    assert list(iter_array(data, fds, path)) == expected
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_iter_array_errors(version):
+    data, fds = serialize({'list': [[1], [2]]}, version)
+    with pytest.raises(KeyError):
+        list(iter_array(data, fds, ['missing']))
+    with pytest.raises(IndexError):
+        list(iter_array(data, fds, ['list', 2]))
+    with pytest.raises(DecoderError):
+        list(iter_array(data, fds, ['list', 0, 0]))
+
+
+@pytest.mark.parametrize('version', [1, 2])
+@pytest.mark.parametrize('index, error', [(-1, IndexError), (True, TypeError), (False, TypeError), ('0', TypeError)])
+def test_iter_array_invalid_index(version, index, error):
+    data, fds = serialize([[1], [2]], version)
+    with pytest.raises(error):
+        list(iter_array(data, fds, [index]))
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_iter_array_bool_key(version):
+    data, fds = serialize({True: [1, 2]}, version)
+    assert list(iter_array(data, fds, [True])) == [1, 2]
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_materialize_copies_typed_arrays(version):
+    data, fds = serialize([array.array('d', [0.5, 1.5]), [array.array('h', [-1, 2])]], version)
+    data = bytearray(data)
+    value = materialize(deserialize_lazy(data, fds))
+    top = materialize(deserialize_lazy(data, fds)[0])
+    # The buffer can be resized only if nothing references it.
+    data.extend(bytes(8))
+    assert (value[0].format, value[0].tolist()) == ('d', [0.5, 1.5])
+    assert (value[1][0].format, value[1][0].tolist()) == ('h', [-1, 2])
+    assert (top.format, top.tolist()) == ('d', [0.5, 1.5])
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_materialize_copies_numpy_arrays(version):
+    numpy = pytest.importorskip('numpy')
+    data, fds = serialize(numpy.arange(6, dtype='i').reshape(2, 3), version)
+    data = bytearray(data)
+    value = materialize(deserialize_lazy(data, fds))
+    data.extend(bytes(8))
+    assert (value.format, value.shape, value.tolist()) == ('i', (2, 3), [[0, 1, 2], [3, 4, 5]])
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from ipc.metrics import ConnectionStats, Histogram, OTHER_METHOD, encode_stats
+
+
+def test_histogram():
+    histogram = Histogram()
+    for duration in (0.001, 0.002, 0.004, 1.0):
+        histogram.add(duration)
+    assert histogram.count == 4
+    assert histogram.mean == pytest.approx(1.007 / 4)
+    assert histogram.max == 1.0
+    # Quantiles are upper bounds of buckets of powers of two of microseconds.
+    assert 0.002 <= histogram.quantile(0.5) <= 0.004
+    assert histogram.quantile(1.0) == 1.0
+
+
+def test_snapshot_merge():
+    stats = ConnectionStats()
+    stats.messages_out = 2
+    stats.round_trip.add(0.001)
+    stats.method('read').sent += 1
+    stats.error(ValueError())
+    other = ConnectionStats()
+    other.messages_out = 3
+    other.method('read').sent += 2
+    other.method('write').handled += 1
+    other.error(ValueError())
+    stats.merge(other)
+
+    snapshot = json.loads(json.dumps(stats.snapshot()))
+    assert snapshot['messages_out'] == 5
+    assert snapshot['errors'] == {'ValueError': 2}
+    assert snapshot['round_trip']['count'] == 1
+    assert snapshot['methods']['read']['sent'] == 3
+    assert snapshot['methods']['write']['handled'] == 1
+
+
+def test_method_keys():
+    stats = ConnectionStats(max_methods=2)
+    stats.method(1).sent += 1
+    stats.method(('a', 'b')).sent += 1
+    stats.method('c').sent += 1
+    stats.method('d').sent += 1
+    assert stats.method('1').sent == 1
+    assert set(stats.methods) == {'1', "('a', 'b')", OTHER_METHOD}
+    assert stats.methods[OTHER_METHOD].sent == 2
+    json.dumps(stats.snapshot())
+
+
+def test_encode_stats():
+    stats = ConnectionStats()
+    assert json.loads(encode_stats(None, stats)) is None
+    assert json.loads(encode_stats(lambda: {'a': 1}, stats)) == {'a': 1}
+    assert json.loads(encode_stats(lambda: 1 / 0, stats)) is None
+    assert json.loads(encode_stats(lambda: {'a': object()}, stats)) is None
+    assert stats.errors == {'ZeroDivisionError': 1, 'TypeError': 1}
@@ -0,0 +1,137 @@
+import array
+from socket import AF_UNIX, SOCK_SEQPACKET
+
+import pytest
+import trio
+import trio.socket
+
+from ipc.codecs import NativeCodec
+from ipc.connection import Connection
+from ipc.pool import BufferPool
+from ipc.transport import Message, PacketTransport
+
+
+def test_size_classes():
+    pool = BufferPool(min_size=256, max_size=4096)
+    for size, expected in [(0, 256), (1, 256), (256, 256), (257, 512), (4096, 4096)]:
+        with pool.acquire(size) as buffer:
+            assert len(buffer.view) == size
+            assert len(buffer.view.obj) == expected
+
+
+def test_reuse():
+    pool = BufferPool()
+    buffer = pool.acquire(1000)
+    data = buffer.view.obj
+    buffer.release()
+    assert buffer.released
+    buffer.release()
+    with pool.acquire(700) as buffer:
+        assert buffer.view.obj is data
+    # Another size class does not reuse the buffer.
+    with pool.acquire(100) as buffer:
+        assert buffer.view.obj is not data
+    assert (pool.hits, pool.misses, pool.allocations) == (1, 2, 2)
+
+
+def test_max_buffers():
+    pool = BufferPool(max_buffers=2)
+    buffers = [pool.acquire(100) for _i in range(3)]
+    for buffer in buffers:
+        buffer.release()
+    for _i in range(3):
+        pool.acquire(100)
+    assert (pool.hits, pool.misses) == (2, 4)
+
+
+def test_large_buffers():
+    pool = BufferPool(max_size=1024)
+    with pool.acquire(1025) as buffer:
+        assert len(buffer.view) == 1025
+    with pool.acquire(1025):
+        pass
+    assert (pool.hits, pool.misses) == (0, 2)
+
+
+def test_retained():
+    pool = BufferPool()
+    buffer = pool.acquire(100)
+    buffer.view[:] = bytes(range(100))
+    # A view of the data keeps the buffer out of the pool, so that its data are not overwritten.
+    kept = memoryview(buffer.view.obj)[10:20]
+    buffer.release()
+    assert pool.retained == 1
+    with pool.acquire(100) as other:
+        other.view[:] = bytes(100)
+    assert bytes(kept) == bytes(range(10, 20))
+    assert pool.hits == 0
+
+    # A reference to the view itself is detected as well.
+    buffer = pool.acquire(100)
+    exported = memoryview(buffer.view)
+    buffer.release()
+    assert pool.retained == 2
+    exported.release()
+
+
+def test_clear():
+    pool = BufferPool()
+    pool.acquire(100).release()
+    pool.clear()
+    pool.acquire(100)
+    assert (pool.hits, pool.misses, pool.allocations) == (0, 1, 1)
+
+
+def test_invalid_min_size():
+    with pytest.raises(ValueError):
+        BufferPool(min_size=100)
+
+
+def test_message_release():
+    pool = BufferPool()
+    buffer = pool.acquire(10)
+    with Message(1, 0, buffer.view, [], buffer) as msg:
+        assert not msg.buffer.released
+    assert buffer.released
+    pool.acquire(10)
+    assert pool.hits == 1
+    # Messages without a buffer are released as well.
+    with Message(1, 0, b'data', []):
+        pass
+
+
+@pytest.mark.parametrize('view', [False, True])
+def test_connection(view):
+    async def main():
+        a, b = trio.socket.socketpair(AF_UNIX, SOCK_SEQPACKET)
+        pool = BufferPool()
+        received = []
+
+        async def on_notification(_conn, msg, _fds):
+            received.append(msg)
+
+        async def on_request(_conn, msg, _fds):
+            return msg, []
+
+        client = Connection(1, PacketTransport, on_request, on_notification, codec=NativeCodec())
+        server = Connection(2, PacketTransport, on_request, on_notification, codec=NativeCodec(), pool=pool)
+        async with trio.open_nursery() as nursery:
+            await nursery.start(client.attach, a, b'')
+            await nursery.start(server.attach, b, b'')
+            for i in range(5):
+                # Typed arrays are decoded as views of the received buffer, binary data are copied.
+                await client.notify(array.array('i', [i] * 100) if view else bytes([i]) * 400)
+                while len(received) <= i:
+                    await trio.sleep(0.001)
+            if view:
+                assert pool.retained == 5
+                assert pool.hits == 0
+                assert [msg.tolist() for msg in received] == [[i] * 100 for i in range(5)]
+            else:
+                assert pool.retained == 0
+                assert pool.hits == 4
+                assert received == [bytes([i]) * 400 for i in range(5)]
+            client.close()
+            server.close()
+
+    trio.run(main)
@@ -0,0 +1,74 @@
+import os
+import time
+
+import pytest
+
+QtCore = pytest.importorskip('PySide2.QtCore')
+
+from ipc.codecs import NativeCodec
+from ipc.qt import QtConnection, QtPacketTransport
+from ipc.types import Fd
+
+
+@pytest.fixture
+def app():
+    return QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+def _echo(_conn, msg, fds):
+    return msg, fds
+
+
+def _run_until(condition, timeout=5.0):
+    # Socket notifiers are activated only by a running event loop.
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'Timed out.'
+        loop = QtCore.QEventLoop()
+        QtCore.QTimer.singleShot(10, loop.quit)
+        loop.exec_()
+
+
+def test_trio_server(trio_server, app):
+    responses = {}
+    failures = []
+    pushed = []
+    closed = []
+    conn = QtConnection(1, QtPacketTransport, _echo, lambda _conn, msg, _fds: pushed.append(msg),
+                        codec=NativeCodec())
+    conn.responseReceived.connect(lambda num, data, fds: responses.__setitem__(num, (data, fds)))
+    conn.requestFailed.connect(lambda _num, error: failures.append(error))
+    conn.closed.connect(closed.append)
+    conn.connect(trio_server)
+
+    def send(msg, fds=None):
+        num = conn.send(msg, fds)
+        _run_until(lambda: num in responses or failures)
+        assert not failures
+        return responses.pop(num)
+
+    assert send(['hello', 1]) == (['hello', 1], [])
+    fd = Fd(os.open(os.devnull, os.O_RDONLY))
+    try:
+        _msg, fds = send('fd', [fd])
+        assert len(fds) == 1
+        assert os.path.samestat(os.fstat(fds[0].get()), os.fstat(fd.get()))
+        fds[0].close()
+    finally:
+        fd.close()
+    # Large messages are sent in fragments.
+    large = os.urandom(1024 * 1024)
+    assert send(large) == (large, [])
+
+    for i in range(100):
+        conn.notify(i)
+    deadline = time.monotonic() + 5
+    while len(send('notifications')[0]) < 100 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(send('notifications')[0]) == list(range(100))
+    # Notifications of the server are handled before the response which follows them.
+    assert send('push') == ('push', [])
+    assert pushed == ['pushed']
+
+    conn.close()
+    assert closed == [None]
@@ -0,0 +1,104 @@
+import os
+from typing import Any, Optional
+
+import pytest
+
+from ipc.codecs import serialize, deserialize, DecoderError, EncoderError
+from ipc.schema import Schema
+from ipc.types import Fd
+
+POINT = Schema('Point', {'x': float, 'y': float})
+RECORD = Schema('Record', {
+    'flag': bool,
+    'count': int,
+    'ratio': float,
+    'name': str,
+    'payload': bytes,
+    'note': Optional[str],
+    'point': POINT,
+    'anything': Any,
+})
+
+
+def test_round_trip():
+    msg = RECORD.type(True, 2 ** 40, 0.5, 'ž' * 10, b'\x00\xff', 'note', POINT.type(1.0, -2.5), [1, {'a': None}])
+    data, fds = RECORD.encode(msg)
+    assert RECORD.decode(data, fds) == msg
+    # Messages are arrays of NativeCodec.
+    assert deserialize(data, fds) == [True, 2 ** 40, 0.5, 'ž' * 10, b'\x00\xff', 'note', [1.0, -2.5],
+                                      [1, {'a': None}]]
+    assert RECORD.decode(*serialize(list(msg), 1)) == msg
+
+
+def test_round_trip_optional():
+    msg = RECORD.type(False, 0, 0.0, '', b'', None, POINT.type(0.0, 0.0), None)
+    assert RECORD.decode(*RECORD.encode(msg)) == msg
+
+
+def test_round_trip_fds():
+    schema = Schema('File', {'fd': Fd, 'spare': Optional[Fd]})
+    fd = Fd(os.open(os.devnull, os.O_RDONLY))
+    try:
+        data, fds = schema.encode((fd, None))
+        assert fds == [fd]
+        decoded = schema.decode(data, fds)
+        assert decoded.fd.get() == fd.get() and decoded.spare is None
+    finally:
+        fd.close()
+
+
+def test_empty_schema():
+    empty = Schema('Empty', {})
+    data, fds = empty.encode(())
+    assert empty.decode(data, fds) == empty.type()
+    assert deserialize(data, fds) == []
+    with pytest.raises(EncoderError):
+        empty.encode((1,))
+
+
+def test_nested_empty_schema():
+    empty = Schema('Empty', {})
+    outer = Schema('Outer', {'empty': empty, 'value': int})
+    data, fds = outer.encode(((), 3))
+    assert outer.decode(data, fds) == outer.type(empty.type(), 3)
+
+
+@pytest.mark.parametrize('msg', [
+    (1.0,),
+    (1.0, 2.0, 3.0),
+    ('1', 2.0),
+    (None, 2.0),
+    42,
+])
+def test_encode_mismatch(msg):
+    with pytest.raises(EncoderError):
+        POINT.encode(msg)
+
+
+@pytest.mark.parametrize('value', [
+    [1.0],
+    [1.0, 2.0, 3.0],
+    ['1', 2.0],
+    [1, 2.0],
+    {'x': 1.0, 'y': 2.0},
+])
+def test_decode_mismatch(value):
+    with pytest.raises(DecoderError):
+        POINT.decode(*serialize(value, 1))
+
+
+def test_decode_other_schema():
+    data, fds = Schema('Pair', {'key': str, 'value': int}).encode(('key', 1))
+    with pytest.raises(DecoderError):
+        POINT.decode(data, fds)
+
+
+def test_decode_truncated():
+    data, fds = RECORD.encode((True, 1, 0.5, 'name', b'', None, (1.0, 2.0), None))
+    with pytest.raises(DecoderError):
+        RECORD.decode(data[:-1], fds)
+
+
+def test_unsupported_type():
+    with pytest.raises(TypeError):
+        Schema('Unsupported', {'value': complex})
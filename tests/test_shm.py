@@ -0,0 +1,191 @@
+import os
+from socket import AF_UNIX, SOCK_SEQPACKET
+
+import pytest
+import trio
+import trio.socket
+
+from ipc.shm import ShmTransport, _BODY, _OUT_OF_BAND, _RECORD
+from ipc.transport import Message, NoDataError, WriteError
+from ipc.types import Fd
+
+
+def _pair(**kwargs):
+    a, b = trio.socket.socketpair(AF_UNIX, SOCK_SEQPACKET)
+    return a, b, ShmTransport(a, **kwargs), ShmTransport(b, **kwargs)
+
+
+def test_round_trip():
+    async def main():
+        a, b, writer, reader = _pair(ring_size=64 * 1024)
+        with a, b:
+            fd = Fd(os.open(os.devnull, os.O_RDONLY))
+            # Messages larger than a quarter of the ring are sent over the socket.
+            large = os.urandom(writer.ring_size // 2)
+            messages = [
+                Message(1, 2, b'inline', []),
+                Message(3, 4, [b'seg', b'ments'], []),
+                Message(5, 6, b'with fd', [fd]),
+                Message(7, 8, large, []),
+                Message(9, 0, b'', []),
+            ]
+            for msg in messages:
+                await writer.write(msg)
+            for msg in messages:
+                received = await reader.read()
+                data = b''.join(msg.data) if isinstance(msg.data, list) else msg.data
+                assert (received.num, received.flags, bytes(received.data)) == (msg.num, msg.flags, data)
+                assert len(received.fds) == len(msg.fds)
+
+    trio.run(main)
+
+
+def test_wrap_around():
+    async def main():
+        # Messages do not fit in the small ring at once, so the writer waits for free space.
+        a, b, writer, reader = _pair(ring_size=4096)
+        with a, b:
+            messages = [os.urandom(i * 7 % 1000) for i in range(200)]
+
+            async def write():
+                for i, data in enumerate(messages):
+                    await writer.write(Message(i, 0, data, []))
+
+            received = []
+            with trio.fail_after(10):
+                async with trio.open_nursery() as nursery:
+                    nursery.start_soon(write)
+                    for _i in messages:
+                        received.append(bytes((await reader.read()).data))
+            assert received == messages
+
+    trio.run(main)
+
+
+@pytest.mark.parametrize('fds', [False, True])
+def test_reader_wakeup(fds):
+    async def main():
+        a, b, writer, reader = _pair()
+        with a, b:
+            # The ring buffer is set up, so that the reader then sleeps waiting for data.
+            await writer.write(Message(0, 0, b'setup', []))
+            await reader.read()
+            fd = [Fd(os.open(os.devnull, os.O_RDONLY))] if fds else []
+
+            async def write_later():
+                await trio.sleep(0.05)
+                await writer.write(Message(1, 0, b'late', fd))
+
+            with trio.fail_after(1):
+                async with trio.open_nursery() as nursery:
+                    nursery.start_soon(write_later)
+                    msg = await reader.read()
+            assert (msg.num, bytes(msg.data), len(msg.fds)) == (1, b'late', len(fd))
+
+    trio.run(main)
+
+
+def test_body_before_record():
+    async def main():
+        a, b, writer, reader = _pair()
+        with a, b:
+            await writer.write(Message(0, 0, b'setup', []))
+            await reader.read()
+
+            # The body of an out-of-band message is received while the reader waits for its record.
+            await writer._packets.write(Message(_BODY, 0, b'body', []))
+            with trio.move_on_after(0.05) as scope:
+                await reader.read()
+            assert scope.cancelled_caught
+            writer._tx.write(_RECORD.pack(1, 2, 0, _OUT_OF_BAND))
+            writer._tx.produce(_RECORD.size)
+            await writer.write(Message(3, 0, b'inline', []))
+            with trio.fail_after(1):
+                first = await reader.read()
+                second = await reader.read()
+            assert (first.num, first.flags, bytes(first.data)) == (1, 2, b'body')
+            assert (second.num, bytes(second.data)) == (3, b'inline')
+
+    trio.run(main)
+
+
+def test_cancelled_write():
+    async def main():
+        a, b, writer, reader = _pair(ring_size=4096)
+        with a, b:
+            # Both endpoints set up their ring buffers, so that bodies are sent as single records.
+            await writer.write(Message(0, 0, b'setup', []))
+            await reader.read()
+            await reader.write(Message(0, 0, b'setup', []))
+            await writer.read()
+
+            # Out-of-band messages are written until the socket is full and a write is cancelled.
+            written = 0
+            with trio.move_on_after(0.1) as scope:
+                while True:
+                    await writer.write(Message(written, 0, bytes(2000), []))
+                    written += 1
+            assert scope.cancelled_caught
+            await writer.write(Message(written, 0, b'last', []))
+
+            with trio.fail_after(1):
+                for i in range(written):
+                    msg = await reader.read()
+                    assert (msg.num, len(msg.data)) == (i, 2000)
+                msg = await reader.read()
+            assert (msg.num, bytes(msg.data)) == (written, b'last')
+
+    trio.run(main)
+
+
+def test_writer_closed():
+    async def main():
+        a, b, writer, reader = _pair(ring_size=4096)
+        with a:
+            await writer.write(Message(0, 0, b'setup', []))
+            await reader.read()
+            b.close()
+            with trio.fail_after(1):
+                with pytest.raises(WriteError):
+                    for i in range(100):
+                        await writer.write(Message(i, 0, bytes(500), []))
+
+    trio.run(main)
+
+
+def test_close():
+    async def main():
+        a, b, writer, reader = _pair()
+        with a, b:
+            await writer.write(Message(0, 0, b'setup', []))
+            await reader.read()
+            fds = [fd.get() for fd in writer._tx.fds + reader._rx.fds]
+            writer.close()
+            reader.close()
+            assert writer._tx is None and reader._rx is None
+            for fd in fds:
+                with pytest.raises(OSError):
+                    os.fstat(fd)
+
+    trio.run(main)
+
+
+def test_closed():
+    async def main():
+        a, b, writer, reader = _pair()
+        with b:
+            await writer.write(Message(0, 0, b'setup', []))
+            await reader.read()
+            a.close()
+            with trio.fail_after(1):
+                with pytest.raises(NoDataError):
+                    await reader.read()
+
+    trio.run(main)
+
+
+def test_invalid_ring_size():
+    a, b = trio.socket.socketpair(AF_UNIX, SOCK_SEQPACKET)
+    with a, b:
+        with pytest.raises(ValueError):
+            ShmTransport(a, ring_size=1000)
@@ -0,0 +1,44 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ipc.codecs import NativeCodec
+from ipc.sync import SyncClient
+from ipc.types import Fd
+
+
+def test_trio_server(trio_server):
+    pushed = []
+
+    def on_notification(_client, msg, _fds):
+        pushed.append(msg)
+
+    with SyncClient(NativeCodec(), notification_handler=on_notification) as client:
+        client.connect(trio_server)
+        assert client.send(['hello', 1]) == (['hello', 1], [])
+        fd = Fd(os.open(os.devnull, os.O_RDONLY))
+        try:
+            _msg, fds = client.send('fd', [fd])
+            assert len(fds) == 1
+            assert os.path.samestat(os.fstat(fds[0].get()), os.fstat(fd.get()))
+            fds[0].close()
+        finally:
+            fd.close()
+        # Large messages are sent in fragments once the server has advertised its framing.
+        large = os.urandom(1024 * 1024)
+        assert client.send(large) == (large, [])
+
+        # Threads share the client and take turns reading responses.
+        with ThreadPoolExecutor(8) as executor:
+            responses = list(executor.map(lambda i: client.send(i)[0], range(100)))
+        assert responses == list(range(100))
+
+        for i in range(10):
+            client.notify(i)
+        deadline = time.monotonic() + 5
+        while len(client.send('notifications')[0]) < 10 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert sorted(client.send('notifications')[0]) == list(range(10))
+        # Notifications of the server are handled while waiting for a response.
+        assert client.send('push') == ('push', [])
+        assert pushed == ['pushed']
@@ -0,0 +1,95 @@
+import errno
+import os
+
+import pytest
+import trio
+
+from ipc import transfer
+from ipc.transfer import copy_fd
+
+DATA = os.urandom(300 * 1024)
+
+
+@pytest.fixture
+def src(tmp_path):
+    path = tmp_path / 'src'
+    path.write_bytes(DATA)
+    fd = os.open(path, os.O_RDONLY)
+    yield fd
+    os.close(fd)
+
+
+@pytest.fixture
+def dst(tmp_path):
+    fd = os.open(tmp_path / 'dst', os.O_RDWR | os.O_CREAT)
+    yield fd
+    os.close(fd)
+
+
+def _read(fd):
+    return os.pread(fd, len(DATA) + 1, 0)
+
+
+def _copy(*args, **kwargs):
+    return trio.run(lambda: copy_fd(*args, **kwargs))
+
+
+@pytest.mark.parametrize('method', ['copy_file_range', 'sendfile', 'splice', 'copy'])
+def test_copy(src, dst, method):
+    result = _copy(src, dst, len(DATA) + 100, methods=[method], chunk_size=100 * 1024)
+    assert result == (len(DATA), method, result.elapsed)
+    assert _read(dst) == DATA
+    assert os.lseek(src, 0, os.SEEK_CUR) == len(DATA)
+
+
+@pytest.mark.parametrize('method', ['copy_file_range', 'splice', 'copy'])
+def test_copy_offsets(src, dst, method):
+    result = _copy(src, dst, 1000, src_offset=100, dst_offset=10, methods=[method])
+    assert result.size == 1000
+    assert _read(dst) == bytes(10) + DATA[100:1100]
+    # Explicit offsets do not move the current positions.
+    assert os.lseek(src, 0, os.SEEK_CUR) == 0
+    assert os.lseek(dst, 0, os.SEEK_CUR) == 0
+
+
+def test_fallback(src, tmp_path):
+    # splice cannot write to files opened with O_APPEND after it has moved data to its pipe.
+    dst = os.open(tmp_path / 'dst', os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+    try:
+        result = _copy(src, dst, len(DATA), methods=['splice', 'copy'], chunk_size=100 * 1024)
+        assert result.size == len(DATA)
+        assert result.method == 'copy'
+        with open(tmp_path / 'dst', 'rb') as f:
+            assert f.read() == DATA
+    finally:
+        os.close(dst)
+
+
+def test_fallback_rewind(src, dst, monkeypatch):
+    # If data stuck in the pipe cannot be written, the source is rewound to read them again.
+    splice, write = os.splice, os.write
+    failures = {'splice': 1, 'write': 1}
+
+    def failing_splice(src_fd, dst_fd, count, **kwargs):
+        if dst_fd == dst and failures['splice']:
+            failures['splice'] -= 1
+            raise OSError(errno.EINVAL, 'splice')
+        return splice(src_fd, dst_fd, count, **kwargs)
+
+    def failing_write(fd, data):
+        if fd == dst and failures['write']:
+            failures['write'] -= 1
+            raise OSError(errno.EINVAL, 'write')
+        return write(fd, data)
+
+    monkeypatch.setattr(transfer.os, 'splice', failing_splice)
+    monkeypatch.setattr(transfer.os, 'write', failing_write)
+    result = _copy(src, dst, len(DATA), methods=['splice', 'copy'], chunk_size=100 * 1024)
+    assert result.size == len(DATA)
+    assert result.method == 'copy'
+    assert _read(dst) == DATA
+
+
+def test_unknown_method(src, dst):
+    with pytest.raises(ValueError):
+        _copy(src, dst, 1, methods=['rsync'])
@@ -0,0 +1,314 @@
+import os
+import struct
+from socket import AF_UNIX, SOCK_SEQPACKET
+
+import pytest
+import trio
+import trio.socket
+import trio.testing
+
+from ipc.connection import Connection, Flags
+from ipc.framing import MAX_FDS, pack_batch, unpack_batch
+from ipc.pool import BufferPool
+from ipc.transport import PacketTransport, Message, WrongDataError
+from ipc.types import Fd
+from ipc.utils import Result
+
+HEADER = struct.Struct('=IIII')
+FRAMING_HEADER = struct.Struct('=IIIII')
+
+
+def _socketpair():
+    return trio.socket.socketpair(AF_UNIX, SOCK_SEQPACKET)
+
+
+async def _negotiate(a: PacketTransport, b: PacketTransport) -> None:
+    # Each endpoint learns from the first message of the other one that it reads single-record messages.
+    await a.write(Message(0, 0, b'', []))
+    (await b.read()).release()
+    await b.write(Message(0, 0, b'', []))
+    (await a.read()).release()
+    assert a.single_record and b.single_record
+
+
+def test_two_records_before_negotiation():
+    async def main():
+        a, b = _socketpair()
+        with a, b:
+            writer, reader = PacketTransport(a), PacketTransport(b)
+            await writer.write(Message(7, 3, b'body', []))
+            header = await b.recv(1024)
+            assert HEADER.unpack_from(header) == (7, 3, 4, 0)
+            assert len(header) == FRAMING_HEADER.size
+            assert await b.recv(1024) == b'body'
+
+            await writer.write(Message(8, 0, [b'seg', b'ments'], []))
+            msg = await reader.read()
+            assert (msg.num, msg.flags, bytes(msg.data), msg.fds) == (8, 0, b'segments', [])
+            assert reader.single_record
+
+    trio.run(main)
+
+
+def test_legacy_header():
+    async def main():
+        a, b = _socketpair()
+        with a, b:
+            # Older implementations send a header without a framing word.
+            await a.send(HEADER.pack(1, 2, 5, 0))
+            await a.send(b'hello')
+            reader = PacketTransport(b)
+            msg = await reader.read()
+            assert (msg.num, msg.flags, bytes(msg.data)) == (1, 2, b'hello')
+            assert not reader.single_record
+
+    trio.run(main)
+
+
+def test_single_record():
+    async def main():
+        a, b = _socketpair()
+        with a, b:
+            writer, reader = PacketTransport(a), PacketTransport(b)
+            await _negotiate(writer, reader)
+            await writer.write(Message(5, 1, [b'single ', b'record'], []))
+            record = await b.recv(1024)
+            assert FRAMING_HEADER.unpack_from(record) == (5, 1, 13, 0, 2)
+            assert record[FRAMING_HEADER.size:] == b'single record'
+
+            fd = Fd(os.open(os.devnull, os.O_RDONLY))
+            await writer.write(Message(6, 0, b'with fd', [fd]))
+            msg = await reader.read()
+            assert (msg.num, bytes(msg.data), len(msg.fds)) == (6, b'with fd', 1)
+            assert os.path.samestat(os.fstat(msg.fds[0].get()), os.fstat(fd.get()))
+
+    trio.run(main)
+
+
+def test_single_record_pool():
+    async def main():
+        a, b = _socketpair()
+        with a, b:
+            writer, reader = PacketTransport(a), PacketTransport(b)
+            reader.pool = pool = BufferPool()
+            await _negotiate(writer, reader)
+            for i in range(3):
+                await writer.write(Message(i, 0, bytes([i]) * 1000, []))
+                with await reader.read() as msg:
+                    assert msg.buffer is not None
+                    assert msg.data == bytes([i]) * 1000
+            assert pool.hits >= 2
+
+    trio.run(main)
+
+
+@pytest.mark.parametrize('pool', [None, BufferPool()])
+def test_fragments(pool):
+    async def main():
+        a, b = _socketpair()
+        with a, b:
+            writer, reader = PacketTransport(a), PacketTransport(b)
+            reader.pool = pool
+            await _negotiate(writer, reader)
+            writer.fragment_size = 4096
+            large = os.urandom(100000)
+            fd = Fd(os.open(os.devnull, os.O_RDONLY))
+            received = []
+
+            async def read():
+                for _i in range(3):
+                    msg = await reader.read()
+                    received.append((msg.num, bytes(msg.data), len(msg.fds)))
+                    msg.release()
+
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(read)
+                # Concurrent messages may be written between fragments of large messages.
+                nursery.start_soon(writer.write, Message(1, 0, [large[:50000], large[50000:]], [fd]))
+                nursery.start_soon(writer.write, Message(2, 0, b'small', []))
+                nursery.start_soon(writer.write, Message(3, 0, large[::-1], []))
+
+            assert sorted(received) == [(1, large, 1), (2, b'small', 0), (3, large[::-1], 0)]
+            assert not reader._pending
+
+    trio.run(main)
+
+
+def test_fragments_interleaved():
+    async def main():
+        a, b = _socketpair()
+        with a, b:
+            writer, reader = PacketTransport(a), PacketTransport(b)
+            await _negotiate(writer, reader)
+            writer.fragment_size = 1024
+            large = [os.urandom(1024 * 1024), os.urandom(1024 * 1024 + 1)]
+            received = []
+            max_pending = 0
+
+            async def read():
+                nonlocal max_pending
+                while len(received) < 5:
+                    with await reader.read() as msg:
+                        received.append((msg.num, bytes(msg.data)))
+                    max_pending = max(max_pending, len(reader._pending))
+
+            async with trio.open_nursery() as nursery:
+                # Large messages fill the send buffer, then small messages take turns with their fragments.
+                nursery.start_soon(writer.write, Message(1, 0, large[0], []))
+                nursery.start_soon(writer.write, Message(2, 0, large[1], []))
+                await trio.testing.wait_all_tasks_blocked()
+                for i in range(3, 6):
+                    nursery.start_soon(writer.write, Message(i, 0, bytes([i]) * 100, []))
+                await trio.testing.wait_all_tasks_blocked()
+                nursery.start_soon(read)
+
+            assert sorted(received[:3]) == [(i, bytes([i]) * 100) for i in range(3, 6)]
+            assert sorted(received[3:]) == [(1, large[0]), (2, large[1])]
+            assert max_pending == 2
+            assert not reader._pending
+
+    trio.run(main)
+
+
+def test_fragments_too_large():
+    async def main():
+        a, b = _socketpair()
+        with a, b:
+            writer, reader = PacketTransport(a), PacketTransport(b, max_message_size=10000)
+            await _negotiate(writer, reader)
+            writer.fragment_size = 4096
+            await writer.write(Message(1, 0, bytes(20000), []))
+            with pytest.raises(WrongDataError):
+                await reader.read()
+
+    trio.run(main)
+
+
+def test_batch_frames():
+    fd = Fd(os.open(os.devnull, os.O_RDONLY))
+    batch = [
+        (Message(1, 4, b'first', []), Result(), False),
+        (Message(2, 8, [b'sec', b'ond'], [fd]), Result(), False),
+        (Message(3, 0, b'x' * 100, []), Result(), False),
+        (Message(4, 0, b'last', []), Result(), False),
+    ]
+    frames = pack_batch(batch, 64, Flags.BATCH.value)
+    # The third message does not fit in the first frame and the last one is not wrapped in a frame.
+    assert [count for _frame, count in frames] == [2, 1, 1]
+    frame = frames[0][0]
+    assert frame.flags & Flags.BATCH.value
+    assert frame.fds == [fd]
+    assert frames[2][0] is batch[3][0]
+
+    for pool in (None, BufferPool()):
+        messages = unpack_batch(frame, pool)
+        assert [(msg.num, msg.flags, bytes(msg.data), msg.fds) for msg in messages] == [
+            (1, 4, b'first', []), (2, 8, b'second', [fd])]
+
+    with pytest.raises(WrongDataError):
+        unpack_batch(frame._replace(data=frame.data[:-1]), None)
+    with pytest.raises(WrongDataError):
+        unpack_batch(frame._replace(fds=[]), None)
+
+
+@pytest.mark.parametrize('max_size', [1, 100, 250, 10000])
+def test_batch_frames_max_size(max_size):
+    batch = [(Message(i, 0, bytes([i]) * (i * 7 % 120), []), Result(), False) for i in range(50)]
+    frames = pack_batch(batch, max_size, Flags.BATCH.value)
+    assert sum(count for _frame, count in frames) == len(batch)
+
+    messages = []
+    for frame, count in frames:
+        if count == 1:
+            messages.append(frame)
+            continue
+        unpacked = unpack_batch(frame, None)
+        assert len(unpacked) == count
+        # Bodies of a frame of several messages fit in the limit.
+        assert sum(len(msg.data) for msg in unpacked) <= max_size
+        messages += unpacked
+    assert [(msg.num, bytes(msg.data)) for msg in messages] == [(msg.num, msg.data) for msg, _r, _w in batch]
+
+
+def test_batch_frames_max_fds():
+    fds = [Fd(os.open(os.devnull, os.O_RDONLY)) for _i in range(2)]
+    try:
+        batch = [(Message(i, 0, b'fds', fds), Result(), False) for i in range(MAX_FDS)]
+        frames = pack_batch(batch, 1024 * 1024, Flags.BATCH.value)
+        # A frame carries at most MAX_FDS file descriptors.
+        assert [count for _frame, count in frames] == [MAX_FDS // 2, MAX_FDS // 2, 1]
+        assert [len(frame.fds) for frame, _count in frames] == [MAX_FDS - 1, MAX_FDS - 1, 2]
+        unpacked = unpack_batch(frames[0][0], None)
+        assert all(msg.fds == fds for msg in unpacked)
+    finally:
+        for fd in fds:
+            fd.close()
+
+
+def test_batched_connection():
+    async def main():
+        a, b = _socketpair()
+        received = []
+
+        async def on_notification(_conn, data, _fds):
+            received.append(bytes(data))
+
+        async def on_request(_conn, data, _fds):
+            return bytes(data).upper(), []
+
+        client = Connection(1, PacketTransport, on_request, on_notification)
+        server = Connection(2, PacketTransport, on_request, on_notification)
+        async with trio.open_nursery() as nursery:
+            await nursery.start(client.attach, a, b'')
+            await nursery.start(server.attach, b, b'')
+            # The first response advertises that the server accepts batch frames.
+            assert await client.send(b'hello') == (b'HELLO', [])
+            async with trio.open_nursery() as senders:
+                for i in range(100):
+                    senders.start_soon(client.notify, f'message {i}'.encode())
+            while len(received) < 100:
+                await trio.sleep(0.01)
+            assert sorted(received) == sorted(f'message {i}'.encode() for i in range(100))
+            assert client.stats.messages_out == 101
+            assert client.stats.frames_out < 101
+            client.close()
+            server.close()
+
+    trio.run(main)
+
+
+@pytest.mark.parametrize('max_batch_size', [0, 256])
+def test_batched_connection_max_batch_size(max_batch_size):
+    async def main():
+        a, b = _socketpair()
+        received = []
+
+        async def on_notification(_conn, data, _fds):
+            received.append(bytes(data))
+
+        async def on_request(_conn, data, _fds):
+            return bytes(data), []
+
+        client = Connection(1, PacketTransport, on_request, on_notification, max_batch_size=max_batch_size)
+        server = Connection(2, PacketTransport, on_request, on_notification)
+        async with trio.open_nursery() as nursery:
+            await nursery.start(client.attach, a, b'')
+            await nursery.start(server.attach, b, b'')
+            await client.send(b'hello')
+            messages = [bytes([i]) * 100 for i in range(100)]
+            async with trio.open_nursery() as senders:
+                for msg in messages:
+                    senders.start_soon(client.notify, msg)
+            while len(received) < 100:
+                await trio.sleep(0.01)
+            assert sorted(received) == sorted(messages)
+            if max_batch_size:
+                # Frames carry at most two bodies of 100 bytes.
+                assert 51 <= client.stats.frames_out < 101
+            else:
+                assert client.stats.frames_out == 101
+            assert server.stats.messages_in == 101
+            client.close()
+            server.close()
+
+    trio.run(main)